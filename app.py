@@ -1,18 +1,90 @@
 import os
 import atexit
-from flask import Flask, Response, render_template, send_from_directory, request, jsonify
-from src.camera_capture import CameraCaptureSystem
+from flask import Flask, Response, render_template, send_file, request, jsonify
+from src.assets import AssetPipeline
+from src.camera_capture import DEFAULT_PREVIEW_TIER, CameraCaptureSystem
+from src.clip_worker import use_as_spawn_main
+from src.derivatives import DerivativeError, PhotoNotFound
+from src.jobs import JobQueueFull, sse_format
+from src.metrics import METRICS
+from src.startup import STARTUP, health_report
+from src.sync import MANIFEST_PAGE, GalleryAggregator
+from src.uploads import HttpUploader, guess_mime_type
 import threading
 import time
 import json
 import signal
 import sys
 
+STARTUP.mark('imported')
+
 # Get the absolute path of the current directory
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-CAPTURES_DIR = os.path.join(BASE_DIR, 'captures')
+CAPTURES_DIR = os.environ.get('PHOTOBOOTH_CAPTURES_DIR', os.path.join(BASE_DIR, 'captures'))
+CACHE_DIR = os.environ.get('PHOTOBOOTH_CACHE_DIR', os.path.join(BASE_DIR, 'cache'))
+PORT = int(os.environ.get('PHOTOBOOTH_PORT', '80'))
+# 'flask' for the threaded development server, 'asgi' for the async mode in src/asgi_app.py
+SERVER_MODE = os.environ.get('PHOTOBOOTH_SERVER', 'flask')
+# Captures never change once written, so browsers may keep them for a year
+PHOTO_MAX_AGE = 365 * 24 * 3600
+# Upload to a plain HTTP endpoint (e.g. benchmarks/upload_standin.py) instead of Google Drive
+UPLOAD_URL = os.environ.get('PHOTOBOOTH_UPLOAD_URL')
+UPLOAD_WORKERS = int(os.environ.get('PHOTOBOOTH_UPLOAD_WORKERS', '2'))
+# 'pi' for the real camera and LEDs, 'sim' to run anywhere with simulated hardware
+HARDWARE = os.environ.get('PHOTOBOOTH_HARDWARE', 'pi')
+# Optional JSON-lines file receiving one stage-timing record per capture
+TRACE_PATH = os.environ.get('PHOTOBOOTH_TRACE_FILE')
+# 'array' grabs stills from the running video stream, 'jpeg' uses the older stop-and-capture path
+CAPTURE_MODE = os.environ.get('PHOTOBOOTH_CAPTURE_MODE', 'array')
+JPEG_QUALITY = int(os.environ.get('PHOTOBOOTH_JPEG_QUALITY', '90'))
+# Comma-separated layouts from src/collage.py composed after each three-shot session ('' disables)
+COLLAGE_LAYOUTS = [l for l in os.environ.get('PHOTOBOOTH_COLLAGE_LAYOUTS', 'strip').split(',') if l]
+# Capture jobs allowed to wait behind the running one, and what to do with more: 'coalesce' or 'reject'
+JOB_QUEUE_SIZE = int(os.environ.get('PHOTOBOOTH_JOB_QUEUE_SIZE', '2'))
+JOB_QUEUE_POLICY = os.environ.get('PHOTOBOOTH_JOB_QUEUE_POLICY', 'coalesce')
+# Seconds between keepalive comments on an idle /jobs/<id>/events stream
+SSE_KEEPALIVE = 15
+# Captures are filed under CAPTURES_DIR/<event>/<date>/; see src/storage.py
+EVENT_NAME = os.environ.get('PHOTOBOOTH_EVENT', 'default')
+ARCHIVE_DIR = os.environ.get('PHOTOBOOTH_ARCHIVE_DIR')
+# Local captures kept before old, fully uploaded shards are archived (unset keeps everything)
+RETENTION_GB = os.environ.get('PHOTOBOOTH_RETENTION_GB')
+# WIDTHxHEIGHT of the lores stream the preview is encoded from ('' encodes the full-resolution stream)
+PREVIEW_SIZE = os.environ.get('PHOTOBOOTH_PREVIEW_SIZE', '544x680')
+PREVIEW_FPS = float(os.environ.get('PHOTOBOOTH_PREVIEW_FPS', '15'))
+PREVIEW_QUALITY = int(os.environ.get('PHOTOBOOTH_PREVIEW_QUALITY', '75'))
+# Upload bandwidth caps in KiB/s: while idle (unset for none) and during captures or remote viewing
+UPLOAD_RATE_KB = os.environ.get('PHOTOBOOTH_UPLOAD_RATE_KB')
+UPLOAD_BUSY_RATE_KB = os.environ.get('PHOTOBOOTH_UPLOAD_BUSY_RATE_KB', '128')
+UPLOAD_CHUNK_KB = int(os.environ.get('PHOTOBOOTH_UPLOAD_CHUNK_KB', '256'))
+# Width of a resized copy uploaded ahead of each original (unset uploads originals only)
+UPLOAD_RESIZED_FIRST = os.environ.get('PHOTOBOOTH_UPLOAD_RESIZED_FIRST')
+# '1' records captures already on disk as uploaded when the upload journal is first created
+UPLOAD_ASSUME_EXISTING = os.environ.get('PHOTOBOOTH_UPLOAD_ASSUME_EXISTING', '0') == '1'
+# Main-stream frames kept for the shutter to pick from in array mode (0 takes the next frame instead)
+PREROLL_FRAMES = int(os.environ.get('PHOTOBOOTH_PREROLL_FRAMES', '6'))
+# Take the sharpest frame within this many ms of the shutter rather than the nearest one
+PREROLL_WINDOW_MS = float(os.environ.get('PHOTOBOOTH_PREROLL_WINDOW_MS', '0'))
+# Clip jobs: 'webp', 'gif' or 'mp4' (needs ffmpeg), recorded for this many seconds at this frame rate
+CLIP_FORMAT = os.environ.get('PHOTOBOOTH_CLIP_FORMAT', 'webp')
+CLIP_SECONDS = float(os.environ.get('PHOTOBOOTH_CLIP_SECONDS', '2'))
+CLIP_FPS = float(os.environ.get('PHOTOBOOTH_CLIP_FPS', '8'))
+# Serve fingerprinted, precompressed static assets built into CACHE_DIR/assets ('0' serves static/ as-is)
+ASSET_PIPELINE = os.environ.get('PHOTOBOOTH_ASSET_PIPELINE', '1') != '0'
+# This booth's name in /sync/manifest (defaults to the hostname)
+BOOTH_ID = os.environ.get('PHOTOBOOTH_BOOTH_ID')
+# Comma-separated booth URLs: run as a gallery aggregator of those booths instead of a booth
+SYNC_BOOTHS = [u for u in os.environ.get('PHOTOBOOTH_SYNC_BOOTHS', '').split(',') if u]
+SYNC_TRANSFERS = int(os.environ.get('PHOTOBOOTH_SYNC_TRANSFERS', '4'))
+# Longest a /sync/manifest request waits for a new capture
+SYNC_MAX_WAIT = 30
+# Routes that need a camera, answered with 404 by an aggregator
+CAMERA_ENDPOINTS = {'video_feed', 'video_feed_stats', 'capture', 'capture_3', 'create_job', 'get_job', 'job_events',
+                    'sync_manifest'}
 
-app = Flask(__name__, template_folder='templates')
+app = Flask(__name__, template_folder='templates', static_folder=None)
+assets = AssetPipeline(os.path.join(BASE_DIR, 'static'), os.path.join(CACHE_DIR, 'assets'), enabled=ASSET_PIPELINE)
+app.jinja_env.globals['asset_url'] = assets.url
 camera_system = None
 camera_lock = threading.Lock()
 shutdown_event = threading.Event()
@@ -23,7 +95,6 @@ def cleanup_resources():
     with camera_lock:
         if camera_system:
             print("Shutting down camera system...")
-            camera_system.stop_mjpeg_stream()
             camera_system.cleanup()
             camera_system = None
     print("Cleanup complete")
@@ -34,36 +105,255 @@ def signal_handler(signum, frame):
     cleanup_resources()
     sys.exit(0)
 
+# Number of photos shown in the reel on the index page
+REEL_SIZE = 3
+API_PAGE_LIMIT = 200
+
+@app.before_request
+def _aggregator_has_no_camera():
+    if SYNC_BOOTHS and request.endpoint in CAMERA_ENDPOINTS:
+        return jsonify({'status': 'error', 'message': 'This node only serves the merged gallery of its booths'}), 404
+
 @app.route('/')
 def index():
-    photos = camera_system.get_all_photos() if camera_system else []
+    photos = [r.filename for r in camera_system.photo_index.latest(REEL_SIZE)] if camera_system else []
     return render_template('index.html', photos=photos)
 
+@app.route('/gallery')
+def gallery():
+    """Guest gallery that follows /feed instead of being reloaded."""
+    return render_template('gallery.html')
+
+@app.route('/api/photos')
+def api_photos():
+    if not camera_system:
+        return jsonify({'status': 'error', 'message': 'Camera system not initialized'}), 500
+    try:
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor is not None else None
+        limit = min(max(int(request.args.get('limit', 50)), 1), API_PAGE_LIMIT)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid cursor or limit'}), 400
+    records, next_cursor = camera_system.photo_index.page(cursor=cursor, limit=limit)
+    return jsonify({
+        'photos': [r.as_dict() for r in records],
+        'next_cursor': next_cursor,
+        'total': len(camera_system.photo_index),
+    })
+
+def _starting():
+    response = jsonify(health_report(camera_system is not None))
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: 200 unless a subsystem failed to start, with every subsystem's state."""
+    report = health_report(camera_system is not None)
+    return jsonify(report), 503 if report['status'] == 'failed' else 200
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once the camera, LEDs, watermark and storage are all up."""
+    if camera_system is None or not STARTUP.ready:
+        return _starting()
+    return jsonify(health_report(True))
+
 @app.route('/video_feed')
 def video_feed():
-    return Response(camera_system.mjpeg_generator(),
+    if not camera_system:
+        # The kiosk page retries once /readyz says the camera is up
+        return _starting()
+    tier = request.args.get('tier', DEFAULT_PREVIEW_TIER)
+    if tier not in camera_system.preview_tiers:
+        return jsonify({'status': 'error', 'message': f"Unknown preview tier {tier!r}",
+                        'tiers': sorted(camera_system.preview_tiers)}), 400
+    return Response(camera_system.mjpeg_generator(tier, peer=request.remote_addr),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/video_feed/stats')
+def video_feed_stats():
+    if camera_system:
+        return jsonify(camera_system.stream_hub.stats())
+    return jsonify({'status': 'error', 'message': 'Camera system not initialized'}), 500
+
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+def _queue_full(error):
+    response = jsonify({'status': 'busy', 'message': str(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = '5'
+    return response
+
+def _run_job(kind):
+    """Queue a capture job and wait for it, for the blocking /capture endpoints."""
+    job, _ = camera_system.jobs.submit(kind)
+    job.finished.wait()
+    if job.state != 'done':
+        raise RuntimeError(job.error)
+    return job
+
 @app.route('/capture', methods=['POST'])
 def capture():
     if camera_system:
-        filename = camera_system.capture_image()
-        return jsonify({'status': 'success', 'filename': os.path.basename(filename)})
+        try:
+            job = _run_job('photo')
+        except JobQueueFull as e:
+            return _queue_full(e)
+        return jsonify({'status': 'success', 'filename': os.path.basename(job.filenames[0])})
     return jsonify({'status': 'error', 'message': 'Camera system not initialized'}), 500
 
 @app.route('/capture_3', methods=['POST'])
 def capture_3():
     if camera_system:
-        filenames = camera_system.capture_image_3()
+        try:
+            job = _run_job('burst')
+        except JobQueueFull as e:
+            return _queue_full(e)
         return jsonify({
             'status': 'success', 
-            'filenames': [os.path.basename(f) for f in filenames]
+            'filenames': [os.path.basename(f) for f in job.filenames],
+            'collages': [os.path.basename(f) for f in job.collages]
         })
     return jsonify({'status': 'error', 'message': 'Camera system not initialized'}), 500
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a capture without waiting for it; follow it on /jobs/<id>/events."""
+    if not camera_system:
+        return jsonify({'status': 'error', 'message': 'Camera system not initialized'}), 500
+    body = request.get_json(silent=True) or {}
+    kind = body.get('kind') or request.args.get('kind', 'burst')
+    try:
+        job, coalesced = camera_system.jobs.submit(kind)
+    except JobQueueFull as e:
+        return _queue_full(e)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify(dict(job.as_dict(), coalesced=coalesced)), 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = camera_system.jobs.get(job_id) if camera_system else None
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    return jsonify(job.as_dict())
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = camera_system.jobs.get(job_id) if camera_system else None
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+    except ValueError:
+        last_id = 0
+
+    def stream(last_id):
+        while True:
+            events, closed = job.events_since(last_id, timeout=SSE_KEEPALIVE)
+            for event in events:
+                last_id = event['id']
+                yield sse_format(event)
+            if closed:
+                return
+            if not events:
+                yield ': keepalive\n\n'
+
+    return Response(stream(last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/feed')
+def feed():
+    """Server-sent ``photo`` events as captures are written; ``since`` (or Last-Event-ID) catches up."""
+    if not camera_system:
+        return _starting()
+    try:
+        since = request.headers.get('Last-Event-ID') or request.args.get('since')
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid since'}), 400
+    subscription = camera_system.feed.subscribe(since)
+
+    def stream():
+        try:
+            # Tells the browser to retry quickly if the connection drops
+            yield 'retry: 2000\n\n'
+            while True:
+                events = subscription.next(timeout=SSE_KEEPALIVE)
+                if events:
+                    yield ''.join(events)
+                else:
+                    yield ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/sync/manifest')
+def sync_manifest():
+    """This booth's captures after version ``since`` of ``epoch``; ``wait`` long-polls for the next one."""
+    if not camera_system:
+        return _starting()
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(max(int(request.args.get('limit', MANIFEST_PAGE)), 1), MANIFEST_PAGE)
+        wait = min(max(float(request.args.get('wait', 0)), 0), SYNC_MAX_WAIT)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid since, limit or wait'}), 400
+    return jsonify(camera_system.manifest.changes(request.args.get('epoch'), since, limit, wait))
+
+@app.route('/sync/status')
+def sync_status():
+    """Per-booth progress, lag and throughput of an aggregator."""
+    if not SYNC_BOOTHS:
+        return jsonify({'status': 'error', 'message': 'Not an aggregator; set PHOTOBOOTH_SYNC_BOOTHS'}), 404
+    if not camera_system:
+        return _starting()
+    return jsonify(camera_system.stats())
+
+@app.route('/static/<path:filename>')
+def serve_static(filename):
+    asset = assets.resolve(filename, request.headers.get('Accept-Encoding', ''))
+    if asset is None:
+        return jsonify({'status': 'error', 'message': f"No such asset: {filename}"}), 404
+    response = send_file(asset.path, mimetype=asset.mimetype, etag=asset.etag, conditional=True, max_age=None)
+    response.headers.update(asset.headers)
+    return response
+
 @app.route('/captures/<path:filename>')
 def serve_photo(filename):
-    return send_from_directory(CAPTURES_DIR, filename)
+    if not camera_system:
+        return _starting()
+    # Photos from a capture that just returned may still be in post-processing
+    if not camera_system.wait_for_photo(filename, timeout=3.0):
+        response = jsonify({'status': 'pending', 'filename': filename})
+        response.status_code = 202
+        response.headers['Retry-After'] = '1'
+        return response
+
+    width = request.args.get('w')
+    fmt = request.args.get('fmt')
+    if width or fmt:
+        try:
+            path, etag, mimetype = camera_system.derivatives.get(filename, width, fmt)
+        except PhotoNotFound as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 404
+        except DerivativeError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        response = send_file(path, mimetype=mimetype, etag=etag, max_age=PHOTO_MAX_AGE, conditional=True)
+    else:
+        path = camera_system.storage.resolve(filename)
+        if path is None:
+            return jsonify({'status': 'error', 'message': f"No such photo: {filename}"}), 404
+        response = send_file(path, mimetype=guess_mime_type(path), max_age=PHOTO_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 
@@ -75,9 +365,49 @@ def initialize_camera_system():
     while retry_count < max_retries and not shutdown_event.is_set():
         try:
             with camera_lock:
+                if not camera_system and SYNC_BOOTHS:
+                    print(f"Initializing gallery aggregator for {', '.join(SYNC_BOOTHS)}...")
+                    camera_system = GalleryAggregator(
+                        SYNC_BOOTHS,
+                        CAPTURES_DIR,
+                        cache_dir=CACHE_DIR,
+                        event=EVENT_NAME,
+                        transfers=SYNC_TRANSFERS
+                    )
+                    camera_system.run()
+                    return True
                 if not camera_system:
                     print("Initializing camera system...")
-                    camera_system = CameraCaptureSystem(capture_dir=CAPTURES_DIR)
+                    camera_system = CameraCaptureSystem(
+                        capture_dir=CAPTURES_DIR,
+                        cache_dir=CACHE_DIR,
+                        uploader=HttpUploader(UPLOAD_URL) if UPLOAD_URL else None,
+                        upload_workers=UPLOAD_WORKERS,
+                        hardware=HARDWARE,
+                        trace_path=TRACE_PATH,
+                        capture_mode=CAPTURE_MODE,
+                        jpeg_quality=JPEG_QUALITY,
+                        collage_layouts=COLLAGE_LAYOUTS,
+                        job_queue_size=JOB_QUEUE_SIZE,
+                        job_queue_policy=JOB_QUEUE_POLICY,
+                        event=EVENT_NAME,
+                        archive_dir=ARCHIVE_DIR,
+                        retention_bytes=int(float(RETENTION_GB) * 1e9) if RETENTION_GB else None,
+                        preview_size=tuple(int(v) for v in PREVIEW_SIZE.split('x')) if PREVIEW_SIZE else None,
+                        preview_fps=PREVIEW_FPS,
+                        preview_quality=PREVIEW_QUALITY,
+                        upload_rate=float(UPLOAD_RATE_KB) * 1024 if UPLOAD_RATE_KB else None,
+                        upload_busy_rate=float(UPLOAD_BUSY_RATE_KB) * 1024 if UPLOAD_BUSY_RATE_KB else None,
+                        upload_chunk_size=UPLOAD_CHUNK_KB * 1024,
+                        upload_resized_width=int(UPLOAD_RESIZED_FIRST) if UPLOAD_RESIZED_FIRST else None,
+                        upload_assume_existing=UPLOAD_ASSUME_EXISTING,
+                        preroll_frames=PREROLL_FRAMES,
+                        preroll_window=PREROLL_WINDOW_MS / 1000,
+                        clip_format=CLIP_FORMAT,
+                        clip_seconds=CLIP_SECONDS,
+                        clip_fps=CLIP_FPS,
+                        booth_id=BOOTH_ID
+                    )
                     camera_system.run()
                     print("Camera system initialized successfully")
                     return True
@@ -95,6 +425,9 @@ def start_camera_thread():
     return camera_thread
 
 if __name__ == '__main__':
+    # Spawned clip workers start from src/clip_worker.py rather than re-running this file
+    use_as_spawn_main()
+
     # Ensure the captures directory exists
     os.makedirs(CAPTURES_DIR, exist_ok=True)
 
@@ -105,14 +438,27 @@ if __name__ == '__main__':
     # Register cleanup function
     atexit.register(cleanup_resources)
 
-    # Start camera initialization
+    # Quick when static/ is unchanged since the last build
+    with STARTUP.phase('assets'):
+        assets.build()
+
+    # Start camera initialization; the server answers /readyz with 503 until it is done
     camera_thread = start_camera_thread()
-    time.sleep(2)  # Give the camera system time to initialize
+    STARTUP.mark('serving')
 
     try:
-        app.run(host='0.0.0.0', port=80, debug=True, use_reloader=False)
+        if SERVER_MODE == 'asgi':
+            from src.asgi_app import create_asgi_app, serve
+
+            serve(create_asgi_app(lambda: camera_system, BASE_DIR,
+                                  reel_size=REEL_SIZE, api_page_limit=API_PAGE_LIMIT,
+                                  photo_max_age=PHOTO_MAX_AGE, sse_keepalive=SSE_KEEPALIVE,
+                                  assets=assets, aggregator=bool(SYNC_BOOTHS),
+                                  sync_max_wait=SYNC_MAX_WAIT), port=PORT)
+        else:
+            app.run(host='0.0.0.0', port=PORT, debug=True, use_reloader=False)
     except Exception as e:
-        print(f"Error running Flask app: {e}")
+        print(f"Error running {SERVER_MODE} app: {e}")
     finally:
         shutdown_event.set()
         cleanup_resources()
\ No newline at end of file
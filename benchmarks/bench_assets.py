@@ -0,0 +1,137 @@
+"""
+Bytes and requests to load the kiosk page, with and without the asset pipeline.
+
+A small browser model loads ``/`` through the Flask test client: it follows
+``/static/...`` references in the page, its stylesheets and its scripts, plus
+the countdown images the script builds at runtime, and keeps an HTTP cache that
+honours ``Cache-Control``. Reported per mode:
+
+    first    empty cache: requests and bytes on the wire
+    repeat   same browser reloads: requests still made (revalidations answered
+             304, immutable assets not requested at all) and bytes received
+
+Modes are ``plain`` (``static/`` as-is, the old behaviour) and ``pipeline``
+(fingerprinted, precompressed and optimized assets). Byte counts are response
+bodies plus status line and headers.
+
+    python benchmarks/bench_assets.py [--accept-encoding "gzip, br"] [--output results.json]
+"""
+import argparse
+import gzip
+import os
+import re
+import tempfile
+import time
+
+from common import BASE_DIR, write_results
+
+REFERENCE = re.compile(r'''/static/[^'"`()\s?#]+\.\w+''')
+# Built by main.js at runtime from CONFIG.countdown.imageBasePath
+DYNAMIC_URLS = ('/static/img/1.png', '/static/img/2.png', '/static/img/3.png')
+
+
+def _wire_bytes(response):
+    head = f"HTTP/1.1 {response.status}\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in response.headers.items())
+    return len(head) + 2 + len(response.data)
+
+
+class Browser:
+    """Fetches a page and its assets with a Cache-Control-aware cache."""
+
+    def __init__(self, client, accept_encoding):
+        self.client = client
+        self.accept_encoding = accept_encoding
+        self.cache = {}
+
+    def get(self, url, stats):
+        cached = self.cache.get(url)
+        if cached and cached['immutable']:
+            stats['from_cache'] += 1
+            return cached['body']
+        headers = {'Accept-Encoding': self.accept_encoding}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        response = self.client.get(url, headers=headers)
+        stats['requests'] += 1
+        stats['bytes'] += _wire_bytes(response)
+        if response.status_code == 304:
+            stats['not_modified'] += 1
+            return cached['body']
+        body = response.data
+        if response.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        cache_control = response.headers.get('Cache-Control', '')
+        if 'no-store' not in cache_control:
+            self.cache[url] = {
+                'immutable': 'immutable' in cache_control,
+                'etag': response.headers.get('ETag'),
+                'body': body,
+            }
+        return body
+
+    def load(self):
+        stats = {'requests': 0, 'bytes': 0, 'not_modified': 0, 'from_cache': 0}
+        start = time.perf_counter()
+        pending = [('/', True)] + [(url, False) for url in DYNAMIC_URLS]
+        seen = set()
+        while pending:
+            url, parse = pending.pop(0)
+            if url in seen:
+                continue
+            seen.add(url)
+            body = self.get(url, stats)
+            if parse or url.endswith(('.css', '.js')):
+                pending.extend((ref, False) for ref in REFERENCE.findall(body.decode('utf-8', 'replace')))
+        stats['urls'] = len(seen)
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+
+def run_mode(enabled, accept_encoding):
+    from flask import Flask, render_template, request, send_file
+    from src.assets import AssetPipeline
+
+    with tempfile.TemporaryDirectory() as directory:
+        assets = AssetPipeline(os.path.join(BASE_DIR, 'static'), os.path.join(directory, 'assets'), enabled=enabled)
+        build = assets.build()
+        # Same routes as app.py, without the camera system behind the page
+        app = Flask(__name__, template_folder=os.path.join(BASE_DIR, 'templates'), static_folder=None)
+        app.jinja_env.globals['asset_url'] = assets.url
+
+        @app.route('/')
+        def index():
+            return render_template('index.html', photos=[])
+
+        @app.route('/static/<path:filename>')
+        def serve_static(filename):
+            asset = assets.resolve(filename, request.headers.get('Accept-Encoding', ''))
+            if asset is None:
+                return 'Not found', 404
+            response = send_file(asset.path, mimetype=asset.mimetype, etag=asset.etag, conditional=True,
+                                 max_age=None)
+            response.headers.update(asset.headers)
+            return response
+
+        browser = Browser(app.test_client(), accept_encoding)
+        return {'build': build, 'first': browser.load(), 'repeat': browser.load()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accept-encoding', default='gzip, deflate, br')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = {}
+    for name, enabled in (('plain', False), ('pipeline', True)):
+        result = results[name] = run_mode(enabled, args.accept_encoding)
+        first, repeat = result['first'], result['repeat']
+        print(f"{name:>8}: first load {first['requests']} requests, {first['bytes'] / 1024:.1f} KiB; "
+              f"repeat {repeat['requests']} requests ({repeat['not_modified']} not modified, "
+              f"{repeat['from_cache']} from cache), {repeat['bytes'] / 1024:.1f} KiB")
+
+    write_results('assets', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
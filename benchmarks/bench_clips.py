@@ -0,0 +1,141 @@
+"""
+Clip encode time and peak memory per clip length, to size the clip worker for a Pi.
+
+For every clip length and format a clip is recorded into a spool the way the
+booth does it. The frames are full-size pans across a photo with a little
+sensor noise. The spool is then encoded with ``encode_clip`` in a fresh
+worker process, so each peak RSS belongs to that clip alone. The
+``webp_in_memory`` mode encodes the same frames with all of them decoded into
+one list, which is what the worker would hold without streaming.
+
+Reported per case:
+- encode time, and time per output frame
+- clip size
+- the worker's RSS before the encode, at its peak, and the difference
+- the booth-side cost of spooling one frame
+
+    python benchmarks/bench_clips.py [--seconds 1,2,4] [--formats webp,gif,mp4,webp_in_memory] [--output results.json]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common import BASE_DIR, summarize, write_results
+
+WATERMARK_PATH = os.path.join(BASE_DIR, 'static', 'img', 'watermark.png')
+PHOTO_PATH = os.path.join(BASE_DIR, 'static', 'img', 'bliss.jpg')
+FRAME_SIZE = (1080, 1350)
+
+
+def record_spool(directory, frames):
+    """Spool ``frames`` full-size XBGR frames panning across a photo. Returns (spool, per-frame seconds)."""
+    import numpy as np
+    from PIL import Image
+    from src.clips import ClipEncoder
+
+    width, height = FRAME_SIZE
+    with Image.open(PHOTO_PATH) as photo:
+        scene = np.asarray(photo.convert('RGBX').resize((int(width * 1.3), int(height * 1.3))))
+    rng = np.random.default_rng(1)
+    encoder = ClipEncoder('webp', frame_size=FRAME_SIZE, spool_dir=directory)
+    encoder.shutdown()
+    spool = encoder.spool(f"clip_{frames}.webp")
+    seconds = []
+    for i in range(frames):
+        x = i * (scene.shape[1] - width) // max(1, frames - 1)
+        frame = scene[i * 4:i * 4 + height, x:x + width].copy()
+        frame[..., :3] = np.clip(frame[..., :3] + rng.integers(-4, 5, frame.shape[:2] + (3,), dtype=np.int16),
+                                 0, 255)
+        start = time.perf_counter()
+        spool.add(frame)
+        seconds.append(time.perf_counter() - start)
+    spool.close()
+    return spool, encoder.size, seconds
+
+
+def encode_in_memory(spool_path, output_path, size, frames, fps, watermark):
+    """The same WebP encode with every frame decoded up front, for comparison."""
+    from src import clips
+
+    clips._reset_peak_rss()
+    rss_kb = clips._read_status_kb('VmRSS')
+    start = time.perf_counter()
+    reader = clips._SpoolReader(spool_path, tuple(size), clips._watermark(watermark, tuple(size)))
+    images = [reader.image(i) for i in clips.boomerang_order(frames)]
+    reader.close()
+    images[0].save(output_path, 'WEBP', save_all=True, append_images=images[1:], duration=round(1000 / fps),
+                   loop=0, quality=clips.WEBP_QUALITY, method=clips.WEBP_METHOD)
+    return {
+        'frames': len(images),
+        'encode_seconds': time.perf_counter() - start,
+        'rss_kb': rss_kb,
+        'peak_rss_kb': clips._read_status_kb('VmHWM'),
+        'bytes': os.path.getsize(output_path),
+    }
+
+
+def run_case(fmt, seconds, args, directory):
+    from src.clips import BOOMERANG_SPEED, encode_clip
+
+    frames = max(2, round(seconds * args.fps))
+    spool, size, spool_seconds = record_spool(directory, frames)
+    output = os.path.join(directory, f"clip_{frames}.{fmt.split('_')[0]}")
+    # 100 px margin at full size, as the booth uses
+    watermark = (WATERMARK_PATH, 50, os.path.join(directory, 'cache'))
+    fps = args.fps * BOOMERANG_SPEED
+    try:
+        # A fresh worker per case, so the peak is this clip's alone; warmed up first, as the
+        # booth's worker is after its first clip
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            pool.submit(time.sleep, 0).result()
+            if fmt == 'webp_in_memory':
+                result = pool.submit(encode_in_memory, spool.path, output, size, frames, fps, watermark).result()
+            else:
+                result = pool.submit(encode_clip, spool.path, output, fmt, size, frames, fps, watermark).result()
+    finally:
+        spool.discard()
+    result.pop('path', None)
+    result.update({
+        'seconds': seconds,
+        'recorded_frames': frames,
+        'size': list(size),
+        'encode_ms_per_frame': result['encode_seconds'] / result['frames'] * 1000,
+        'extra_peak_rss_kb': result['peak_rss_kb'] - result['rss_kb'],
+        'spool_frame': summarize(spool_seconds),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', default='1,2,4', help='Comma-separated clip lengths')
+    parser.add_argument('--formats', default='webp,gif,mp4,webp_in_memory')
+    parser.add_argument('--fps', type=float, default=8.0, help='Recorded frames per second')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = {'cpu_count': os.cpu_count()}
+    for fmt in args.formats.split(','):
+        if fmt == 'mp4' and shutil.which('ffmpeg') is None:
+            print("    mp4: skipped, ffmpeg is not installed")
+            results[fmt] = 'skipped: ffmpeg not installed'
+            continue
+        results[fmt] = {}
+        for seconds in (float(s) for s in args.seconds.split(',')):
+            with tempfile.TemporaryDirectory() as directory:
+                result = results[fmt][f"{seconds:g}s"] = run_case(fmt, seconds, args, directory)
+            print(f"{fmt:>14} {seconds:g}s: {result['frames']} frames encoded in {result['encode_seconds']:.2f}s "
+                  f"({result['encode_ms_per_frame']:.0f} ms/frame), {result['bytes'] / 1024:.0f} KiB; worker RSS "
+                  f"{result['rss_kb'] / 1024:.0f} MiB, peak {result['peak_rss_kb'] / 1024:.0f} MiB "
+                  f"(+{result['extra_peak_rss_kb'] / 1024:.0f} MiB); spooling "
+                  f"{result['spool_frame']['median_ms']:.1f} ms/frame")
+
+    write_results('clips', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Collage composition time per layout.
+
+    cell      shrinking one decoded full-size frame into a layout's cell
+    compose   pasting three cells into the layout and encoding the JPEG
+    ready     capture_image_3 returning until the collage is on disk
+              (simulated hardware, only with --sessions > 0)
+
+    python benchmarks/bench_collage.py [--layouts strip,grid] [--iterations 20] [--sessions 1]
+                                       [--output results.json]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from common import BASE_DIR, summarize, time_calls, write_results
+
+LOGO_PATH = os.path.join(BASE_DIR, 'static', 'img', 'watermark.png')
+
+
+def _frame(seed):
+    rng = np.random.default_rng(seed)
+    frame = np.empty((1350, 1080, 4), dtype=np.uint8)
+    frame[..., :3] = rng.integers(0, 256, (1350, 1080, 3), dtype=np.uint8)
+    frame[..., 3] = 255
+    return Image.frombuffer('RGBX', (1080, 1350), frame, 'raw', 'RGBX', 0, 1)
+
+
+def bench_layout(name, iterations, directory):
+    from src.collage import LAYOUTS, CollageComposer
+
+    layout = LAYOUTS[name]
+    composer = CollageComposer(lambda filename: os.path.join(directory, filename), LOGO_PATH, layouts=(name,))
+    try:
+        frames = [_frame(i) for i in range(layout.shots)]
+        cells = [ImageOps.fit(f, layout.cell_size, Image.Resampling.BILINEAR).convert('RGB') for f in frames]
+
+        def compose():
+            encoded = io.BytesIO()
+            composer.compose(layout, cells).save(encoded, format='JPEG', quality=composer.quality)
+            return encoded
+
+        return {
+            'size': list(layout.size),
+            'cell': summarize(time_calls(
+                lambda: ImageOps.fit(frames[0], layout.cell_size, Image.Resampling.BILINEAR).convert('RGB'),
+                iterations)),
+            'compose': summarize(time_calls(compose, iterations)),
+            'file_size_kb': len(compose().getvalue()) / 1024,
+        }
+    finally:
+        composer.shutdown()
+
+
+def bench_ready(layouts, sessions, directory):
+    from src.camera_capture import CameraCaptureSystem
+    from src.simulated import SimulatedHardware, SimulatedUploader
+
+    system = CameraCaptureSystem(
+        capture_dir=os.path.join(directory, 'captures'),
+        cache_dir=os.path.join(directory, 'cache'),
+        uploader=SimulatedUploader(),
+        hardware=SimulatedHardware(),
+        collage_layouts=layouts,
+    )
+    samples = []
+    try:
+        for _ in range(sessions):
+            system.capture_image_3()
+            returned = time.perf_counter()
+            for path in system.last_collages:
+                system.wait_for_photo(os.path.basename(path), timeout=30)
+            samples.append(time.perf_counter() - returned)
+    finally:
+        system.cleanup()
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layouts', default='strip,grid')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.chdir(BASE_DIR)  # The watermark is loaded relative to the repository root
+    layouts = [l for l in args.layouts.split(',') if l]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in layouts:
+            results[name] = bench_layout(name, args.iterations, directory)
+            print(f"{name:>5}: cell median {results[name]['cell']['median_ms']:.1f} ms, "
+                  f"compose+encode median {results[name]['compose']['median_ms']:.1f} ms")
+        if args.sessions:
+            results['ready'] = bench_ready(layouts, args.sessions, directory)
+            print(f"ready after capture_image_3 returned: median {results['ready']['median_ms']:.1f} ms")
+
+    write_results('collage', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
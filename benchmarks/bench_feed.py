@@ -0,0 +1,160 @@
+"""
+Gallery feed fan-out to a few hundred subscribers.
+
+Photos are added to a photo index and published to the feed at a fixed
+interval while ``--subscribers`` clients follow it, in one of two modes:
+
+    threads     one thread per subscriber blocking in ``next`` (the Flask app)
+    async       one event loop with a task per subscriber in ``next_async``
+                (the ASGI app)
+
+Reported per mode: delivery latency from publish to each subscriber holding
+the event (p50/p95/p99/max), time spent in ``publish``, whether every
+subscriber got every photo exactly once, process CPU per wall second, and the
+bytes each subscriber receives per new photo next to what reloading the kiosk
+page would cost (its HTML alone, before any thumbnails are revalidated).
+
+    python benchmarks/bench_feed.py [--subscribers 300] [--photos 20] [--output results.json]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from common import BASE_DIR, summarize, write_results
+
+
+def _write_photos(storage, count, size=(108, 135)):
+    from PIL import Image
+
+    image = Image.new('RGB', size, (40, 80, 120))
+    paths = []
+    for number in range(1, count + 1):
+        path = storage.path_for(f"photo_{number}.jpg")
+        image.save(path, quality=80)
+        paths.append(path)
+    return paths
+
+
+def _number(encoded):
+    return int(encoded.split('\n', 1)[0][len('id: '):])
+
+
+def run_mode(mode, args):
+    from src.feed import PhotoFeed
+    from src.photo_index import PhotoIndex
+    from src.storage import CaptureStorage
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = CaptureStorage(os.path.join(directory, 'captures'))
+        index = PhotoIndex(storage)
+        feed = PhotoFeed(index)
+        paths = _write_photos(storage, args.photos)
+        published = {}
+        received = [[] for _ in range(args.subscribers)]
+        event_bytes = []
+        done = threading.Event()
+
+        def record(slot, events):
+            now = time.perf_counter()
+            for encoded in events:
+                received[slot].append((_number(encoded), now))
+                if slot == 0:
+                    event_bytes.append(len(encoded))
+
+        subscriptions = [feed.subscribe() for _ in range(args.subscribers)]
+        ready = threading.Barrier(2 if mode == 'async' else args.subscribers + 1)
+
+        def follow(slot):
+            subscription = subscriptions[slot]
+            ready.wait()
+            while not done.is_set():
+                record(slot, subscription.next(timeout=0.5))
+            subscription.close()
+
+        async def follow_all():
+            async def follow_async(slot):
+                subscription = subscriptions[slot]
+                while not done.is_set():
+                    record(slot, await subscription.next_async(timeout=0.5))
+                subscription.close()
+
+            tasks = [asyncio.create_task(follow_async(slot)) for slot in range(args.subscribers)]
+            await asyncio.sleep(0.2)  # Every task waiting in next_async
+            ready.wait()
+            await asyncio.gather(*tasks)
+
+        if mode == 'threads':
+            threads = [threading.Thread(target=follow, args=(slot,), daemon=True) for slot in range(args.subscribers)]
+        else:
+            threads = [threading.Thread(target=lambda: asyncio.run(follow_all()), daemon=True)]
+        for thread in threads:
+            thread.start()
+        ready.wait()
+        time.sleep(0.2)
+
+        publish_times = []
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        for path in paths:
+            photo = index.add(path)
+            start = time.perf_counter()
+            published[photo.number] = start
+            feed.publish(photo)
+            publish_times.append(time.perf_counter() - start)
+            time.sleep(args.interval)
+        time.sleep(1.0)  # Stragglers
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        done.set()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        latencies = [at - published[number] for events in received for number, at in events]
+        expected = list(published)
+        complete = sum(1 for events in received if sorted(n for n, _ in events) == expected)
+        return {
+            'subscribers': args.subscribers,
+            'photos': args.photos,
+            'delivery_latency': summarize(latencies),
+            'publish': summarize(publish_times),
+            'subscribers_complete': complete,
+            'process_core_share': cpu / wall,
+            'event_bytes_mean': sum(event_bytes) / len(event_bytes) if event_bytes else None,
+        }
+
+
+def reload_bytes():
+    """Size of the kiosk page's HTML with a full reel, as a reloading guest would fetch it."""
+    import app
+
+    with app.app.test_request_context('/'):
+        from flask import render_template
+        return len(render_template('index.html', photos=['photo_3.jpg', 'photo_2.jpg', 'photo_1.jpg']).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='threads,async')
+    parser.add_argument('--subscribers', type=int, default=300)
+    parser.add_argument('--photos', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.2, help='Seconds between published photos')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.chdir(BASE_DIR)
+    results = {'reload_html_bytes': reload_bytes()}
+    for mode in args.modes.split(','):
+        result = results[mode] = run_mode(mode, args)
+        latency = result['delivery_latency']
+        print(f"{mode:>7}: {result['subscribers']} subscribers, latency p50 {latency['median_ms']:.1f} ms "
+              f"p95 {latency['p95_ms']:.1f} ms p99 {latency['p99_ms']:.1f} ms max {latency['max_ms']:.1f} ms; "
+              f"publish {result['publish']['mean_ms']:.2f} ms; {result['subscribers_complete']}/"
+              f"{result['subscribers']} got every photo once; CPU {result['process_core_share'] * 100:.0f}%; "
+              f"{result['event_bytes_mean']:.0f} B per photo vs {results['reload_html_bytes']} B per reload")
+
+    write_results('feed', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+LED engine timing checked against a simulated strip.
+
+Every ``show()`` on SimulatedPixels is timestamped, so the strip's history can
+be compared with the deadlines the engine was asked to meet:
+
+    countdown   blocking 3 s countdown: total duration error and the lateness
+                of each colour/position change against its tick deadline
+    flash       flash scheduled at an absolute deadline: when it actually lit
+    engine      the engine's own tick lateness and overrun counters
+
+Optionally adds CPU-bound background threads to see how the render thread
+copes with GIL contention.
+
+    python benchmarks/bench_leds.py [--runs 3] [--tick-rate 60] [--load 2] [--output results.json]
+"""
+import argparse
+import threading
+import time
+
+from common import summarize, write_results
+
+
+def _busy(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(10000))
+
+
+def bench_countdown(animator, pixels, runs):
+    durations, lateness = [], []
+    for _ in range(runs):
+        pixels.history.clear()
+        start = animator.start_animation('countdown', blocking=True)
+        durations.append(time.perf_counter() - start)
+        frames = animator._frames('countdown')
+        # Expected time of every frame that differs from the one before it
+        expected = [start + i * animator.tick for i in range(len(frames))
+                    if i == 0 or (frames[i] != frames[i - 1]).any()]
+        shown = [t for t, _ in pixels.history][:len(expected)]
+        lateness.extend(t - e for t, e in zip(shown, expected))
+    return {
+        'duration_error': summarize([d - len(animator._frames('countdown')) * animator.tick for d in durations]),
+        'frame_lateness': summarize(lateness),
+    }
+
+
+def bench_flash(animator, pixels, runs):
+    lateness = []
+    for _ in range(runs):
+        pixels.history.clear()
+        deadline = time.perf_counter() + 0.25
+        animator.start_animation('flash', at=deadline)
+        time.sleep(0.7)
+        lit = next(t for t, frame in pixels.history if frame[0] == (255, 255, 255))
+        lateness.append(lit - deadline)
+    return summarize(lateness)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--pixels', type=int, default=16)
+    parser.add_argument('--tick-rate', type=int, default=60)
+    parser.add_argument('--load', type=int, default=0, help='CPU-bound background threads')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    from src.leds import PixelAnimator
+    from src.simulated import SimulatedHardware
+
+    hardware = SimulatedHardware()
+    animator = PixelAnimator(args.pixels, hardware=hardware, tick_rate=args.tick_rate)
+    pixels = hardware.pixels
+    stop = threading.Event()
+    load = [threading.Thread(target=_busy, args=(stop,), daemon=True) for _ in range(args.load)]
+    for thread in load:
+        thread.start()
+    try:
+        results = {
+            'background_threads': args.load,
+            'countdown': bench_countdown(animator, pixels, args.runs),
+            'flash_lateness': bench_flash(animator, pixels, args.runs),
+        }
+    finally:
+        stop.set()
+        animator.shutdown()
+    results['engine'] = animator.stats()
+    results['engine']['shows'] = pixels.show_count
+
+    print(f"countdown frame lateness median {results['countdown']['frame_lateness']['median_ms']:.2f} ms, "
+          f"max {results['countdown']['frame_lateness']['max_ms']:.2f} ms; "
+          f"flash lateness median {results['flash_lateness']['median_ms']:.2f} ms; "
+          f"overruns {results['engine']['overruns']}")
+    write_results('leds', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Index page render time as the number of captures grows.
+
+Compares the old listdir-and-sort per request against the in-memory PhotoIndex,
+rendering the real index.html template each time, for capture directories of
+increasing size (empty placeholder files are enough for both paths). Also
+times building the index at start-up from a flat directory and from the same
+photos in day shards with manifests (``--shard-size`` photos per shard).
+
+    python benchmarks/bench_photo_index.py [--counts 100,1000,10000,50000] [--shard-size 500]
+                                           [--output results.json]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from common import BASE_DIR, summarize, time_calls, write_results
+
+
+def _legacy_listing(capture_dir):
+    return sorted(
+        [f for f in os.listdir(capture_dir) if f.startswith('photo_') and f.endswith('.jpg')],
+        key=lambda x: int(x.split('_')[1].split('.')[0]),
+        reverse=True
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='100,1000,10000,50000')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--shard-size', type=int, default=500)
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    from jinja2 import Environment, FileSystemLoader
+    from src.photo_index import PhotoIndex
+    from src.storage import CaptureStorage
+
+    template = Environment(loader=FileSystemLoader(os.path.join(BASE_DIR, 'templates'))).get_template('index.html')
+    counts = sorted(int(c) for c in args.counts.split(','))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as capture_dir, tempfile.TemporaryDirectory() as sharded_dir:
+        created = 0
+        for count in counts:
+            for number in range(created, count):
+                open(os.path.join(capture_dir, f"photo_{number}.jpg"), 'wb').close()
+                shard = os.path.join(sharded_dir, 'bench', f"2024-01-{number // args.shard_size + 1:02d}")
+                os.makedirs(shard, exist_ok=True)
+                open(os.path.join(shard, f"photo_{number}.jpg"), 'wb').close()
+            created = count
+            # The first load writes the manifests of the new shards
+            CaptureStorage(sharded_dir, event='bench')
+
+            start = time.perf_counter()
+            index = PhotoIndex(CaptureStorage(capture_dir))
+            build_s = time.perf_counter() - start
+            start = time.perf_counter()
+            PhotoIndex(CaptureStorage(sharded_dir, event='bench'))
+            sharded_build_s = time.perf_counter() - start
+
+            legacy = time_calls(lambda: template.render(photos=_legacy_listing(capture_dir)), args.iterations)
+            indexed = time_calls(
+                lambda: template.render(photos=[r.filename for r in index.latest(3)]), args.iterations)
+            paged = time_calls(lambda: index.page(cursor=count // 2, limit=50), args.iterations)
+
+            results[str(count)] = {
+                'index_build_ms': build_s * 1000,
+                'sharded_index_build_ms': sharded_build_s * 1000,
+                'legacy_render': summarize(legacy),
+                'indexed_render': summarize(indexed),
+                'api_page_mid_gallery': summarize(paged),
+            }
+            print(f"{count:>6} photos: legacy {results[str(count)]['legacy_render']['median_ms']:.3f} ms, "
+                  f"indexed {results[str(count)]['indexed_render']['median_ms']:.3f} ms; build flat "
+                  f"{build_s * 1000:.1f} ms, sharded {sharded_build_s * 1000:.1f} ms")
+
+    write_results('photo_index', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Which frame a shot gets: the next frame vs the pre-roll ring.
+
+Single shots are taken on simulated hardware whose frames are randomly smeared
+by up to ``--motion-blur`` rows, as guests moving would. Modes:
+
+    next_frame  no pre-roll: the first frame after the shutter (the old behaviour)
+    nearest     pre-roll ring, the frame nearest the shutter time
+    sharpest    pre-roll ring, the sharpest frame within ``--window-ms`` of it
+
+Reported per mode: the offset between the shutter and the chosen frame's
+timestamp, how long the shutter waited for its frame, the smear of the chosen
+frame against the mean over all frames, and the ring's memory and per-frame
+write cost. A micro-benchmark of the ring's lookup is reported separately.
+
+    python benchmarks/bench_preroll.py [--shots 20] [--motion-blur 12] [--output results.json]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from common import BASE_DIR, summarize, time_calls, write_results
+
+
+def run_mode(mode, args):
+    from src.camera_capture import CameraCaptureSystem
+    from src.simulated import SimulatedHardware, SimulatedUploader
+
+    options = {
+        'next_frame': {'preroll_frames': 0},
+        'nearest': {'preroll_frames': args.frames},
+        'sharpest': {'preroll_frames': args.frames, 'preroll_window': args.window_ms / 1000},
+    }[mode]
+    with tempfile.TemporaryDirectory() as directory:
+        system = CameraCaptureSystem(
+            capture_dir=os.path.join(directory, 'captures'),
+            cache_dir=os.path.join(directory, 'cache'),
+            uploader=SimulatedUploader(),
+            hardware=SimulatedHardware(motion_blur=args.motion_blur),
+            collage_layouts=(),
+            **options
+        )
+        try:
+            camera = system.picam2
+            time.sleep(1.0)  # Fill the ring
+            offsets, waits, blurs = [], [], []
+            for _ in range(args.shots):
+                with system.capture_lock:
+                    shutter_time = time.time()
+                    start = time.perf_counter()
+                    frame = system._shutter_frame(shutter_time)
+                    waits.append(time.perf_counter() - start)
+                frame_time = (camera.last_capture_time if system.preroll is None
+                              else shutter_time + system.last_shutter_offset)
+                offsets.append(frame_time - shutter_time)
+                blurs.append(dict(camera.blur_history).get(frame_time))
+                del frame
+                time.sleep(args.interval)
+            all_blurs = [b for _, b in camera.blur_history]
+            return {
+                'shutter_to_frame_offset': summarize([abs(o) for o in offsets]),
+                'frames_after_shutter': sum(1 for o in offsets if o > 0),
+                'shutter_wait': summarize(waits),
+                'chosen_blur_rows_mean': sum(b for b in blurs if b is not None) / max(1, sum(b is not None for b in blurs)),
+                'all_frames_blur_rows_mean': sum(all_blurs) / len(all_blurs),
+                'ring': system.preroll.stats() if system.preroll else None,
+            }
+        finally:
+            system.cleanup()
+
+
+def bench_lookup(frames, iterations):
+    import numpy as np
+    from src.preroll import FrameRing
+
+    ring = FrameRing(frames, (1350, 1080, 4))
+    now = time.time()
+    frame = np.zeros((1350, 1080, 4), dtype=np.uint8)
+    for i in range(frames):
+        ring.write(frame, now + i / 15)
+
+    def lookup():
+        with ring.condition:
+            ring.nearest(now + 0.13)
+
+    return {
+        'nearest': summarize(time_calls(lookup, iterations)),
+        'grab_copy': summarize(time_calls(lambda: ring.grab(now + 0.13, timeout=0), 20)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='next_frame,nearest,sharpest')
+    parser.add_argument('--shots', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.3, help='Pause between shots, in seconds')
+    parser.add_argument('--frames', type=int, default=6, help='Pre-roll ring size')
+    parser.add_argument('--window-ms', type=float, default=100, help='Window for the sharpest mode')
+    parser.add_argument('--motion-blur', type=int, default=12, help='Largest simulated smear, in rows')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.chdir(BASE_DIR)  # The watermark is loaded relative to the repository root
+    results = {}
+    for mode in args.modes.split(','):
+        result = results[mode] = run_mode(mode, args)
+        ring = result['ring']
+        print(f"{mode:>10}: offset p50 {result['shutter_to_frame_offset']['median_ms']:.1f} ms "
+              f"max {result['shutter_to_frame_offset']['max_ms']:.1f} ms, wait p50 "
+              f"{result['shutter_wait']['median_ms']:.1f} ms; smear {result['chosen_blur_rows_mean']:.1f} rows "
+              f"(all frames {result['all_frames_blur_rows_mean']:.1f})"
+              + (f"; ring {ring['bytes'] / 2 ** 20:.0f} MiB, write {ring['write_ms_mean']:.2f} ms/frame" if ring else ""))
+    results['lookup'] = bench_lookup(args.frames, 10000)
+    print(f"    lookup: nearest p50 {results['lookup']['nearest']['median_ms'] * 1000:.1f} us, "
+          f"grab with copy p50 {results['lookup']['grab_copy']['median_ms']:.2f} ms")
+
+    write_results('preroll', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
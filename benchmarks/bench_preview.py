@@ -0,0 +1,130 @@
+"""
+Preview encoding cost and per-viewer bandwidth for different preview streams.
+
+For each configuration the booth runs on simulated hardware with one viewer
+per preview tier (``kiosk``, ``remote``, ``thumb``) for a fixed time. Reported
+per configuration:
+
+    encoder     frames encoded per second, mean encode CPU time per frame and
+                the share of one core the encoder used, plus mean frame size
+    cpu         process CPU seconds per wall second over the run (camera
+                simulation, encoder and fan-out together)
+    viewers     frames and bytes per second each tier's viewer received
+
+Configurations are ``name=SIZE@FPS:QUALITY`` with SIZE ``main`` for encoding
+the full-resolution stream (the old behaviour) or ``WIDTHxHEIGHT`` for a lores
+stream, e.g. ``--configs main=main@15:85,lores=544x680@15:75``.
+
+    python benchmarks/bench_preview.py [--seconds 5] [--output results.json]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from common import BASE_DIR, write_results
+
+DEFAULT_CONFIGS = 'main=main@15:85,lores=544x680@15:75,lores_7fps=544x680@7.5:75'
+
+
+def parse_config(text):
+    name, spec = text.split('=', 1)
+    size, rest = spec.split('@', 1)
+    fps, quality = rest.split(':', 1)
+    return name, {
+        'preview_size': None if size == 'main' else tuple(int(v) for v in size.split('x')),
+        'preview_fps': float(fps),
+        'preview_quality': int(quality),
+    }
+
+
+def run_config(options, seconds):
+    from src.camera_capture import CameraCaptureSystem
+    from src.simulated import SimulatedHardware, SimulatedUploader
+
+    with tempfile.TemporaryDirectory() as directory:
+        system = CameraCaptureSystem(
+            capture_dir=os.path.join(directory, 'captures'),
+            cache_dir=os.path.join(directory, 'cache'),
+            uploader=SimulatedUploader(),
+            hardware=SimulatedHardware(),
+            collage_layouts=(),
+            **options
+        )
+        try:
+            system.start_mjpeg_stream()
+            stop = threading.Event()
+
+            def viewer(tier):
+                stream = system.mjpeg_generator(tier)
+                for _ in stream:
+                    if stop.is_set():
+                        break
+                stream.close()
+
+            threads = [threading.Thread(target=viewer, args=(tier,), daemon=True) for tier in system.preview_tiers]
+            for thread in threads:
+                thread.start()
+            time.sleep(1.0)  # Let the encoder and viewers settle
+
+            encoder = system.picam2.encoder
+            before = (encoder.frames_encoded, encoder.bytes_encoded, encoder.encode_cpu_seconds)
+            clients_before = {c['tier']: c for c in system.stream_hub.stats()['clients'].values()}
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            time.sleep(seconds)
+            cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+            frames = encoder.frames_encoded - before[0]
+            encoded_bytes = encoder.bytes_encoded - before[1]
+            encode_seconds = encoder.encode_cpu_seconds - before[2]
+            clients = {c['tier']: c for c in system.stream_hub.stats()['clients'].values()}
+
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=2)
+            return {
+                'encoder': {
+                    'fps': frames / wall,
+                    'encode_cpu_ms_mean': encode_seconds / frames * 1000 if frames else None,
+                    'core_share': encode_seconds / wall,
+                    'frame_kb_mean': encoded_bytes / frames / 1024 if frames else None,
+                    'kb_per_second': encoded_bytes / wall / 1024,
+                },
+                'cpu': {'process_core_share': cpu / wall},
+                'viewers': {
+                    tier: {
+                        'fps': (c['frames_sent'] - clients_before[tier]['frames_sent']) / wall,
+                        'kb_per_second': (c['bytes_sent'] - clients_before[tier]['bytes_sent']) / wall / 1024,
+                        'frames_dropped': c['frames_dropped'],
+                    }
+                    for tier, c in clients.items()
+                },
+            }
+        finally:
+            system.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', default=DEFAULT_CONFIGS)
+    parser.add_argument('--seconds', type=float, default=5.0, help='Measured time per configuration')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.chdir(BASE_DIR)  # The watermark is loaded relative to the repository root
+    results = {}
+    for text in args.configs.split(','):
+        name, options = parse_config(text)
+        result = run_config(options, args.seconds)
+        results[name] = dict(result, options=dict(options, preview_size=options['preview_size'] and
+                                                  'x'.join(map(str, options['preview_size']))))
+        encoder, viewers = result['encoder'], result['viewers']
+        print(f"{name:>11}: encoder {encoder['fps']:.1f} fps, {encoder['encode_cpu_ms_mean']:.1f} ms/frame, "
+              f"{encoder['core_share'] * 100:.0f}% of a core, process {result['cpu']['process_core_share'] * 100:.0f}%; "
+              + ", ".join(f"{tier} {v['kb_per_second']:.0f} KiB/s" for tier, v in viewers.items()))
+
+    write_results('preview', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Server memory and thread count with 1, 10 and 50 concurrent stream viewers.
+
+Starts app.py on simulated hardware once per serving mode (threaded Flask and
+ASGI), connects N /video_feed viewers from an asyncio client, and samples the
+server's RSS and thread count from /proc once the viewers are streaming.
+
+    python benchmarks/bench_serving_modes.py [--viewers 1,10,50] [--modes flask,asgi] [--output results.json]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import BASE_DIR, write_results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _proc_status(pid):
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'Threads'):
+                values[key] = int(value.split()[0])
+    return {'rss_kb': values.get('VmRSS'), 'threads': values.get('Threads')}
+
+
+def start_server(mode, directory, port, extra_env=None):
+    """Start app.py on simulated hardware and wait until /readyz reports it ready."""
+    env = dict(os.environ,
+               PHOTOBOOTH_HARDWARE='sim',
+               PHOTOBOOTH_SERVER=mode,
+               PHOTOBOOTH_PORT=str(port),
+               PHOTOBOOTH_CAPTURES_DIR=os.path.join(directory, 'captures'),
+               PHOTOBOOTH_CACHE_DIR=os.path.join(directory, 'cache'),
+               PHOTOBOOTH_UPLOAD_URL='http://127.0.0.1:9/unused')
+    env.update(extra_env or {})
+    proc = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'app.py')], cwd=BASE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as s:
+                s.sendall(b"GET /readyz HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+                if b' 200 ' in s.recv(64):
+                    return proc
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not come up on port {port}")
+
+
+async def _viewer(port, stop, counter, index):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b"GET /video_feed HTTP/1.1\r\nHost: booth\r\n\r\n")
+    await writer.drain()
+    try:
+        while not stop.is_set():
+            data = await reader.read(256 * 1024)
+            if not data:
+                break
+            counter[index] += data.count(b'--frame\r\n')
+    finally:
+        writer.close()
+
+
+async def measure(pid, port, viewers, seconds):
+    stop = asyncio.Event()
+    counts = [0] * viewers
+    tasks = [asyncio.create_task(_viewer(port, stop, counts, i)) for i in range(viewers)]
+    await asyncio.sleep(seconds / 2)
+    status = _proc_status(pid)
+    start_counts = list(counts)
+    await asyncio.sleep(seconds / 2)
+    fps = [(c - s) / (seconds / 2) for c, s in zip(counts, start_counts)]
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Let the server notice the disconnects before the next run
+    await asyncio.sleep(1.0)
+    status.update({
+        'viewers': viewers,
+        'fps_per_viewer_mean': sum(fps) / len(fps),
+        'fps_per_viewer_min': min(fps),
+    })
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--viewers', default='1,10,50')
+    parser.add_argument('--modes', default='flask,asgi')
+    parser.add_argument('--seconds', type=float, default=4.0)
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes.split(','):
+        with tempfile.TemporaryDirectory() as directory:
+            port = _free_port()
+            proc = start_server(mode, directory, port)
+            try:
+                runs = [{'viewers': 0, **_proc_status(proc.pid)}]
+                for viewers in (int(v) for v in args.viewers.split(',')):
+                    runs.append(asyncio.run(measure(proc.pid, port, viewers, args.seconds)))
+                    print(f"{mode:>5} {viewers:>3} viewers: rss {runs[-1]['rss_kb'] / 1024:.1f} MiB, "
+                          f"threads {runs[-1]['threads']}, {runs[-1]['fps_per_viewer_mean']:.1f} fps/viewer")
+                results[mode] = runs
+            finally:
+                proc.terminate()
+                proc.wait(timeout=15)
+
+    write_results('serving_modes', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
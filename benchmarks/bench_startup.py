@@ -0,0 +1,183 @@
+"""
+Cold-start timing of app.py on simulated hardware.
+
+    imports     ``import app`` in a fresh interpreter, from ``-X importtime``:
+                total, the heaviest top-level modules, and whether the Drive
+                client or requests were loaded
+    boot        app.py launched as a subprocess: time until it answers HTTP,
+                until /readyz is 200 and until the first /video_feed frame
+                arrives, plus the server's own phase report from /healthz
+
+All boot times are measured from launching the process. ``--camera-startup``
+makes the simulated camera's first start take as long as libcamera bring-up
+does on the Pi, so the overlap of the start-up phases is visible.
+
+    python benchmarks/bench_startup.py [--runs 3] [--camera-startup 1.0] [--output results.json]
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from common import BASE_DIR, summarize, write_results
+
+# Modules whose cumulative import time is reported individually
+TRACKED_MODULES = ('flask', 'numpy', 'PIL', 'src.camera_capture', 'src.uploads', 'googleapiclient',
+                   'google.oauth2', 'requests', 'starlette')
+LAZY_MODULES = ('googleapiclient', 'google.oauth2', 'requests')
+
+
+def _import_profile():
+    probe = f"import app, json, sys; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe], cwd=BASE_DIR,
+                            capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| +(\S+)', line)
+        if match:
+            cumulative[match.group(2)] = int(match.group(1)) / 1e6
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return cumulative, loaded
+
+
+def bench_imports(runs):
+    totals, modules, loaded = [], {name: [] for name in TRACKED_MODULES}, []
+    for _ in range(runs):
+        cumulative, loaded = _import_profile()
+        totals.append(cumulative['app'])
+        for name in TRACKED_MODULES:
+            if name in cumulative:
+                modules[name].append(cumulative[name])
+    return {
+        'import_app': summarize(totals),
+        'modules_median_ms': {name: summarize(samples)['median_ms'] for name, samples in modules.items() if samples},
+        'lazy_modules_loaded': loaded,
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _get(port, path):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=2) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def _first_frame(port, timeout=10):
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as s:
+        s.sendall(b"GET /video_feed HTTP/1.1\r\nHost: booth\r\n\r\n")
+        data = b''
+        while b'\xff\xd9' not in data:
+            chunk = s.recv(65536)
+            if not chunk:
+                raise RuntimeError("/video_feed closed before the first frame")
+            data += chunk
+
+
+def boot_once(directory, camera_startup, mode, timeout=30):
+    env = dict(os.environ,
+               PHOTOBOOTH_HARDWARE='sim',
+               PHOTOBOOTH_SERVER=mode,
+               PHOTOBOOTH_PORT=str(_free_port()),
+               PHOTOBOOTH_CAPTURES_DIR=os.path.join(directory, 'captures'),
+               PHOTOBOOTH_CACHE_DIR=os.path.join(directory, 'cache'),
+               PHOTOBOOTH_UPLOAD_URL='http://127.0.0.1:9/unused',
+               PHOTOBOOTH_SIM_CAMERA_STARTUP=str(camera_startup))
+    port = int(env['PHOTOBOOTH_PORT'])
+    launched = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'app.py')], cwd=BASE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        deadline = launched + timeout
+        while time.perf_counter() < deadline:
+            try:
+                status, _ = _get(port, '/readyz')
+            except OSError:
+                time.sleep(0.02)
+                continue
+            result.setdefault('serving_s', time.perf_counter() - launched)
+            if status == 200:
+                result['ready_s'] = time.perf_counter() - launched
+                break
+            time.sleep(0.02)
+        else:
+            raise RuntimeError("app.py did not become ready")
+        _first_frame(port)
+        result['first_frame_s'] = time.perf_counter() - launched
+        _, body = _get(port, '/healthz')
+        report = json.loads(body)
+        phases = {p['name']: p for p in report['phases']}
+        parallel = [phases[name] for name in ('leds', 'camera', 'watermark', 'collage', 'storage', 'uploads')
+                    if name in phases]
+        result['phases_s'] = {name: p['seconds'] for name, p in phases.items()}
+        result['milestones_s'] = report['milestones']
+        # How long the overlapped phases would have taken one after another, and how long they took
+        result['bring_up_sequential_s'] = sum(p['seconds'] for p in parallel)
+        result['bring_up_wall_s'] = (max(p['start'] + p['seconds'] for p in parallel) -
+                                     min(p['start'] for p in parallel))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+
+def bench_boot(runs, camera_startup, mode):
+    boots = []
+    for _ in range(runs):
+        # A fresh directory each time, so the watermark cache and photo scan start cold
+        with tempfile.TemporaryDirectory() as directory:
+            boots.append(boot_once(directory, camera_startup, mode))
+    return {
+        'serving': summarize([b['serving_s'] for b in boots]),
+        'ready': summarize([b['ready_s'] for b in boots]),
+        'first_frame': summarize([b['first_frame_s'] for b in boots]),
+        'bring_up_sequential': summarize([b['bring_up_sequential_s'] for b in boots]),
+        'bring_up_wall': summarize([b['bring_up_wall_s'] for b in boots]),
+        'last_run': boots[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--camera-startup', type=float, default=1.0,
+                        help='Seconds the simulated camera takes to start the first time')
+    parser.add_argument('--mode', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = {
+        'camera_startup_s': args.camera_startup,
+        'mode': args.mode,
+        'imports': bench_imports(args.runs),
+        'boot': bench_boot(args.runs, args.camera_startup, args.mode),
+    }
+    imports, boot = results['imports'], results['boot']
+    print(f"import app median {imports['import_app']['median_ms']:.0f} ms "
+          f"(lazy modules loaded: {', '.join(imports['lazy_modules_loaded']) or 'none'})")
+    print(f"serving {boot['serving']['median_ms']:.0f} ms, ready {boot['ready']['median_ms']:.0f} ms, "
+          f"first frame {boot['first_frame']['median_ms']:.0f} ms after launch; bring-up "
+          f"{boot['bring_up_wall']['median_ms']:.0f} ms wall for "
+          f"{boot['bring_up_sequential']['median_ms']:.0f} ms of phases")
+    write_results('startup', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Still capture from the live stream ('array') vs stop-and-capture ('jpeg').
+
+For each capture mode, one viewer consumes the MJPEG preview while a series of
+single shots is taken on simulated hardware. Reported per mode:
+
+    shutter_to_file   shutter until the watermarked JPEG is on disk
+    call_to_file      _capture_single_image call until the file is on disk
+    preview           frames the viewer received during the run, the longest
+                      gap between two frames and the time spent without preview
+
+    python benchmarks/bench_still_capture.py [--modes jpeg,array] [--shots 10] [--output results.json]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from common import BASE_DIR, summarize, write_results
+
+
+def _camera_system(directory, fps, capture_mode, jpeg_quality):
+    from src.camera_capture import CameraCaptureSystem
+    from src.simulated import SimulatedHardware, SimulatedUploader
+
+    return CameraCaptureSystem(
+        capture_dir=os.path.join(directory, 'captures'),
+        cache_dir=os.path.join(directory, 'cache'),
+        uploader=SimulatedUploader(),
+        hardware=SimulatedHardware(fps=fps),
+        capture_mode=capture_mode,
+        jpeg_quality=jpeg_quality,
+    )
+
+
+def run_mode(mode, shots, interval, fps, jpeg_quality):
+    with tempfile.TemporaryDirectory() as directory:
+        system = _camera_system(directory, fps, mode, jpeg_quality)
+        try:
+            arrivals = []
+            stop = threading.Event()
+
+            def viewer():
+                stream = system.mjpeg_generator()
+                for _ in stream:
+                    arrivals.append(time.perf_counter())
+                    if stop.is_set():
+                        break
+                stream.close()
+
+            thread = threading.Thread(target=viewer, daemon=True)
+            thread.start()
+            time.sleep(1.0)  # Let the preview settle before the first shot
+
+            shutter_to_file, call_to_file, sizes = [], [], []
+            start = time.perf_counter()
+            for _ in range(shots):
+                called = time.time()
+                with system.capture_lock:
+                    filename, shutter_time = system._capture_single_image()
+                system.wait_for_photo(os.path.basename(filename), timeout=10)
+                written = time.time()
+                shutter_to_file.append(written - shutter_time)
+                call_to_file.append(written - called)
+                sizes.append(os.path.getsize(filename))
+                time.sleep(interval)
+            elapsed = time.perf_counter() - start
+
+            stop.set()
+            # A stopped preview never yields again, so don't wait for the viewer forever
+            thread.join(timeout=2)
+            during = [t for t in arrivals if t >= start]
+            gaps = [b - a for a, b in zip([start] + during, during + [start + elapsed])]
+            frame_interval = 1.0 / fps
+            return {
+                'shutter_to_file': summarize(shutter_to_file),
+                'call_to_file': summarize(call_to_file),
+                'file_size_kb_mean': sum(sizes) / len(sizes) / 1024,
+                'preview': {
+                    'expected_frames': round(elapsed * fps),
+                    'frames_received': len(during),
+                    'max_gap_ms': max(gaps) * 1000,
+                    # Any gap beyond two frame intervals counts as the preview being frozen
+                    'frozen_seconds': sum(g for g in gaps if g > 2 * frame_interval),
+                },
+            }
+        finally:
+            system.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='jpeg,array')
+    parser.add_argument('--shots', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.5, help='Pause between shots, in seconds')
+    parser.add_argument('--fps', type=int, default=15)
+    parser.add_argument('--quality', type=int, default=90, help='JPEG quality of the final encode')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.chdir(BASE_DIR)  # The watermark is loaded relative to the repository root
+    results = {}
+    for mode in args.modes.split(','):
+        results[mode] = run_mode(mode, args.shots, args.interval, args.fps, args.quality)
+        preview = results[mode]['preview']
+        print(f"{mode:>5}: shutter->file median {results[mode]['shutter_to_file']['median_ms']:.1f} ms, "
+              f"preview {preview['frames_received']}/{preview['expected_frames']} frames, "
+              f"max gap {preview['max_gap_ms']:.0f} ms, frozen {preview['frozen_seconds']:.2f} s")
+
+    write_results('still_capture', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Multi-booth sync: backlog throughput, live sync lag and manifest traffic.
+
+Starts ``--booths`` booth processes (app.py on simulated hardware), each
+seeded with ``--seed`` full-size photos, and then an aggregator process
+(app.py with ``PHOTOBOOTH_SYNC_BOOTHS``) following all of them. Each
+aggregator starts with an empty captures directory. The cases are:
+
+    backlog   time until the aggregator has every seeded photo, run once per
+              ``--transfers`` value; throughput is seeded bytes over that time
+    live      with the last aggregator still running, every booth takes
+              ``--bursts`` three-shot bursts at once; the lag from each capture
+              to its arrival on the aggregator is read back from /sync/status
+
+Also reported: the manifest bytes the aggregator read per live capture,
+against one full manifest of every booth.
+
+    python benchmarks/bench_sync.py [--booths 3] [--seed 100] [--transfers 1,4] [--bursts 3] [--output results.json]
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from bench_serving_modes import _free_port, start_server
+from common import BASE_DIR, write_results
+
+PHOTO_PATH = os.path.join(BASE_DIR, 'static', 'img', 'bliss.jpg')
+FRAME_SIZE = (1080, 1350)
+
+
+def _get_json(url, timeout=10):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def _post_json(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def seed_booth(directory, count, booth):
+    """Write ``count`` distinct full-size photos into a booth's captures, as earlier runs would have."""
+    import numpy as np
+    from PIL import Image
+    from src.storage import day_of
+
+    with Image.open(PHOTO_PATH) as photo:
+        scene = photo.convert('RGB').resize(FRAME_SIZE)
+    rng = np.random.default_rng(booth)
+    pixels = np.asarray(scene, dtype=np.int16)
+    shard = os.path.join(directory, 'captures', 'default', day_of())
+    os.makedirs(shard, exist_ok=True)
+    total = 0
+    for i in range(count):
+        noisy = np.clip(pixels + rng.integers(-6, 7, pixels.shape, dtype=np.int16), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(noisy).save(buffer, 'JPEG', quality=90)
+        with open(os.path.join(shard, f"photo_{i}.jpg"), 'wb') as f:
+            f.write(buffer.getvalue())
+        total += buffer.tell()
+    return total
+
+
+def wait_for_photos(url, expected, timeout):
+    """Poll the aggregator until its gallery holds ``expected`` photos. Returns the seconds taken, or None."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if _get_json(f"{url}/api/photos?limit=1")['total'] >= expected:
+            return time.perf_counter() - start
+        time.sleep(0.05)
+    return None
+
+
+def stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def run_live(url, booth_urls, bursts, expected, timeout):
+    """Fire ``bursts`` bursts on every booth at once and wait until the aggregator has them all."""
+    start = time.perf_counter()
+    for _ in range(bursts):
+        jobs = [(booth, _post_json(f"{booth}/jobs", {'kind': 'burst'})['id']) for booth in booth_urls]
+        for booth, job_id in jobs:
+            while _get_json(f"{booth}/jobs/{job_id}")['state'] not in ('done', 'failed'):
+                time.sleep(0.1)
+    captured = time.perf_counter() - start
+    settled = wait_for_photos(url, expected, timeout)
+    status = _get_json(f"{url}/sync/status")
+    return {
+        'captures_seconds': captured,
+        'settled_after_last_burst_seconds': settled,
+        'booths': [{key: b[key] for key in ('booth', 'files', 'bytes', 'manifest_bytes', 'lag_seconds',
+                                            'bytes_per_second')} for b in status['booths']],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--booths', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=100, help='Photos already on each booth')
+    parser.add_argument('--transfers', default='1,4', help='Comma-separated concurrent transfer counts')
+    parser.add_argument('--bursts', type=int, default=3, help='Live bursts per booth (0 skips the live case)')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = {'booths': args.booths, 'seed_per_booth': args.seed, 'backlog': {}}
+    processes = []
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            booth_urls = []
+            seeded = 0
+            for i in range(args.booths):
+                booth_dir = os.path.join(directory, f"booth{i}")
+                seeded += seed_booth(booth_dir, args.seed, i)
+                port = _free_port()
+                processes.append(start_server('flask', booth_dir, port, {'PHOTOBOOTH_BOOTH_ID': f"booth{i}",
+                                                                         'PHOTOBOOTH_COLLAGE_LAYOUTS': ''}))
+                booth_urls.append(f"http://127.0.0.1:{port}")
+            expected = args.booths * args.seed
+            results['seed_bytes'] = seeded
+            full_manifest = 0
+            for booth in booth_urls:
+                # Waits until the booth has hashed its backlog
+                while _get_json(f"{booth}/sync/manifest?limit=1")['building']:
+                    time.sleep(0.1)
+                with urllib.request.urlopen(f"{booth}/sync/manifest?limit=500") as response:
+                    full_manifest += len(response.read())
+            results['full_manifest_bytes'] = full_manifest
+
+            aggregator = None
+            for transfers in (int(t) for t in args.transfers.split(',')):
+                if aggregator is not None:
+                    stop(aggregator)
+                    processes.remove(aggregator)
+                port = _free_port()
+                url = f"http://127.0.0.1:{port}"
+                aggregator = start_server('flask', os.path.join(directory, f"aggregator{transfers}"), port, {
+                    'PHOTOBOOTH_SYNC_BOOTHS': ','.join(booth_urls),
+                    'PHOTOBOOTH_SYNC_TRANSFERS': str(transfers),
+                })
+                processes.append(aggregator)
+                seconds = wait_for_photos(url, expected, args.timeout)
+                result = results['backlog'][f"transfers_{transfers}"] = {
+                    'seconds': seconds,
+                    'photos_per_second': expected / seconds if seconds else None,
+                    'mib_per_second': seeded / seconds / 2 ** 20 if seconds else None,
+                }
+                print(f"    backlog, {transfers} transfer(s): {expected} photos ({seeded / 2 ** 20:.0f} MiB) in "
+                      f"{seconds:.2f}s, {result['photos_per_second']:.0f} photos/s, "
+                      f"{result['mib_per_second']:.1f} MiB/s")
+
+            if args.bursts:
+                before = sum(b['manifest_bytes'] for b in _get_json(f"{url}/sync/status")['booths'])
+                live = results['live'] = run_live(url, booth_urls, args.bursts,
+                                                  expected + args.booths * args.bursts * 3, args.timeout)
+                captures = args.booths * args.bursts * 3
+                live['manifest_bytes_per_capture'] = (
+                    sum(b['manifest_bytes'] for b in live['booths']) - before) / captures
+                lags = [b['lag_seconds'] for b in live['booths']]
+                print(f"    live: {captures} captures on {args.booths} booths in {live['captures_seconds']:.1f}s, "
+                      f"all on the aggregator {live['settled_after_last_burst_seconds']:.2f}s after the last "
+                      f"burst; lag median " + ', '.join(f"{l['median'] * 1000:.0f}" for l in lags) + " ms, p95 "
+                      + ', '.join(f"{l['p95'] * 1000:.0f}" for l in lags) + " ms per booth")
+                print(f"    manifest: {live['manifest_bytes_per_capture']:.0f} bytes read per live capture, "
+                      f"against {full_manifest / 1024:.0f} KiB for every booth's full manifest")
+        finally:
+            for proc in processes:
+                stop(proc)
+
+    write_results('sync', results, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
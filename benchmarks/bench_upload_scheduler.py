@@ -0,0 +1,195 @@
+"""
+Upload scheduling against preview traffic on a shared, slow uplink.
+
+The booth runs on simulated hardware and uploads to the local stand-in server.
+The stand-in reads request bodies through a token bucket standing in for the
+venue's uplink (``--link-kb``), and emulated remote viewers push every preview
+frame they receive through the same bucket, so uploads and preview compete for
+the link as they do at an event. Each scenario has two phases:
+
+    busy    ``--viewers`` remote viewers watch the preview while a backlog of
+            files is uploading and a three-shot burst is taken
+    idle    the viewers leave and the backlog drains
+
+Reported per scenario: upload KiB/s in each phase, preview frames per second
+and frame latency (publish to arrival over the link) while busy, how many
+files had a first version uploaded by the end of the busy phase, how long after
+the burst its photos were first uploaded, and how long the backlog took to
+drain. Scenarios: ``unthrottled`` (no caps), ``throttled`` (the busy cap) and
+``resized_first`` (the busy cap plus resized copies ahead of originals).
+
+    python benchmarks/bench_upload_scheduler.py [--link-kb 1024] [--busy-kb 128] [--output results.json]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from common import BASE_DIR, summarize, write_results
+from upload_standin import start_standin
+
+
+def _backlog(system, count, quality):
+    """Earlier captures still waiting to upload: noisy photos, which compress about as badly as real ones."""
+    import numpy as np
+    from PIL import Image
+
+    image = Image.fromarray(np.random.randint(0, 256, (1350, 1080, 3), dtype=np.uint8))
+    paths = []
+    for number in range(count):
+        path = system.storage.path_for(f"backlog_{1000 + number}.jpg")
+        image.save(path, quality=quality)
+        system.storage.add(path)
+        paths.append(path)
+    return paths
+
+
+def run_scenario(options, args):
+    from src.camera_capture import CameraCaptureSystem
+    from src.simulated import SimulatedHardware
+    from src.upload_scheduler import TokenBucket
+    from src.uploads import HttpUploader
+
+    link = TokenBucket(args.link_kb * 1024, burst=64 * 1024)
+    server, url = start_standin(link=link)
+    with tempfile.TemporaryDirectory() as directory:
+        system = CameraCaptureSystem(
+            capture_dir=os.path.join(directory, 'captures'),
+            cache_dir=os.path.join(directory, 'cache'),
+            uploader=HttpUploader(f"{url}/upload"),
+            hardware=SimulatedHardware(),
+            collage_layouts=(),
+            **options
+        )
+        try:
+            uploaded = {}
+            system.file_listeners.append(
+                lambda event, path, **details: event == 'uploaded' and uploaded.setdefault(path, time.perf_counter()))
+
+            # When each preview frame was published, to time its trip to the viewers
+            published = {}
+            output = system.output
+
+            def record_publish():
+                chunk = output.chunk
+                published[id(chunk)] = (chunk, time.perf_counter())
+                if len(published) > 200:
+                    published.pop(next(iter(published)))
+
+            output.listeners.append(record_publish)
+            system.start_mjpeg_stream()
+
+            stop = threading.Event()
+            latencies, arrivals = [], []
+
+            def viewer(number):
+                stream = system.mjpeg_generator('kiosk', peer=f"192.0.2.{number + 10}")
+                for chunk in stream:
+                    # The frame crosses the shared uplink before the guest sees it
+                    time.sleep(link.take(len(chunk)))
+                    now = time.perf_counter()
+                    sent = published.get(id(chunk))
+                    if sent is not None and sent[0] is chunk:
+                        latencies.append(now - sent[1])
+                    arrivals.append(now)
+                    if stop.is_set():
+                        break
+                stream.close()
+
+            backlog = _backlog(system, args.backlog, args.backlog_quality)
+            for path in backlog:
+                system.upload(path)
+
+            busy_start = time.perf_counter()
+            # Counted by the scheduler as each chunk goes out; the stand-in only counts finished uploads
+            sent_start = system.upload_scheduler.stats()['bytes_sent']
+            threads = [threading.Thread(target=viewer, args=(n,), daemon=True) for n in range(args.viewers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(1.0)
+            burst = system.capture_image_3()
+            burst_done = time.perf_counter()
+            time.sleep(max(0.0, busy_start + args.busy_seconds - time.perf_counter()))
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=5)
+            busy_end = time.perf_counter()
+            sent_busy = system.upload_scheduler.stats()['bytes_sent'] - sent_start
+
+            deadline = busy_end + args.timeout
+            while time.perf_counter() < deadline:
+                counts = system.upload_queue.journal.counts()
+                if not counts.get('pending') and not counts.get('uploading'):
+                    break
+                time.sleep(0.05)
+            idle_end = time.perf_counter()
+            sent_idle = system.upload_scheduler.stats()['bytes_sent'] - sent_start - sent_busy
+
+            busy_frames = [t for t in arrivals if busy_start + 1.0 <= t <= busy_end]
+            gaps = [b - a for a, b in zip(busy_frames, busy_frames[1:])]
+            first_uploads = [uploaded.get(os.path.abspath(p)) for p in burst]
+            # Files with at least a resized copy up by the end of the busy phase
+            shown_while_busy = sum(1 for p in backlog + burst
+                                   if uploaded.get(os.path.abspath(p), busy_end) < busy_end)
+            return {
+                'busy': {
+                    'seconds': busy_end - busy_start,
+                    'upload_kb_per_second': sent_busy / (busy_end - busy_start) / 1024,
+                    'preview_fps_per_viewer': len(busy_frames) / (busy_end - busy_start - 1.0) / args.viewers,
+                    'preview_latency': summarize(latencies),
+                    'preview_max_gap_ms': max(gaps) * 1000 if gaps else None,
+                },
+                'idle': {
+                    'seconds': idle_end - busy_end,
+                    'upload_kb_per_second': sent_idle / max(idle_end - busy_end, 1e-9) / 1024,
+                },
+                'files_uploaded_while_busy': shown_while_busy,
+                'files': len(backlog) + len(burst),
+                'burst_uploaded_after_s': [t - burst_done if t else None for t in first_uploads],
+                'drain_seconds': idle_end - busy_start,
+                'journal': system.upload_queue.journal.counts(),
+                'scheduler': system.upload_scheduler.stats(),
+            }
+        finally:
+            system.cleanup()
+            server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default='unthrottled,throttled,resized_first')
+    parser.add_argument('--link-kb', type=float, default=1024, help='Shared uplink capacity, KiB/s')
+    parser.add_argument('--busy-kb', type=float, default=128, help='Upload cap while busy, KiB/s')
+    parser.add_argument('--resized-width', type=int, default=640)
+    parser.add_argument('--viewers', type=int, default=2)
+    parser.add_argument('--backlog', type=int, default=12, help='Files already waiting to upload')
+    parser.add_argument('--backlog-quality', type=int, default=60, help='JPEG quality of the backlog photos')
+    parser.add_argument('--busy-seconds', type=float, default=10.0)
+    parser.add_argument('--timeout', type=float, default=120.0, help='Longest wait for the backlog to drain')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    scenarios = {
+        'unthrottled': {'upload_busy_rate': None},
+        'throttled': {'upload_busy_rate': args.busy_kb * 1024},
+        'resized_first': {'upload_busy_rate': args.busy_kb * 1024, 'upload_resized_width': args.resized_width},
+    }
+    os.chdir(BASE_DIR)  # The watermark is loaded relative to the repository root
+    results = {'link_kb_per_second': args.link_kb}
+    for name in args.scenarios.split(','):
+        result = results[name] = run_scenario(scenarios[name], args)
+        busy = result['busy']
+        burst = [f"{t:.1f}s" if t is not None else 'never' for t in result['burst_uploaded_after_s']]
+        print(f"{name:>13}: busy upload {busy['upload_kb_per_second']:.0f} KiB/s, preview "
+              f"{busy['preview_fps_per_viewer']:.1f} fps, latency p50 {busy['preview_latency']['median_ms']:.0f} ms "
+              f"p95 {busy['preview_latency']['p95_ms']:.0f} ms; idle upload "
+              f"{result['idle']['upload_kb_per_second']:.0f} KiB/s; {result['files_uploaded_while_busy']}/"
+              f"{result['files']} files up while busy, burst after {', '.join(burst)}; "
+              f"drained in {result['drain_seconds']:.1f}s")
+
+    write_results('upload_scheduler', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
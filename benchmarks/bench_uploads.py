@@ -0,0 +1,144 @@
+"""
+Upload queue throughput and crash recovery against the local stand-in server.
+
+Throughput: uploads a batch of files with 1, 2 and 4 workers and reports
+files/s and MB/s. Crash recovery: a child process starts uploading, is killed
+with SIGKILL part-way through, and a second process resumes from the same
+journal; every file must arrive at least once.
+
+    python benchmarks/bench_uploads.py [--files 40] [--size-kb 800] [--fail-rate 0.1]
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from common import BASE_DIR, write_results
+from upload_standin import start_standin
+
+
+def _make_files(directory, count, size_kb, prefix):
+    payload = os.urandom(size_kb * 1024)
+    paths = []
+    for number in range(count):
+        path = os.path.join(directory, f"{prefix}_photo_{number}.jpg")
+        with open(path, 'wb') as f:
+            f.write(payload)
+        paths.append(path)
+    return paths
+
+
+def _wait_until_settled(journal, expected, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        counts = journal.counts()
+        if counts.get('done', 0) + counts.get('failed', 0) >= expected:
+            return counts
+        time.sleep(0.05)
+    return journal.counts()
+
+
+def run_throughput(url, directory, files, size_kb, workers):
+    from src.uploads import HttpUploader, UploadQueue
+
+    run_dir = os.path.join(directory, f"throughput_{workers}")
+    os.makedirs(run_dir)
+    paths = _make_files(run_dir, files, size_kb, prefix=f"w{workers}")
+    queue = UploadQueue(HttpUploader(url), os.path.join(run_dir, 'uploads.db'), workers=workers,
+                        base_delay=0.05, max_delay=0.5)
+    start = time.perf_counter()
+    for path in paths:
+        queue.add_to_queue(path)
+    counts = _wait_until_settled(queue.journal, files, timeout=300)
+    elapsed = time.perf_counter() - start
+    queue.stop()
+    return {
+        'workers': workers,
+        'seconds': elapsed,
+        'files_per_second': files / elapsed,
+        'megabytes_per_second': files * size_kb / 1024 / elapsed,
+        'journal': counts,
+    }
+
+
+_CHILD = '''
+import os, sys, time
+sys.path.insert(0, {base!r})
+from src.uploads import HttpUploader, UploadQueue
+queue = UploadQueue(HttpUploader({url!r}), {journal!r}, workers=2, base_delay=0.05, max_delay=0.5)
+queue.reconcile(sorted(os.path.join({dir!r}, f) for f in os.listdir({dir!r}) if f.endswith('.jpg')))
+for name in sorted(os.listdir({dir!r})):
+    if name.endswith('.jpg'):
+        queue.add_to_queue(os.path.join({dir!r}, name))
+while True:
+    time.sleep(0.1)
+'''
+
+
+def run_crash_recovery(url, standin_url, directory, files, size_kb, kill_after):
+    from src.uploads import UploadJournal
+
+    run_dir = os.path.join(directory, 'crash')
+    os.makedirs(run_dir)
+    _make_files(run_dir, files, size_kb, prefix='crash')
+    journal_path = os.path.join(run_dir, 'uploads.db')
+    # Create the journal up front so reconcile treats the files as new, not as pre-journal history
+    UploadJournal(journal_path).close()
+    code = _CHILD.format(base=BASE_DIR, url=url, journal=journal_path, dir=run_dir)
+
+    stats_url = f"{standin_url}/stats?prefix=crash_"
+    child = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL)
+    while requests.get(stats_url).json()['uploads'] < kill_after:
+        time.sleep(0.01)
+    child.send_signal(signal.SIGKILL)
+    child.wait()
+    uploaded_before_crash = requests.get(stats_url).json()['uploads']
+
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL)
+    journal = UploadJournal(journal_path)
+    counts = _wait_until_settled(journal, files, timeout=300)
+    recovery_s = time.perf_counter() - start
+    child.send_signal(signal.SIGKILL)
+    child.wait()
+    journal.close()
+    received = requests.get(stats_url).json()
+    return {
+        'files': files,
+        'files_received': received['files'],
+        'duplicate_uploads': received['duplicates'],
+        'uploaded_before_crash': uploaded_before_crash,
+        'recovery_seconds': recovery_s,
+        'journal_after_recovery': counts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=40)
+    parser.add_argument('--size-kb', type=int, default=800)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--fail-rate', type=float, default=0.1)
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    server, base_url = start_standin(latency=args.latency, fail_rate=args.fail_rate)
+    url = f"{base_url}/upload"
+    results = {'throughput': []}
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in (1, 2, 4):
+            results['throughput'].append(run_throughput(url, directory, args.files, args.size_kb, workers))
+        results['crash_recovery'] = run_crash_recovery(
+            url, base_url, directory, args.files, args.size_kb, kill_after=args.files // 3)
+    results['standin'] = server.state.stats()
+    server.shutdown()
+    write_results('uploads', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
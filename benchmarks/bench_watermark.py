@@ -0,0 +1,129 @@
+"""
+Compare the old and new watermark paths.
+
+Measures one-off preparation time and per-shot compositing time plus peak RSS
+for a 1080x1350 frame. Each variant runs in a fresh process so allocator reuse
+from one variant does not hide the peak of the next.
+
+    python benchmarks/bench_watermark.py [--iterations 30] [--output results.json]
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+
+from common import BASE_DIR, measure_peak_rss, summarize, time_calls, write_results
+
+WATERMARK_PATH = os.path.join(BASE_DIR, 'static', 'img', 'watermark.png')
+FRAME_SIZE = (1080, 1350)
+
+
+def _synthetic_jpeg():
+    from PIL import Image
+    import numpy as np
+
+    width, height = FRAME_SIZE
+    gradient = np.linspace(0, 255, width, dtype=np.uint8)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = gradient
+    frame[..., 1] = gradient[::-1]
+    frame[..., 2] = 128
+    stream = io.BytesIO()
+    Image.fromarray(frame).save(stream, format='JPEG', quality=90)
+    return stream.getvalue()
+
+
+def _legacy_prepare():
+    """The original getpixel/putpixel preparation from CameraCaptureSystem."""
+    from PIL import Image
+
+    with Image.open(WATERMARK_PATH) as watermark:
+        watermark = watermark.convert('RGBA')
+        if watermark.size[0] > FRAME_SIZE[0]:
+            scale_factor = FRAME_SIZE[0] / watermark.size[0]
+            watermark = watermark.resize((FRAME_SIZE[0], int(watermark.size[1] * scale_factor)),
+                                         Image.Resampling.LANCZOS)
+        transparent = Image.new('RGBA', watermark.size, (0, 0, 0, 0))
+        for x in range(watermark.size[0]):
+            for y in range(watermark.size[1]):
+                pixel = watermark.getpixel((x, y))
+                transparent.putpixel((x, y), (pixel[0], pixel[1], pixel[2], int(pixel[3] * 0.70)))
+        position = (0, FRAME_SIZE[1] - watermark.size[1] - 100)
+        return transparent, position
+
+
+def _run_variant(variant, iterations, queue):
+    from PIL import Image
+    from src.watermark import Watermark
+
+    jpeg = _synthetic_jpeg()
+
+    if variant == 'legacy':
+        start = time.perf_counter()
+        watermark, position = _legacy_prepare()
+        prepare_s = time.perf_counter() - start
+
+        def composite():
+            with Image.open(io.BytesIO(jpeg)) as img:
+                img = img.convert('RGBA')
+                img.paste(watermark, position, watermark)
+                return img.convert('RGB')
+    else:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            start = time.perf_counter()
+            watermark = Watermark(WATERMARK_PATH, frame_size=FRAME_SIZE, cache_dir=cache_dir)
+            prepare_s = time.perf_counter() - start
+            start = time.perf_counter()
+            watermark = Watermark(WATERMARK_PATH, frame_size=FRAME_SIZE, cache_dir=cache_dir)
+            cached_prepare_s = time.perf_counter() - start
+
+        def composite():
+            with Image.open(io.BytesIO(jpeg)) as img:
+                return watermark.apply(img)
+
+    # Decode cost is shared by both paths; report it so the difference is clear
+    def decode_only():
+        with Image.open(io.BytesIO(jpeg)) as img:
+            img.load()
+
+    decode = summarize(time_calls(decode_only, iterations))
+    samples = time_calls(composite, iterations)
+    _, peak_kb = measure_peak_rss(composite)
+
+    result = {
+        'prepare_ms': prepare_s * 1000,
+        'decode_only': decode,
+        'decode_and_composite': summarize(samples),
+        'composite_peak_rss_kb': peak_kb,
+    }
+    if variant != 'legacy':
+        result['prepare_cached_ms'] = cached_prepare_s * 1000
+    queue.put((variant, result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for variant in ('legacy', 'premultiplied'):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_variant, args=(variant, args.iterations, queue))
+        proc.start()
+        name, result = queue.get()
+        proc.join()
+        results[name] = result
+
+    legacy = results['legacy']['decode_and_composite']['median_ms']
+    new = results['premultiplied']['decode_and_composite']['median_ms']
+    results['speedup_median'] = legacy / new if new else None
+    write_results('watermark', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Small helpers shared by the standalone benchmark scripts."""
+import json
+import os
+import statistics
+import sys
+import time
+
+# Make `src` importable when a benchmark is run as `python benchmarks/<name>.py`
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+
+def summarize(samples):
+    """Return min/median/mean/p95/p99/max (in milliseconds) for a list of seconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    p99 = ordered[min(len(ordered) - 1, int(round(0.99 * (len(ordered) - 1))))]
+    return {
+        'count': len(ordered),
+        'min_ms': ordered[0] * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p95_ms': p95 * 1000,
+        'p99_ms': p99 * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def time_calls(fn, iterations, warmup=2):
+    """Call ``fn`` repeatedly and return the per-call durations in seconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _read_status_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_kb():
+    return _read_status_kb('VmRSS')
+
+
+def reset_peak_rss():
+    """Reset the kernel's RSS high-water mark (Linux only). Returns False if unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    return _read_status_kb('VmHWM')
+
+
+def measure_peak_rss(fn):
+    """
+    Run ``fn`` and return (result, extra peak RSS in KiB over the starting RSS).
+
+    Native allocations (PIL, libjpeg) are not visible to tracemalloc, so the
+    kernel's high-water mark is used instead. Returns None for the peak when the
+    platform does not expose it.
+    """
+    if not reset_peak_rss():
+        return fn(), None
+    baseline = current_rss_kb()
+    result = fn()
+    peak = peak_rss_kb()
+    if baseline is None or peak is None:
+        return result, None
+    return result, max(0, peak - baseline)
+
+
+def write_results(name, results, output=None):
+    """Write ``results`` as JSON (to ``output`` or stdout) with some run metadata."""
+    payload = {
+        'benchmark': name,
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'machine': os.uname().machine if hasattr(os, 'uname') else None,
+        'results': results,
+    }
+    text = json.dumps(payload, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return payload
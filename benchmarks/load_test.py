@@ -0,0 +1,416 @@
+"""
+End-to-end HTTP load test of the booth server.
+
+Starts app.py on simulated hardware (or targets a running booth with
+``--url``) and runs a mix of simulated guests against it for ``--seconds``:
+
+    viewer      keeps /video_feed open and counts the frames it receives
+    browser     loads /, pages through /api/photos and fetches thumbnails and
+                the odd full-size photo, with a think time between pages
+    capturer    presses the button: POST /jobs for a burst, follows the job's
+                events until it is done, waits, and presses again
+
+``--users`` guests are split between the roles by ``--mix`` weights. Reported:
+p50/p95/p99 latency, request count and error rate per endpoint (time to the
+first frame for /video_feed, time until the job is done for capture jobs),
+delivered frames per second per viewer, and the server's RSS and CPU sampled
+from /proc while the load runs. 429 answers from the job queue are counted as
+``busy``, not as errors. Results go out as JSON plus a text summary; the
+``--max-*``/``--min-*`` limits make the run exit with status 1 when they are
+not met, so it can gate a release before an event.
+
+    python benchmarks/load_test.py [--users 40] [--mix viewer=30,browser=9,capturer=1] [--seconds 30]
+                                   [--mode flask] [--url http://booth.local] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import urllib.parse
+
+from bench_serving_modes import _free_port, start_server
+from common import summarize, write_results
+
+ROLES = ('viewer', 'browser', 'capturer')
+DEFAULT_MIX = 'viewer=30,browser=9,capturer=1'
+
+
+class HttpError(Exception):
+    pass
+
+
+class Recorder:
+    """Latencies and outcomes per endpoint."""
+
+    def __init__(self):
+        self.endpoints = {}
+
+    def add(self, endpoint, seconds=None, status=None, error=None):
+        entry = self.endpoints.setdefault(endpoint, {'latencies': [], 'statuses': {}, 'errors': 0, 'busy': 0})
+        if error is not None or status is None or status >= 500 or status in (400, 404):
+            entry['errors'] += 1
+        elif status == 429:
+            entry['busy'] += 1
+        elif seconds is not None:
+            entry['latencies'].append(seconds)
+        key = str(status) if status is not None else type(error).__name__
+        entry['statuses'][key] = entry['statuses'].get(key, 0) + 1
+
+    def report(self):
+        report = {}
+        for endpoint, entry in sorted(self.endpoints.items()):
+            requests = sum(entry['statuses'].values())
+            report[endpoint] = {
+                'requests': requests,
+                'errors': entry['errors'],
+                'busy': entry['busy'],
+                'error_rate': entry['errors'] / requests if requests else 0.0,
+                'statuses': entry['statuses'],
+                'latency': summarize(entry['latencies']),
+            }
+        return report
+
+
+async def _open(host, port, method, path, body=None, timeout=10.0):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    data = json.dumps(body).encode() if body is not None else b''
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\nAccept-Encoding: gzip\r\n"
+    if body is not None:
+        head += f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+    writer.write(head.encode() + b"\r\n" + data)
+    await writer.drain()
+    status_line = await asyncio.wait_for(reader.readline(), timeout)
+    try:
+        status = int(status_line.split(b' ', 2)[1])
+    except (IndexError, ValueError):
+        writer.close()
+        raise HttpError(f"Bad status line {status_line!r}")
+    return reader, writer, status
+
+
+async def request(target, method, path, body=None, timeout=10.0):
+    """One request on a fresh connection. Returns (status, body)."""
+    reader, writer, status = await _open(*target, method, path, body, timeout)
+    try:
+        raw = await asyncio.wait_for(reader.read(-1), timeout)
+    finally:
+        writer.close()
+    head, _, payload = raw.partition(b'\r\n\r\n')
+    if b'transfer-encoding: chunked' in head.lower():
+        payload = _dechunk(payload)
+    return status, payload
+
+
+def _dechunk(payload):
+    out = bytearray()
+    while payload:
+        size_line, _, payload = payload.partition(b'\r\n')
+        size = int(size_line.split(b';')[0] or b'0', 16)
+        if size == 0:
+            break
+        out += payload[:size]
+        payload = payload[size + 2:]
+    return bytes(out)
+
+
+async def timed(recorder, endpoint, target, method, path, body=None, timeout=10.0):
+    start = time.perf_counter()
+    try:
+        status, payload = await request(target, method, path, body, timeout)
+    except (OSError, asyncio.TimeoutError, HttpError) as e:
+        recorder.add(endpoint, error=e)
+        return None, None
+    recorder.add(endpoint, time.perf_counter() - start, status)
+    return status, payload
+
+
+async def viewer(target, recorder, stop, frames, slot, tier):
+    """Hold a preview stream open, reconnecting if it drops, and count frames."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            reader, writer, status = await _open(*target, 'GET', f"/video_feed?tier={tier}")
+        except (OSError, asyncio.TimeoutError, HttpError) as e:
+            recorder.add('/video_feed', error=e)
+            await asyncio.sleep(1.0)
+            continue
+        first = True
+        try:
+            if status != 200:
+                recorder.add('/video_feed', status=status)
+                await asyncio.sleep(1.0)
+                continue
+            while not stop.is_set():
+                data = await asyncio.wait_for(reader.read(256 * 1024), 10.0)
+                if not data:
+                    break
+                count = data.count(b'--frame\r\n')
+                if count and first:
+                    first = False
+                    recorder.add('/video_feed', time.perf_counter() - start, status)
+                frames[slot].append((time.perf_counter(), count))
+        except (OSError, asyncio.TimeoutError) as e:
+            recorder.add('/video_feed', error=e)
+        finally:
+            writer.close()
+
+
+async def browser(target, recorder, stop, rng, think):
+    """Page through the gallery like a guest on a phone."""
+    while not stop.is_set():
+        await timed(recorder, '/', target, 'GET', '/')
+        cursor = None
+        for _ in range(rng.randint(1, 3)):
+            query = f"?limit=24&cursor={cursor}" if cursor else '?limit=24'
+            status, payload = await timed(recorder, '/api/photos', target, 'GET', f"/api/photos{query}")
+            if status != 200:
+                break
+            page = json.loads(payload)
+            photos = [p['filename'] for p in page['photos']]
+            for filename in rng.sample(photos, min(len(photos), 6)):
+                await timed(recorder, '/captures (thumbnail)', target, 'GET',
+                            f"/captures/{urllib.parse.quote(filename)}?w=320")
+            if photos and rng.random() < 0.3:
+                await timed(recorder, '/captures (full size)', target, 'GET',
+                            f"/captures/{urllib.parse.quote(rng.choice(photos))}")
+            cursor = page.get('next_cursor')
+            await asyncio.sleep(think * rng.uniform(0.5, 1.5))
+            if stop.is_set() or not cursor:
+                break
+
+
+async def capturer(target, recorder, stop, rng, interval):
+    """Press the capture button, follow the job to the end, repeat."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        status, payload = await timed(recorder, 'POST /jobs', target, 'POST', '/jobs', {'kind': 'burst'})
+        if status == 202:
+            job = json.loads(payload)
+            try:
+                reader, writer, events_status = await _open(*target, 'GET', job['events'], timeout=60.0)
+                try:
+                    raw = b''
+                    while not re.search(rb'event: (done|failed)\n', raw):
+                        data = await asyncio.wait_for(reader.read(4096), 60.0)
+                        if not data:
+                            break
+                        raw += data
+                finally:
+                    writer.close()
+                failed = b'event: failed' in raw or b'event: done' not in raw
+                recorder.add('capture job (submit to done)', time.perf_counter() - start,
+                             500 if failed else events_status)
+            except (OSError, asyncio.TimeoutError, HttpError) as e:
+                recorder.add('capture job (submit to done)', error=e)
+        await asyncio.sleep(interval * rng.uniform(0.5, 1.5))
+
+
+class ProcessSampler:
+    """Samples a local process's RSS and CPU time from /proc."""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.ticks = os.sysconf('SC_CLK_TCK')
+
+    def sample(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / self.ticks
+        rss_kb = None
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss_kb = int(line.split()[1])
+        self.samples.append((time.perf_counter(), cpu, rss_kb))
+
+    async def run(self, stop):
+        while not stop.is_set():
+            try:
+                self.sample()
+            except OSError:
+                return
+            await asyncio.sleep(self.interval)
+
+    def report(self):
+        if len(self.samples) < 2:
+            return None
+        (t0, cpu0, _), (t1, cpu1, _) = self.samples[0], self.samples[-1]
+        rss = [s[2] for s in self.samples if s[2] is not None]
+        return {
+            'cpu_core_share': (cpu1 - cpu0) / (t1 - t0),
+            'rss_mb_mean': sum(rss) / len(rss) / 1024,
+            'rss_mb_max': max(rss) / 1024,
+            'samples': len(self.samples),
+        }
+
+
+def split_users(users, mix):
+    """Turn ``--users`` and ``--mix`` weights into a count per role (largest remainder)."""
+    weights = {}
+    for item in mix.split(','):
+        role, _, weight = item.partition('=')
+        if role not in ROLES:
+            raise SystemExit(f"Unknown role {role!r} in --mix, expected {', '.join(ROLES)}")
+        weights[role] = float(weight or 1)
+    total = sum(weights.values())
+    exact = {role: users * w / total for role, w in weights.items()}
+    counts = {role: int(v) for role, v in exact.items()}
+    for role in sorted(exact, key=lambda r: exact[r] - counts[r], reverse=True)[:users - sum(counts.values())]:
+        counts[role] += 1
+    # Every role in the mix gets at least one guest, taken from the largest role
+    for role, weight in weights.items():
+        if weight > 0 and counts[role] == 0:
+            largest = max(counts, key=counts.get)
+            if counts[largest] > 1:
+                counts[largest] -= 1
+                counts[role] = 1
+    return {role: counts.get(role, 0) for role in ROLES}
+
+
+async def seed(target, bursts):
+    """Take a few bursts up front so the gallery has photos to browse."""
+    for _ in range(bursts):
+        status, payload = await request(target, 'POST', '/capture_3', timeout=60.0)
+        if status != 200:
+            print(f"Seeding burst failed with {status}: {payload[:200]!r}")
+
+
+async def run_load(target, args, pid=None):
+    counts = split_users(args.users, args.mix)
+    recorder = Recorder()
+    stop = asyncio.Event()
+    rng = random.Random(args.seed)
+    frames = [[] for _ in range(counts['viewer'])]
+    sampler = ProcessSampler(pid) if pid else None
+
+    await seed(target, args.seed_bursts)
+    tasks = [asyncio.create_task(viewer(target, recorder, stop, frames, slot, args.viewer_tier))
+             for slot in range(counts['viewer'])]
+    tasks += [asyncio.create_task(browser(target, recorder, stop, random.Random(rng.random()), args.think))
+              for _ in range(counts['browser'])]
+    tasks += [asyncio.create_task(capturer(target, recorder, stop, random.Random(rng.random()), args.capture_interval))
+              for _ in range(counts['capturer'])]
+    # Frame rates and server load are measured after the ramp-up
+    await asyncio.sleep(args.ramp)
+    measure_start = time.perf_counter()
+    sampler_task = asyncio.create_task(sampler.run(stop)) if sampler else None
+    await asyncio.sleep(args.seconds)
+    measure_end = time.perf_counter()
+    stop.set()
+    await asyncio.wait(tasks, timeout=max(10.0, args.capture_interval * 2 + 60))
+    for task in tasks:
+        task.cancel()
+    if sampler_task:
+        await sampler_task
+
+    fps = [sum(n for t, n in viewer_frames if measure_start <= t <= measure_end) / (measure_end - measure_start)
+           for viewer_frames in frames]
+    endpoints = recorder.report()
+    requests = sum(e['requests'] for e in endpoints.values())
+    errors = sum(e['errors'] for e in endpoints.values())
+    return {
+        'users': counts,
+        'seconds': measure_end - measure_start,
+        'endpoints': endpoints,
+        'error_rate': errors / requests if requests else 0.0,
+        'viewer_fps': {
+            'mean': sum(fps) / len(fps) if fps else None,
+            'min': min(fps) if fps else None,
+            'per_viewer': fps,
+        },
+        'server': sampler.report() if sampler else None,
+    }
+
+
+def check_limits(result, args):
+    """Return the limits the run did not meet."""
+    failures = []
+    if args.max_error_rate is not None and result['error_rate'] > args.max_error_rate:
+        failures.append(f"error rate {result['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    if args.min_viewer_fps is not None and result['viewer_fps']['min'] is not None \
+            and result['viewer_fps']['min'] < args.min_viewer_fps:
+        failures.append(f"slowest viewer {result['viewer_fps']['min']:.1f} fps < {args.min_viewer_fps} fps")
+    if args.max_p95_ms is not None:
+        for endpoint, stats in result['endpoints'].items():
+            p95 = stats['latency'].get('p95_ms')
+            if endpoint.startswith(('/', 'POST')) and p95 is not None and p95 > args.max_p95_ms:
+                failures.append(f"{endpoint} p95 {p95:.0f} ms > {args.max_p95_ms:.0f} ms")
+    server = result['server']
+    if args.max_rss_mb is not None and server and server['rss_mb_max'] > args.max_rss_mb:
+        failures.append(f"server RSS {server['rss_mb_max']:.0f} MiB > {args.max_rss_mb:.0f} MiB")
+    return failures
+
+
+def summary(result):
+    lines = [f"{sum(result['users'].values())} users ("
+             + ", ".join(f"{n} {role}s" for role, n in result['users'].items())
+             + f") for {result['seconds']:.0f}s, error rate {result['error_rate']:.2%}"]
+    lines.append(f"{'endpoint':<30} {'requests':>8} {'errors':>6} {'busy':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in result['endpoints'].items():
+        latency = stats['latency']
+        values = [latency.get(k) for k in ('median_ms', 'p95_ms', 'p99_ms')]
+        lines.append(f"{endpoint:<30} {stats['requests']:>8} {stats['errors']:>6} {stats['busy']:>5} "
+                     + ' '.join(f"{v:>8.1f}" if v is not None else f"{'-':>8}" for v in values))
+    fps = result['viewer_fps']
+    if fps['mean'] is not None:
+        lines.append(f"viewers: {fps['mean']:.1f} fps mean, {fps['min']:.1f} fps slowest")
+    if result['server']:
+        server = result['server']
+        lines.append(f"server: {server['cpu_core_share'] * 100:.0f}% of a core, "
+                     f"RSS {server['rss_mb_mean']:.0f} MiB mean / {server['rss_mb_max']:.0f} MiB max")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Relative weights of viewer, browser and capturer')
+    parser.add_argument('--seconds', type=float, default=30.0, help='Measured time under load')
+    parser.add_argument('--ramp', type=float, default=3.0, help='Seconds of load before measuring')
+    parser.add_argument('--mode', default='flask', choices=('flask', 'asgi'), help='Server to start')
+    parser.add_argument('--url', help='Load an already running booth instead of starting one')
+    parser.add_argument('--pid', type=int, help='Server process to sample with --url, if it is local')
+    parser.add_argument('--viewer-tier', default='kiosk')
+    parser.add_argument('--think', type=float, default=2.0, help='Mean seconds a browser spends on a page')
+    parser.add_argument('--capture-interval', type=float, default=5.0, help='Mean seconds between button presses')
+    parser.add_argument('--seed-bursts', type=int, default=2, help='Bursts taken before the load starts')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the guests')
+    parser.add_argument('--max-error-rate', type=float)
+    parser.add_argument('--min-viewer-fps', type=float)
+    parser.add_argument('--max-p95-ms', type=float, help='Limit for every request endpoint (not streams or jobs)')
+    parser.add_argument('--max-rss-mb', type=float)
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    if args.url:
+        parsed = urllib.parse.urlparse(args.url)
+        result = asyncio.run(run_load((parsed.hostname, parsed.port or 80), args, pid=args.pid))
+        result['target'] = args.url
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            port = _free_port()
+            proc = start_server(args.mode, directory, port)
+            try:
+                result = asyncio.run(run_load(('127.0.0.1', port), args, pid=proc.pid))
+            finally:
+                proc.terminate()
+                proc.wait(timeout=15)
+        result['target'] = f"app.py ({args.mode}, simulated hardware)"
+
+    result['limits'] = {'failed': check_limits(result, args)}
+    print(summary(result))
+    for failure in result['limits']['failed']:
+        print(f"LIMIT NOT MET: {failure}")
+    write_results('load_test', result, args.output)
+    if result['limits']['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Capture pipeline benchmark suite on the simulated hardware backend.
+
+Stages:
+    capture_to_file   shutter call until the watermarked file is on disk
+    burst_timing      drift of capture_image_3's shots from their 1 s targets
+    watermark         compositing cost on a full-size frame
+    mjpeg_throughput  frames delivered per second to N concurrent viewers
+
+Results are written as JSON; pass --baseline with an earlier run to print the
+change per stage.
+
+    python benchmarks/run_suite.py [--stages capture_to_file,mjpeg_throughput] [--output run.json]
+                                   [--baseline previous.json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from common import BASE_DIR, summarize, time_calls, write_results
+
+STAGES = ('capture_to_file', 'burst_timing', 'watermark', 'mjpeg_throughput')
+
+
+def _camera_system(directory, fps):
+    from src.camera_capture import CameraCaptureSystem
+    from src.simulated import SimulatedHardware, SimulatedUploader
+
+    return CameraCaptureSystem(
+        capture_dir=os.path.join(directory, 'captures'),
+        cache_dir=os.path.join(directory, 'cache'),
+        uploader=SimulatedUploader(),
+        hardware=SimulatedHardware(fps=fps),
+    )
+
+
+def bench_capture_to_file(system, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        with system.capture_lock:
+            filename, _ = system._capture_single_image()
+        system.wait_for_photo(os.path.basename(filename), timeout=10)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_burst_timing(system, bursts):
+    drifts = [[] for _ in range(3)]
+    for _ in range(bursts):
+        system.capture_image_3()
+        for shot, drift in enumerate(system.last_burst_drift):
+            drifts[shot].append(drift)
+    return {f"shot_{i + 1}_drift": summarize(d) for i, d in enumerate(drifts)}
+
+
+def bench_watermark(system, iterations):
+    import numpy as np
+    from PIL import Image
+
+    frame = Image.fromarray(np.full((1350, 1080, 3), 128, dtype=np.uint8))
+    return summarize(time_calls(lambda: system.prepared_watermark.apply(frame), iterations))
+
+
+def bench_mjpeg_throughput(system, viewers, seconds):
+    hub = system.stream_hub
+    if not system.streaming:
+        system.start_mjpeg_stream()
+    counts = [0] * viewers
+    stop = threading.Event()
+
+    def viewer(index):
+        stream = system.mjpeg_generator()
+        for _ in stream:
+            counts[index] += 1
+            if stop.is_set():
+                break
+        stream.close()
+
+    published_before = system.output.sequence
+    threads = [threading.Thread(target=viewer, args=(i,), daemon=True) for i in range(viewers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    elapsed = time.perf_counter() - start
+    stats = hub.stats()
+    return {
+        'viewers': viewers,
+        'encoder_fps': (system.output.sequence - published_before) / elapsed,
+        'delivered_fps_per_viewer': {
+            'min': min(counts) / elapsed,
+            'mean': sum(counts) / len(counts) / elapsed,
+            'max': max(counts) / elapsed,
+        },
+        'frames_dropped': stats['frames_dropped'],
+    }
+
+
+def compare(results, baseline_path):
+    """Print the relative change of each stage's median against a previous run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    def medians(prefix, node, out):
+        if isinstance(node, dict):
+            if 'median_ms' in node:
+                out[prefix] = node['median_ms']
+            for key, value in node.items():
+                medians(f"{prefix}.{key}" if prefix else key, value, out)
+        elif isinstance(node, list):
+            for i, value in enumerate(node):
+                medians(f"{prefix}[{i}]", value, out)
+        return out
+
+    old, new = medians('', baseline, {}), medians('', results, {})
+    for key in sorted(set(old) & set(new)):
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        print(f"{key:<60} {old[key]:>10.3f} -> {new[key]:>10.3f}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--bursts', type=int, default=2)
+    parser.add_argument('--fps', type=int, default=15)
+    parser.add_argument('--viewers', default='1,10')
+    parser.add_argument('--seconds', type=float, default=3.0, help='Duration of each MJPEG run')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(BASE_DIR)  # The watermark is loaded relative to the repository root
+        system = _camera_system(directory, args.fps)
+        try:
+            if 'capture_to_file' in stages:
+                results['capture_to_file'] = bench_capture_to_file(system, args.iterations)
+            if 'burst_timing' in stages:
+                results['burst_timing'] = bench_burst_timing(system, args.bursts)
+            if 'watermark' in stages:
+                results['watermark'] = bench_watermark(system, args.iterations)
+            if 'mjpeg_throughput' in stages:
+                results['mjpeg_throughput'] = [
+                    bench_mjpeg_throughput(system, int(v), args.seconds) for v in args.viewers.split(',')
+                ]
+        finally:
+            system.cleanup()
+
+    write_results('capture_pipeline', results, args.output)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Local stand-in for the upload backend.
+
+Accepts multipart POSTs from src.uploads.HttpUploader, optionally adds latency
+or random failures, and reports what it received on GET /stats[?prefix=<filename prefix>].
+``--bandwidth-kb`` reads request bodies no faster than a slow uplink would
+carry them; benchmarks can instead pass a shared ``link`` (anything with
+``take(nbytes)`` returning seconds to wait, e.g. src.upload_scheduler.TokenBucket)
+that other traffic also goes through.
+
+    python benchmarks/upload_standin.py [--port 8099] [--latency 0.05] [--fail-rate 0.1] [--bandwidth-kb 256]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+_FILENAME = re.compile(rb'filename="([^"]+)"')
+
+
+class StandinState:
+    def __init__(self, latency=0.0, fail_rate=0.0, link=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.link = link
+        self.lock = threading.Lock()
+        self.received = Counter()
+        self.bytes_received = 0
+        self.failures_injected = 0
+        self.started = time.time()
+
+    def stats(self, prefix=''):
+        with self.lock:
+            received = [n for name, n in self.received.items() if (name or '').startswith(prefix)]
+            return {
+                'files': len(received),
+                'uploads': sum(received),
+                'duplicates': sum(n - 1 for n in received),
+                'bytes_received': self.bytes_received,
+                'failures_injected': self.failures_injected,
+                'uptime_seconds': time.time() - self.started,
+            }
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/stats':
+            prefix = parse_qs(url.query).get('prefix', [''])[0]
+            self._send_json(200, self.server.state.stats(prefix))
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length', 0))
+        remaining = length
+        name = None
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            if state.link is not None:
+                time.sleep(state.link.take(len(chunk)))
+            if name is None:
+                match = _FILENAME.search(chunk)
+                if match:
+                    name = match.group(1).decode(errors='replace')
+            remaining -= len(chunk)
+
+        if state.latency:
+            time.sleep(state.latency)
+        if state.fail_rate and random.random() < state.fail_rate:
+            with state.lock:
+                state.failures_injected += 1
+            self._send_json(503, {'error': 'injected failure'})
+            return
+
+        with state.lock:
+            state.received[name] += 1
+            state.bytes_received += length
+        self._send_json(200, {'id': uuid.uuid4().hex, 'name': name})
+
+
+def start_standin(port=0, latency=0.0, fail_rate=0.0, link=None):
+    """Start the stand-in server on a background thread. Returns (server, base URL)."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandinHandler)
+    server.daemon_threads = True
+    server.state = StandinState(latency=latency, fail_rate=fail_rate, link=link)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every upload')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of uploads answered with 503')
+    parser.add_argument('--bandwidth-kb', type=float, help='Cap on the rate request bodies are read at, KiB/s')
+    args = parser.parse_args()
+
+    link = None
+    if args.bandwidth_kb:
+        import common  # Puts the repository root on sys.path for src
+        from src.upload_scheduler import TokenBucket
+
+        link = TokenBucket(args.bandwidth_kb * 1024, burst=64 * 1024)
+    server, url = start_standin(args.port, args.latency, args.fail_rate, link)
+    print(f"Upload stand-in listening on {url}/upload (stats at {url}/stats)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""
+Async (ASGI) serving mode with the same URL surface as the Flask app.
+
+Stream viewers are async generators on the event loop instead of one OS
+thread each. Capture requests wait for their job on the event loop. Waits on
+the camera pipeline (post-processing, stream start) and gallery I/O
+(thumbnails, index pages) run on two separate small executors, so a slow
+capture never holds up the gallery. Requires the optional
+``starlette`` and ``uvicorn`` packages:
+
+    PHOTOBOOTH_SERVER=asgi python app.py
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+
+from src.assets import AssetPipeline
+from src.camera_capture import DEFAULT_PREVIEW_TIER
+from src.derivatives import DerivativeError, PhotoNotFound
+from src.jobs import JobQueueFull, sse_format
+from src.metrics import METRICS
+from src.startup import STARTUP, health_report
+from src.sync import MANIFEST_PAGE
+from src.uploads import guess_mime_type
+
+
+def _not_initialized():
+    return JSONResponse({'status': 'error', 'message': 'Camera system not initialized'}, status_code=500)
+
+
+def _starting(camera_system):
+    return JSONResponse(health_report(camera_system is not None), status_code=503, headers={'Retry-After': '1'})
+
+
+def _queue_full(error):
+    return JSONResponse({'status': 'busy', 'message': str(error)}, status_code=429, headers={'Retry-After': '5'})
+
+
+async def _run_job(camera_system, kind):
+    """Queue a capture job and wait for it on the event loop, so no executor thread is held for the capture."""
+    job, _ = camera_system.jobs.submit(kind)
+    await job.wait_async()
+    if job.state != 'done':
+        raise RuntimeError(job.error)
+    return job
+
+
+def create_asgi_app(get_camera_system, base_dir, reel_size=3, api_page_limit=200,
+                    photo_max_age=365 * 24 * 3600, capture_workers=2, io_workers=2, sse_keepalive=15, assets=None,
+                    aggregator=False, sync_max_wait=30):
+    """
+    Build the Starlette application.
+
+    Args:
+        get_camera_system (callable): Returns the current CameraCaptureSystem (or GalleryAggregator) or None
+        base_dir (str): Repository root holding ``templates`` and ``static``
+        capture_workers (int): Threads for blocking waits on the camera pipeline
+        io_workers (int): Threads for gallery I/O (thumbnails, index pages, feed catch-up)
+        sse_keepalive (float): Seconds between keepalive comments on idle job event streams
+        assets (AssetPipeline): Built static assets; defaults to serving ``static`` as-is
+        aggregator (bool): ``get_camera_system`` returns a GalleryAggregator; the camera routes are left out
+        sync_max_wait (float): Longest a /sync/manifest request waits for a new capture
+    """
+    templates = Jinja2Templates(directory=os.path.join(base_dir, 'templates'))
+    if assets is None:
+        assets = AssetPipeline(os.path.join(base_dir, 'static'), os.path.join(base_dir, 'cache', 'assets'),
+                               enabled=False)
+    templates.env.globals['asset_url'] = assets.url
+    executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='asgi-io')
+    camera_executor = ThreadPoolExecutor(max_workers=capture_workers, thread_name_prefix='asgi-camera')
+    cache_control = f"public, max-age={photo_max_age}, immutable"
+
+    async def run_blocking(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def wait_on_camera(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(camera_executor, fn, *args)
+
+    async def index(request):
+        camera_system = get_camera_system()
+        photos = [r.filename for r in camera_system.photo_index.latest(reel_size)] if camera_system else []
+        return templates.TemplateResponse(request, 'index.html', {'photos': photos})
+
+    async def gallery(request):
+        return templates.TemplateResponse(request, 'gallery.html', {})
+
+    async def api_photos(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _not_initialized()
+        try:
+            cursor = request.query_params.get('cursor')
+            cursor = int(cursor) if cursor is not None else None
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), api_page_limit)
+        except ValueError:
+            return JSONResponse({'status': 'error', 'message': 'Invalid cursor or limit'}, status_code=400)
+        records, next_cursor = await run_blocking(lambda: camera_system.photo_index.page(cursor, limit))
+        return JSONResponse({
+            'photos': [r.as_dict() for r in records],
+            'next_cursor': next_cursor,
+            'total': len(camera_system.photo_index),
+        })
+
+    async def healthz(request):
+        report = health_report(get_camera_system() is not None)
+        return JSONResponse(report, status_code=503 if report['status'] == 'failed' else 200)
+
+    async def readyz(request):
+        camera_system = get_camera_system()
+        if camera_system is None or not STARTUP.ready:
+            return _starting(camera_system)
+        return JSONResponse(health_report(True))
+
+    async def video_feed(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _starting(camera_system)
+        tier = request.query_params.get('tier', DEFAULT_PREVIEW_TIER)
+        if tier not in camera_system.preview_tiers:
+            return JSONResponse({'status': 'error', 'message': f"Unknown preview tier {tier!r}",
+                                 'tiers': sorted(camera_system.preview_tiers)}, status_code=400)
+        hub = camera_system.stream_hub
+        if hub._loop is None:
+            hub.attach_loop(asyncio.get_running_loop())
+        if not camera_system.streaming:
+            with METRICS.stage('stream_start'):
+                await wait_on_camera(camera_system.start_mjpeg_stream)
+        peer = request.client.host if request.client else None
+        stream = hub.subscribe_async(max_fps=camera_system.preview_tiers[tier], tier=tier, peer=peer)
+        return StreamingResponse(stream, media_type='multipart/x-mixed-replace; boundary=frame')
+
+    async def video_feed_stats(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _not_initialized()
+        return JSONResponse(camera_system.stream_hub.stats())
+
+    async def metrics(request):
+        return Response(METRICS.render(), media_type='text/plain; version=0.0.4')
+
+    async def capture(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _not_initialized()
+        try:
+            job = await _run_job(camera_system, 'photo')
+        except JobQueueFull as e:
+            return _queue_full(e)
+        return JSONResponse({'status': 'success', 'filename': os.path.basename(job.filenames[0])})
+
+    async def capture_3(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _not_initialized()
+        try:
+            job = await _run_job(camera_system, 'burst')
+        except JobQueueFull as e:
+            return _queue_full(e)
+        return JSONResponse({
+            'status': 'success',
+            'filenames': [os.path.basename(f) for f in job.filenames],
+            'collages': [os.path.basename(f) for f in job.collages],
+        })
+
+    async def create_job(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _not_initialized()
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        kind = (body.get('kind') if isinstance(body, dict) else None) or request.query_params.get('kind', 'burst')
+        try:
+            job, coalesced = camera_system.jobs.submit(kind)
+        except JobQueueFull as e:
+            return _queue_full(e)
+        except ValueError as e:
+            return JSONResponse({'status': 'error', 'message': str(e)}, status_code=400)
+        return JSONResponse(dict(job.as_dict(), coalesced=coalesced), status_code=202)
+
+    def _get_job(request):
+        camera_system = get_camera_system()
+        return camera_system.jobs.get(request.path_params['job_id']) if camera_system else None
+
+    async def get_job(request):
+        job = _get_job(request)
+        if job is None:
+            return JSONResponse({'status': 'error', 'message': 'Unknown job'}, status_code=404)
+        return JSONResponse(job.as_dict())
+
+    async def job_events(request):
+        job = _get_job(request)
+        if job is None:
+            return JSONResponse({'status': 'error', 'message': 'Unknown job'}, status_code=404)
+        try:
+            last_id = int(request.headers.get('last-event-id') or request.query_params.get('since', 0))
+        except ValueError:
+            last_id = 0
+
+        async def stream(last_id):
+            while True:
+                events, closed = await job.events_since_async(last_id, timeout=sse_keepalive)
+                for event in events:
+                    last_id = event['id']
+                    yield sse_format(event)
+                if closed:
+                    return
+                if not events:
+                    yield ': keepalive\n\n'
+
+        return StreamingResponse(stream(last_id), media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    async def feed(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _starting(camera_system)
+        try:
+            since = request.headers.get('last-event-id') or request.query_params.get('since')
+            since = int(since) if since else None
+        except ValueError:
+            return JSONResponse({'status': 'error', 'message': 'Invalid since'}, status_code=400)
+        subscription = await run_blocking(camera_system.feed.subscribe, since)
+
+        async def stream():
+            try:
+                yield 'retry: 2000\n\n'
+                while True:
+                    events = await subscription.next_async(timeout=sse_keepalive)
+                    if events:
+                        yield ''.join(events)
+                    else:
+                        yield ': keepalive\n\n'
+            finally:
+                subscription.close()
+
+        return StreamingResponse(stream(), media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    async def serve_photo(request):
+        filename = request.path_params['filename']
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _starting(camera_system)
+        if not await wait_on_camera(camera_system.wait_for_photo, filename, 3.0):
+            return JSONResponse({'status': 'pending', 'filename': filename}, status_code=202,
+                                headers={'Retry-After': '1'})
+
+        width = request.query_params.get('w')
+        fmt = request.query_params.get('fmt')
+        if width or fmt:
+            try:
+                path, etag, mimetype = await run_blocking(camera_system.derivatives.get, filename, width, fmt)
+            except PhotoNotFound as e:
+                return JSONResponse({'status': 'error', 'message': str(e)}, status_code=404)
+            except DerivativeError as e:
+                return JSONResponse({'status': 'error', 'message': str(e)}, status_code=400)
+            etag = f'"{etag}"'
+        else:
+            path = camera_system.storage.resolve(filename)
+            if path is None or not os.path.isfile(path):
+                return JSONResponse({'status': 'error', 'message': 'Not found'}, status_code=404)
+            stat = os.stat(path)
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            mimetype = guess_mime_type(path)
+
+        headers = {'ETag': etag, 'Cache-Control': cache_control}
+        if etag in request.headers.get('if-none-match', ''):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, media_type=mimetype, headers=headers)
+
+    async def sync_manifest(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _starting(camera_system)
+        params = request.query_params
+        try:
+            since = int(params.get('since', 0))
+            limit = min(max(int(params.get('limit', MANIFEST_PAGE)), 1), MANIFEST_PAGE)
+            wait = min(max(float(params.get('wait', 0)), 0), sync_max_wait)
+        except ValueError:
+            return JSONResponse({'status': 'error', 'message': 'Invalid since, limit or wait'}, status_code=400)
+        return JSONResponse(await camera_system.manifest.changes_async(params.get('epoch'), since, limit, wait))
+
+    async def sync_status(request):
+        camera_system = get_camera_system()
+        if not camera_system:
+            return _starting(camera_system)
+        return JSONResponse(camera_system.stats())
+
+    async def serve_static(request):
+        filename = request.path_params['filename']
+        asset = assets.resolve(filename, request.headers.get('accept-encoding', ''))
+        if asset is None:
+            return JSONResponse({'status': 'error', 'message': 'Not found'}, status_code=404)
+        etag = f'"{asset.etag}"'
+        headers = dict(asset.headers, ETag=etag)
+        if etag in request.headers.get('if-none-match', ''):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(asset.path, media_type=asset.mimetype, headers=headers)
+
+    routes = [
+        Route('/', index),
+        Route('/gallery', gallery),
+        Route('/api/photos', api_photos),
+        Route('/metrics', metrics),
+        Route('/healthz', healthz),
+        Route('/readyz', readyz),
+        Route('/feed', feed),
+        Route('/captures/{filename:path}', serve_photo),
+        Route('/static/{filename:path}', serve_static),
+    ]
+    if aggregator:
+        routes.append(Route('/sync/status', sync_status))
+    else:
+        routes += [
+            Route('/video_feed', video_feed),
+            Route('/video_feed/stats', video_feed_stats),
+            Route('/capture', capture, methods=['POST']),
+            Route('/capture_3', capture_3, methods=['POST']),
+            Route('/jobs', create_job, methods=['POST']),
+            Route('/jobs/{job_id}', get_job),
+            Route('/jobs/{job_id}/events', job_events),
+            Route('/sync/manifest', sync_manifest),
+        ]
+    return Starlette(routes=routes)
+
+
+def serve(asgi_app, host='0.0.0.0', port=80):
+    import uvicorn
+
+    uvicorn.run(asgi_app, host=host, port=port, log_level='warning')
@@ -0,0 +1,316 @@
+"""
+Fingerprinted, precompressed static assets.
+
+``AssetPipeline.build()`` copies ``static/`` into a build directory:
+
+    images      re-saved losslessly with optimized encoding (kept only if smaller)
+    css/js      literal ``/static/...`` references to other assets rewritten to
+                their fingerprinted URLs
+    every file  also written as ``name.<hash>.ext``; text assets get ``.gz``
+                (and ``.br`` with the optional ``brotli`` package) next to them
+                when that saves bytes
+
+Templates link assets through ``asset_url('css/style.css')``. Fingerprinted
+URLs are served as immutable for a year; plain URLs (e.g. paths JavaScript
+builds at runtime) stay revalidated with ETags. The build is skipped when the
+manifest's signature of the source files still matches, so it is cheap at
+start-up, and it can be run ahead of time with
+
+    python -m src.assets build [--static static] [--output cache/assets]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import time
+
+from PIL import Image
+
+MANIFEST_NAME = 'manifest.json'
+# Bumped when the build output changes for the same sources
+PIPELINE_VERSION = 1
+HASH_LENGTH = 10
+TEXT_EXTENSIONS = ('.css', '.js', '.html', '.svg', '.json', '.txt')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Leftovers that should not be published
+SKIP_SUFFIXES = ('.old', '.orig', '.bak', '~')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+# Text assets smaller than this are not worth a compressed copy
+MIN_COMPRESS_BYTES = 256
+
+_REFERENCE = re.compile(r'''(?P<quote>['"`(])/static/(?P<path>[^'"`()\s?#]+)''')
+
+
+class Asset:
+    """One file to send for a static URL, with the headers that go with it."""
+
+    def __init__(self, path, mimetype, encoding=None, immutable=False):
+        self.path = path
+        self.mimetype = mimetype
+        self.encoding = encoding
+        self.immutable = immutable
+        stat = os.stat(path)
+        self.etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    @property
+    def headers(self):
+        headers = {
+            'Cache-Control': IMMUTABLE if self.immutable else REVALIDATE,
+            'Vary': 'Accept-Encoding',
+        }
+        if self.encoding:
+            headers['Content-Encoding'] = self.encoding
+        return headers
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def accepted_encodings(header):
+    """Content codings a client accepts, from its Accept-Encoding header."""
+    accepted = set()
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def fingerprint(relpath, data):
+    stem, ext = os.path.splitext(relpath)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+class AssetPipeline:
+    """Builds the static directory into fingerprinted, precompressed assets and resolves URLs to them."""
+
+    def __init__(self, static_dir, build_dir, enabled=True):
+        """
+        Args:
+            static_dir (str): Source directory, served under ``/static``
+            build_dir (str): Where the built assets and their manifest go
+            enabled (bool): False serves ``static_dir`` as-is, e.g. to compare against
+        """
+        self.static_dir = os.path.abspath(static_dir)
+        self.build_dir = os.path.abspath(build_dir)
+        self.enabled = enabled
+        # Logical path (e.g. 'css/style.css') -> fingerprinted path
+        self.manifest = {}
+        self.fingerprinted = set()
+        self.encodings = {}
+        self.built = False
+
+    # Build
+
+    def sources(self):
+        """Relative paths of the files to publish, in a stable order."""
+        found = []
+        for directory, dirnames, filenames in os.walk(self.static_dir):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for name in filenames:
+                if name.startswith('.') or name.endswith(SKIP_SUFFIXES):
+                    continue
+                found.append(os.path.relpath(os.path.join(directory, name), self.static_dir).replace(os.sep, '/'))
+        return sorted(found)
+
+    def signature(self, sources):
+        digest = hashlib.sha256(f"v{PIPELINE_VERSION} br={_brotli() is not None}".encode())
+        for relpath in sources:
+            stat = os.stat(os.path.join(self.static_dir, relpath))
+            digest.update(f"{relpath}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+
+    def load(self):
+        """Use an existing build if it exists. Returns its signature, or None."""
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.manifest = manifest['assets']
+        self.fingerprinted = set(self.manifest.values())
+        self.encodings = manifest.get('encodings', {})
+        self.built = True
+        return manifest.get('signature')
+
+    def build(self, force=False):
+        """
+        Bring the build directory up to date with ``static_dir``.
+
+        Returns:
+            dict: Byte counts of the sources and the built output, or None if nothing had to be done
+        """
+        if not self.enabled:
+            return None
+        sources = self.sources()
+        signature = self.signature(sources)
+        if not force and self.load() == signature:
+            return None
+
+        start = time.perf_counter()
+        staging = f"{self.build_dir}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        report = {'files': len(sources), 'source_bytes': 0, 'built_bytes': 0, 'gzip_bytes': 0, 'brotli_bytes': 0}
+        manifest, encodings = {}, {}
+        # Images first, so stylesheets and scripts can point at their fingerprinted names
+        ordered = sorted(sources, key=lambda p: (os.path.splitext(p)[1].lower() in TEXT_EXTENSIONS, p))
+        for relpath in ordered:
+            with open(os.path.join(self.static_dir, relpath), 'rb') as f:
+                data = f.read()
+            report['source_bytes'] += len(data)
+            ext = os.path.splitext(relpath)[1].lower()
+            if ext in IMAGE_EXTENSIONS:
+                data = self._optimize_image(relpath, data)
+            elif ext in TEXT_EXTENSIONS:
+                data = self._rewrite(data, manifest)
+            hashed = fingerprint(relpath, data)
+            manifest[relpath] = hashed
+            report['built_bytes'] += len(data)
+            for name in (relpath, hashed):
+                self._write(staging, name, data)
+            if ext in TEXT_EXTENSIONS and len(data) >= MIN_COMPRESS_BYTES:
+                encodings[relpath] = self._precompress(staging, (relpath, hashed), data, report)
+
+        with open(os.path.join(staging, MANIFEST_NAME), 'w') as f:
+            json.dump({'signature': signature, 'assets': manifest, 'encodings': encodings}, f, indent=1, sort_keys=True)
+        # Swap the finished build in; a crash mid-build leaves the old one in place
+        previous = f"{self.build_dir}.old"
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(self.build_dir):
+            os.replace(self.build_dir, previous)
+        os.replace(staging, self.build_dir)
+        shutil.rmtree(previous, ignore_errors=True)
+
+        self.manifest = manifest
+        self.fingerprinted = set(manifest.values())
+        self.encodings = encodings
+        self.built = True
+        report['seconds'] = time.perf_counter() - start
+        print(f"Built {len(sources)} static assets in {report['seconds']:.2f}s: "
+              f"{report['source_bytes'] / 1024:.0f} KiB -> {report['built_bytes'] / 1024:.0f} KiB"
+              + ("" if _brotli() else " (brotli not installed, gzip only)"))
+        return report
+
+    @staticmethod
+    def _write(root, relpath, data):
+        path = os.path.join(root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    @staticmethod
+    def _optimize_image(relpath, data):
+        """Re-encode without changing a pixel; keep the original bytes if that is not smaller."""
+        import io
+
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                out = io.BytesIO()
+                if img.format == 'PNG':
+                    img.save(out, format='PNG', optimize=True)
+                elif img.format == 'JPEG':
+                    # 'keep' reuses the quantization tables, so only the entropy coding changes
+                    img.save(out, format='JPEG', quality='keep', optimize=True, progressive=True)
+                else:
+                    return data
+        except Exception as e:
+            print(f"Not optimizing {relpath}: {e}")
+            return data
+        return out.getvalue() if out.tell() < len(data) else data
+
+    @staticmethod
+    def _rewrite(data, manifest):
+        """Point literal /static/... references at their fingerprinted names."""
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            return data
+
+        def replace(match):
+            hashed = manifest.get(match.group('path'))
+            return f"{match.group('quote')}/static/{hashed}" if hashed else match.group(0)
+
+        return _REFERENCE.sub(replace, text).encode('utf-8')
+
+    def _precompress(self, root, names, data, report):
+        compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+        brotli = _brotli()
+        if brotli is not None:
+            compressed['br'] = brotli.compress(data, quality=11)
+        kept = []
+        for encoding, blob in compressed.items():
+            if len(blob) >= len(data):
+                continue
+            suffix = '.gz' if encoding == 'gzip' else '.br'
+            for name in names:
+                self._write(root, name + suffix, blob)
+            report['gzip_bytes' if encoding == 'gzip' else 'brotli_bytes'] += len(blob)
+            kept.append(encoding)
+        return kept
+
+    # Serving
+
+    def url(self, relpath):
+        """URL for an asset, fingerprinted once the build has it."""
+        relpath = relpath.lstrip('/')
+        return f"/static/{self.manifest.get(relpath, relpath) if self.enabled else relpath}"
+
+    def resolve(self, relpath, accept_encoding=''):
+        """
+        Pick the file to send for ``/static/<relpath>``.
+
+        Returns:
+            Asset: The file and its headers, or None if there is no such asset
+        """
+        relpath = relpath.lstrip('/')
+        if '..' in relpath.split('/') or relpath == MANIFEST_NAME:
+            return None
+        if not (self.enabled and self.built):
+            path = os.path.join(self.static_dir, relpath)
+            return Asset(path, mimetypes.guess_type(path)[0]) if os.path.isfile(path) else None
+
+        path = os.path.join(self.build_dir, relpath)
+        if not os.path.isfile(path):
+            return None
+        immutable = relpath in self.fingerprinted
+        logical = relpath if not immutable else self._logical(relpath)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in accepted and encoding in self.encodings.get(logical, ()):
+                return Asset(path + suffix, mimetype, encoding, immutable)
+        return Asset(path, mimetype, None, immutable)
+
+    def _logical(self, hashed):
+        stem, ext = os.path.splitext(hashed)
+        return f"{stem[:-(HASH_LENGTH + 1)]}{ext}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets.')
+    parser.add_argument('command', choices=('build',))
+    parser.add_argument('--static', default='static', help='Source directory')
+    parser.add_argument('--output', default=os.path.join('cache', 'assets'), help='Build directory')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the sources are unchanged')
+    args = parser.parse_args()
+
+    report = AssetPipeline(args.static, args.output).build(force=args.force)
+    print(json.dumps(report, indent=2) if report else "Static assets are up to date")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,268 +1,235 @@
-import queue
-import re
-from picamera2 import Picamera2
-from picamera2.encoders import MJPEGEncoder
-from picamera2.outputs import FileOutput
-from libcamera import Transform
-import board
-import neopixel
 import threading
 import time
-from PIL import Image
 import io
 import os
-from contextlib import contextmanager
+import shutil
+import socket
+from concurrent.futures import ThreadPoolExecutor
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from src.clips import ClipEncoder
+from src.collage import CollageComposer
+from src.derivatives import DerivativeCache, DerivativeError
+from src.feed import PhotoFeed
+from src.hardware import load_hardware
+from src.jobs import CaptureJobQueue
+from src.leds import COUNTDOWN_SECONDS, PixelAnimator
+from src.metrics import METRICS, TraceWriter
+from src.photo_index import PhotoIndex
+from src.postprocess import PostProcessor
+from src.preroll import FrameRing
+from src.startup import STARTUP
+from src.storage import CaptureStorage
+from src.streaming import BroadcastHub, StreamingOutput
+from src.sync import CaptureManifest
+from src.upload_scheduler import DEFAULT_CHUNK_SIZE, UploadScheduler
+from src.uploads import GoogleDriveUploader, UploadQueue
+from src.watermark import Watermark
 
-import requests
 
-class UploadQueue:
-    def __init__(self):
-        self.drive_uploader = GoogleDriveUploader(
-            credentials_path='/home/pi/photobooth/credentials.json',
-            folder_id='1AJDAdtoWkDDbdk8jdlkitG1EofXRtGen'
-        )
-        self.queue = queue.Queue()
-        self.is_running = True
-        self.upload_thread = threading.Thread(target=self._process_queue, daemon=True)
-        self.upload_thread.start()
-    
-    def add_to_queue(self, filename):
-        """Add a file to the upload queue"""
-        self.queue.put(filename)
-    
-    def _process_queue(self):
-        """Process the upload queue in the background"""
-        while self.is_running:
-            try:
-                # Get filename from queue, wait up to 1 second
-                filename = self.queue.get(timeout=1.0)
-                
-                try:
-                    # Upload to Google Drive
-                    file = self.drive_uploader.upload_file(filename)
-                    print(f"Uploaded {file['name']} to Google Drive")
-                    print(f"View at: {file['webViewLink']}")
-                except Exception as e:
-                    print(f"Failed to upload {filename} to Google Drive: {str(e)}")
-                
-                # Mark task as done
-                self.queue.task_done()
-                
-            except queue.Empty:
-                # No items in queue, continue waiting
-                continue
-            except Exception as e:
-                print(f"Error in upload queue processor: {str(e)}")
-                time.sleep(1)  # Prevent tight loop on repeated errors
-    
-    def stop(self):
-        """Stop the upload queue processor"""
-        self.is_running = False
-        self.upload_thread.join()
-
-class GoogleDriveUploader:
-    def __init__(self, credentials_path='credentials.json', folder_id=None):
-        """
-        Initialize Google Drive uploader with service account credentials.
-        
-        Args:
-            service_account_path (str): Path to the service account JSON file
-            folder_id (str): Optional Google Drive folder ID to upload to
-        """
-        self.SCOPES = ['https://www.googleapis.com/auth/drive.file']
-        self.service_account_path = credentials_path
-        self.folder_id = folder_id
-        self.service = None
-        
-    def authenticate(self):
-        """Authenticate with Google Drive API using service account."""
-        credentials = service_account.Credentials.from_service_account_file(
-            self.service_account_path,
-            scopes=self.SCOPES
-        )
-        
-        self.service = build('drive', 'v3', credentials=credentials)
-        
-    def create_folder(self, folder_name):
-        """
-        Create a new folder in Google Drive.
-        
-        Args:
-            folder_name (str): Name of the folder to create
-            
-        Returns:
-            str: ID of the created folder
-        """
-        if not self.service:
-            self.authenticate()
-            
-        folder_metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder'
-        }
-        
-        folder = self.service.files().create(
-            body=folder_metadata,
-            fields='id'
-        ).execute()
-        
-        return folder.get('id')
-    
-    def upload_file(self, file_path, folder_id=None):
-        """
-        Upload a file to Google Drive.
-        
-        Args:
-            file_path (str): Path to the file to upload
-            folder_id (str): Optional folder ID to upload to (overrides instance folder_id)
-            
-        Returns:
-            dict: File metadata from Google Drive
-        """
-        if not self.service:
-            self.authenticate()
-            
-        target_folder = folder_id or self.folder_id
-        file_name = os.path.basename(file_path)
-        
-        file_metadata = {
-            'name': file_name
-        }
-        
-        if target_folder:
-            file_metadata['parents'] = [target_folder]
-        
-        # Detect mimetype based on file extension
-        file_ext = os.path.splitext(file_path)[1].lower()
-        mime_types = {
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-        }
-        mime_type = mime_types.get(file_ext, 'application/octet-stream')
-        
-        media = MediaFileUpload(
-            file_path,
-            mimetype=mime_type,
-            resumable=True
-        )
-        
-        file = self.service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, name, webViewLink'
-        ).execute()
-        
-        return file
-
-class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        self.frame = None
-        self.condition = threading.Condition()
-
-    def write(self, buf):
-        with self.condition:
-            self.frame = buf
-            self.condition.notify_all()
-
-class PixelAnimator:
-    def __init__(self, num_pixels):
-        self.pixels = neopixel.NeoPixel(board.D18, num_pixels, auto_write=False)
-        self.num_pixels = num_pixels
-        self.animation_thread = None
-        self.stop_event = threading.Event()
-
-    @contextmanager
-    def animation_context(self):
-        try:
-            yield
-        finally:
-            self.pixels.fill((0, 0, 0))
-            self.pixels.show()
-    def start_animation(self, animation_type, duration=1, blocking=False, **kwargs):
-        if self.animation_thread and self.animation_thread.is_alive():
-            self.stop_event.set()
-            self.animation_thread.join()
-
-        self.stop_event.clear()
-        if animation_type == 'countdown':
-            target = self._countdown_animation
-        elif animation_type == 'pulse':
-            target = self._pulse_animation
-        elif animation_type == 'flash':
-            target = self._flash_animation
-        else:
-            raise ValueError(f"Unknown animation type: {animation_type}")
+SHUTTER_OFFSET = METRICS.histogram(
+    'photobooth_shutter_frame_offset_seconds',
+    'Distance between the shutter time and the timestamp of the frame taken from the pre-roll')
+BURST_DRIFT = METRICS.histogram(
+    'photobooth_burst_shutter_drift_seconds',
+    'Delay between a burst shot\'s target time and its actual shutter time',
+    ('shot',)
+)
 
-        if blocking:
-            with self.animation_context():
-                target(duration, **kwargs)
-        else:
-            self.animation_thread = threading.Thread(target=self._run_animation_with_context, args=(target, duration), kwargs=kwargs)
-            self.animation_thread.start()
-    def _run_animation_with_context(self, animation_func, duration, **kwargs):
-        with self.animation_context():
-            animation_func(duration, **kwargs)
-    def _countdown_animation(self, duration):
-        colors = [(255, 0, 0), (255, 255, 0), (0, 255, 0)]  # Red, Yellow, Green
-        for color in colors:
-            start_time = time.time()
-            while time.time() - start_time < 1 and not self.stop_event.is_set():
-                for i in range(self.num_pixels):
-                    self.pixels.fill((0, 0, 0))
-                    self.pixels[i] = color
-                    if i > 0:
-                        self.pixels[i-1] = tuple(int(0.3 * c) for c in color)
-                    self.pixels.show()
-                    time.sleep(1 / self.num_pixels)
-    def _flash_animation(self, duration):
-        self.pixels.fill((255, 255, 255))
-        self.pixels.show()
-        time.sleep(0.3)
-        self.pixels.fill((0, 0, 0))
-        self.pixels.show()
-    def _pulse_animation(self, duration, color=(0, 255, 0)):
-        start_time = time.time()
-        while time.time() - start_time < duration and not self.stop_event.is_set():
-            for i in range(0, 255, 5):
-                if self.stop_event.is_set():
-                    break
-                self.pixels.fill(tuple(int(i/255 * c) for c in color))
-                self.pixels.show()
-                time.sleep(0.01)
-            for i in range(255, 0, -5):
-                if self.stop_event.is_set():
-                    break
-                self.pixels.fill(tuple(int(i/255 * c) for c in color))
-                self.pixels.show()
-                time.sleep(0.01)
-
-    def stop_animation(self):
-        self.stop_event.set()
-        if self.animation_thread and self.animation_thread.is_alive():
-            self.animation_thread.join()
-
-    def __del__(self):
-        self.stop_animation()
-        self.pixels.fill((0, 0, 0))
-        self.pixels.show()
+# 'array' copies stills out of the live video stream, 'jpeg' is the original stop-and-capture path
+CAPTURE_MODES = ('array', 'jpeg')
+# How long the flash is lit before the shutter fires
+FLASH_SETTLE = 0.1
+# Reported by /healthz and /readyz; the booth is ready once all of them are
+SUBSYSTEMS = ('storage', 'uploads', 'watermark', 'collage', 'camera', 'leds')
+# Full-resolution stream stills are taken from
+STILL_SIZE = (1080, 1350)
+CAMERA_FPS = 15
+# /video_feed?tier=<name>: the most frames a second each tier gets of the preview stream (None for all)
+PREVIEW_TIERS = {'kiosk': None, 'remote': 5, 'thumb': 1}
+DEFAULT_PREVIEW_TIER = 'kiosk'
 
 
 class CameraCaptureSystem:
-    def __init__(self, num_pixels=16, capture_dir="/home/pi/photobooth/captures"):
-        self.pixel_animator = PixelAnimator(num_pixels)
+    def __init__(self, num_pixels=16, capture_dir="/home/pi/photobooth/captures", cache_dir=None,
+                 uploader=None, upload_workers=2, hardware=None, trace_path=None, capture_mode='array',
+                 jpeg_quality=90, collage_layouts=('strip',), job_queue_size=2, job_queue_policy='coalesce',
+                 event='default', archive_dir=None, retention_bytes=None, preview_size=(544, 680),
+                 preview_fps=CAMERA_FPS, preview_quality=75, preview_tiers=None, upload_rate=None,
+                 upload_busy_rate=128 * 1024, upload_chunk_size=DEFAULT_CHUNK_SIZE, upload_resized_width=None,
+                 upload_assume_existing=False,
+                 preroll_frames=6, preroll_window=0.0, clip_format='webp', clip_seconds=2.0, clip_fps=8.0,
+                 booth_id=None):
+        if capture_mode not in CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode {capture_mode!r}, expected one of {', '.join(CAPTURE_MODES)}")
+        self.capture_mode = capture_mode
         self.capture_dir = capture_dir
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(capture_dir)), 'cache')
         self.capture_lock = threading.Lock()
-        os.makedirs(self.capture_dir, exist_ok=True)
-        self.capture_count = self._get_last_photo_number() + 1
         self.streaming = False
+        # The preview is encoded from the lores stream (None encodes the full-resolution main stream)
+        self.preview_size = tuple(preview_size) if preview_size else None
+        self.preview_fps = preview_fps
+        self.preview_quality = preview_quality
+        self.preview_tiers = dict(preview_tiers or PREVIEW_TIERS)
+        # Uploads go at upload_rate, or upload_busy_rate during captures and remote viewing (bytes/s)
+        self.upload_scheduler = UploadScheduler(upload_rate, upload_busy_rate, upload_chunk_size,
+                                                is_busy=self._uplink_busy)
+        # Optionally upload a copy this wide first and the original once the booth is idle
+        self.upload_resized_width = upload_resized_width
+        self.upload_variants = {}
+        # In array mode, stills come from a ring of the last preroll_frames main-stream frames;
+        # a preroll_window (seconds) takes the sharpest frame that close to the shutter
+        self.preroll_frames = preroll_frames if capture_mode == 'array' else 0
+        self.preroll_window = preroll_window
+        self.preroll = None
+        self.last_shutter_offset = None
+        self.last_burst_drift = []
+        # Clip jobs record clip_seconds of the main stream at clip_fps and encode them on a worker process
+        self.clip_seconds = clip_seconds
+        self.clip_fps = clip_fps
+        self.last_collages = []
+        # Called with (event, path, **details) as files are written and uploaded
+        self.file_listeners = []
+        # Optional JSON-lines dump of per-capture stage timings
+        self.tracer = TraceWriter(trace_path) if trace_path else None
         self.prepared_watermark = None
-        self.upload_queue = UploadQueue()
-        self._setup_watermark()
-        self.setup_camera()
+        self.pixel_animator = None
+        self.upload_queue = None
+        self.collage = None
+        self.storage = None
+        STARTUP.expect(*SUBSYSTEMS)
+        try:
+            with STARTUP.phase('hardware'):
+                self.hardware = load_hardware(hardware)
+            # The slow, independent bring-up steps run side by side; storage is scanned meanwhile
+            with ThreadPoolExecutor(max_workers=4, thread_name_prefix='startup') as pool:
+                steps = [
+                    pool.submit(self._startup_step, 'leds', self._setup_leds, num_pixels),
+                    pool.submit(self._startup_step, 'camera', self.setup_camera),
+                    pool.submit(self._startup_step, 'watermark', self._setup_watermark),
+                    pool.submit(self._startup_step, 'collage', self._setup_collage, collage_layouts, jpeg_quality),
+                ]
+                with STARTUP.phase('storage', subsystem='storage'):
+                    # Captures are sharded per event and day; see src/storage.py
+                    self.storage = CaptureStorage(capture_dir, event=event, archive_dir=archive_dir,
+                                                  retention_bytes=retention_bytes)
+                    self.photo_index = PhotoIndex(self.storage)
+                    self.feed = PhotoFeed(self.photo_index)
+                    self.storage.listeners.append(self._storage_event)
+                    self.capture_count = self.storage.last_number + 1
+                    self.derivatives = DerivativeCache(self.storage.resolve, os.path.join(self.cache_dir, 'derivatives'))
+                    # Followed by gallery aggregators on /sync/manifest; see src/sync.py
+                    self.manifest = CaptureManifest(self.storage, booth_id or socket.gethostname(),
+                                                    os.path.join(self.cache_dir, 'manifest_hashes.json'))
+                    self.file_listeners.append(self.manifest.file_event)
+                with STARTUP.phase('uploads', subsystem='uploads'):
+                    self._setup_uploads(uploader, upload_workers, upload_assume_existing)
+                    self.storage.start_retention(self._uploads_confirmed)
+                for step in steps:
+                    step.result()
+            self.post_processor = PostProcessor(
+                self.prepared_watermark,
+                on_complete=self._photo_written,
+                on_error=self._file_failed,
+                derivatives=self.derivatives,
+                jpeg_quality=jpeg_quality
+            )
+            self.clips = ClipEncoder(
+                clip_format,
+                frame_size=STILL_SIZE,
+                spool_dir=os.path.join(self.cache_dir, 'clips'),
+                watermark=('./static/img/watermark.png', 100, self.cache_dir),
+                on_complete=self._clip_written,
+                on_error=self._file_failed
+            )
+            self.jobs = CaptureJobQueue(self, max_queued=job_queue_size, policy=job_queue_policy)
+        except Exception:
+            self._abort_startup()
+            raise
+
+    @staticmethod
+    def _startup_step(subsystem, setup, *args):
+        with STARTUP.phase(subsystem, subsystem=subsystem):
+            setup(*args)
+
+    def _abort_startup(self):
+        """Release whatever a failed start-up had already brought up, so a retry starts clean."""
+        for stop in (
+            lambda: self.picam2.stop(),
+            lambda: self.pixel_animator.shutdown(),
+            lambda: self.collage.shutdown(),
+            lambda: self.upload_queue.stop(),
+            lambda: self.storage.stop(),
+        ):
+            try:
+                stop()
+            except Exception:
+                pass
+
+    def _setup_leds(self, num_pixels):
+        self.pixel_animator = PixelAnimator(num_pixels, hardware=self.hardware)
+
+    def _setup_collage(self, layouts, quality):
+        # Strips/grids composed from each three-shot session; an empty list turns them off
+        if layouts:
+            self.collage = CollageComposer(
+                self._capture_path,
+                './static/img/watermark.png',
+                layouts=layouts,
+                quality=quality,
+                on_complete=self._collage_written,
+                on_error=self._file_failed
+            )
+
+    def _setup_uploads(self, uploader, workers, assume_existing=False):
+        if uploader is None:
+            uploader = GoogleDriveUploader(
+                credentials_path='/home/pi/photobooth/credentials.json',
+                folder_id='1AJDAdtoWkDDbdk8jdlkitG1EofXRtGen'
+            )
+        self.upload_queue = UploadQueue(
+            uploader,
+            journal_path=os.path.join(self.capture_dir, 'uploads.db'),
+            workers=workers,
+            scheduler=self.upload_scheduler
+        )
+        self.upload_queue.listeners.append(self._upload_event)
+        # A confirmed upload may be the last one holding back an old shard's archival
+        self.upload_queue.listeners.append(
+            lambda status, path, **details: status == 'uploaded' and self.storage.request_retention())
+        # Captures the journal has never seen are uploaded, unless told they already were
+        self.upload_queue.reconcile(self.storage.paths(), assume_uploaded=assume_existing)
+
+    def _uplink_busy(self):
+        """True while a capture is running or someone off the booth is watching the preview."""
+        hub = getattr(self, 'stream_hub', None)
+        return self.capture_lock.locked() or (hub is not None and hub.remote_client_count > 0)
+
+    def _upload_event(self, status, path, **details):
+        """Upload results, with those of resized variants reported against their original."""
+        original = self.upload_variants.get(path)
+        if original is None:
+            self._notify_file(status, path, **details)
+            return
+        if status in ('uploaded', 'upload_failed'):
+            self.upload_variants.pop(path, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._notify_file(status, original, variant=os.path.basename(path), **details)
+
+    def _capture_path(self, filename):
+        return self.storage.path_for(filename)
+
+    def _uploads_confirmed(self, paths):
+        """True if every one of ``paths`` has been uploaded, so its shard may be archived."""
+        statuses = self.upload_queue.journal.statuses(os.path.abspath(p) for p in paths)
+        return all(statuses.get(os.path.abspath(p)) == 'done' for p in paths)
+
+    def _storage_event(self, event, filenames):
+        if event == 'archived':
+            self.photo_index.remove(filenames)
 
     def __del__(self):
         self.stop_mjpeg_stream()
@@ -270,79 +237,82 @@ class CameraCaptureSystem:
             self.picam2.stop()
 
     def _setup_watermark(self):
-        """Prepare the watermark image once during initialization."""
-        with Image.open('./static/img/watermark.png') as watermark:
-            # Convert watermark to RGBA if it isn't already
-            watermark = watermark.convert('RGBA')
-            
-            original_width, original_height = watermark.size
-            target_width = 1080
-            
-            # Only scale if original width is larger than target
-            if original_width > target_width:
-                # Calculate new height maintaining aspect ratio
-                scale_factor = target_width / original_width
-                target_height = int(original_height * scale_factor)
-                
-                # Resize watermark
-                watermark = watermark.resize((target_width, target_height), Image.Resampling.LANCZOS)
-            
-            # Create transparent version with 70% opacity
-            transparent_watermark = Image.new('RGBA', watermark.size, (0, 0, 0, 0))
-            for x in range(watermark.size[0]):
-                for y in range(watermark.size[1]):
-                    pixel = watermark.getpixel((x, y))
-                    transparent_watermark.putpixel(
-                        (x, y),
-                        (pixel[0], pixel[1], pixel[2], int(pixel[3] * 0.70))
-                    )
-            
-            # Store the prepared watermark and its position
-            self.prepared_watermark = transparent_watermark
-            self.watermark_position = (
-                0,  # Left aligned
-                1350 - watermark.size[1] - 100  # Bottom with 100px offset
-            )
+        """Load the premultiplied watermark, reusing the on-disk cache when possible."""
+        self.prepared_watermark = Watermark(
+            './static/img/watermark.png',
+            frame_size=STILL_SIZE,
+            opacity=0.70,
+            bottom_margin=100,
+            cache_dir=self.cache_dir
+        )
+        self.watermark_position = self.prepared_watermark.position
 
     def setup_camera(self):
-        self.picam2 = Picamera2()
-        # Create video configuration for streaming
+        self.picam2 = self.hardware.create_camera()
+        # Stills come from the full-resolution main stream; the preview is encoded from the
+        # ISP-scaled lores stream, so neither the encoder nor the viewers pay for full frames
         camera_config = self.picam2.create_video_configuration(
-            transform=Transform(vflip=False),
-            main={"size": (1080, 1350)},
-            encode="main"
+            transform=self.hardware.Transform(vflip=False),
+            # XBGR8888 is RGBX in memory, which the watermark and JPEG encoder take as-is
+            main={"size": STILL_SIZE, "format": "XBGR8888"},
+            lores={"size": self.preview_size, "format": "YUV420"} if self.preview_size else None,
+            encode="lores" if self.preview_size else "main"
         )
         self.picam2.configure(camera_config)
-        self.picam2.set_controls({"FrameRate": 15})
+        self.picam2.set_controls({"FrameRate": CAMERA_FPS})
+        if self.preroll_frames:
+            width, height = STILL_SIZE
+            self.preroll = FrameRing(self.preroll_frames, (height, width, 4))
+            self.hardware.set_frame_callback(self.picam2, self.preroll.write)
+            METRICS.gauge('photobooth_preroll_bytes', 'Memory held by the pre-roll frame ring',
+                          lambda: self.preroll.nbytes)
         self.picam2.start()
 
         # Set up MJPEG encoder and output
         self.output = StreamingOutput()
-        self.file_output = FileOutput(self.output)
+        self.file_output = self.hardware.FileOutput(self.output)
+        self.output.listeners.append(self._first_frame)
+        self.stream_hub = BroadcastHub(self.output)
+        METRICS.gauge('photobooth_stream_clients', 'Connected /video_feed clients',
+                      lambda: self.stream_hub.client_count)
+        METRICS.gauge('photobooth_stream_frames_dropped', 'Frames skipped by slow /video_feed clients',
+                      lambda: self.stream_hub.stats()['frames_dropped'])
+        METRICS.gauge('photobooth_stream_bytes_sent', 'Preview bytes sent to /video_feed clients',
+                      lambda: self.stream_hub.stats()['bytes_sent'])
 
-    def mjpeg_generator(self):
+    def _first_frame(self):
+        if STARTUP.mark('first_frame'):
+            print(f"First preview frame {STARTUP.milestones['first_frame']:.2f}s after process start")
+
+    def mjpeg_generator(self, tier=DEFAULT_PREVIEW_TIER, peer=None):
+        """
+        Yield the preview's multipart chunks for one client.
+
+        Args:
+            tier (str): Key of ``preview_tiers``, which caps the client's frame rate
+            peer (str): Client address; viewers off the booth hold uploads to the busy rate
+        """
+        max_fps = self.preview_tiers[tier]
         try:
             if not self.streaming:
-                self.start_mjpeg_stream()
-            
-            while True:
-                with self.output.condition:
-                    self.output.condition.wait()
-                    frame = self.output.frame
-                if frame:
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                else:
-                    print("Empty frame received")
-                time.sleep(0.001)
+                with METRICS.stage('stream_start'):
+                    self.start_mjpeg_stream()
+            for chunk in self.stream_hub.subscribe(max_fps=max_fps, tier=tier, peer=peer):
+                # Time spent in yield is the server writing the frame to this client
+                start = time.perf_counter()
+                yield chunk
+                METRICS.observe_stage('mjpeg_send', time.perf_counter() - start)
         except Exception as e:
             print(f"Error in MJPEG generator: {str(e)}")
 
     def start_mjpeg_stream(self):
         if not self.streaming:
             self.streaming = True
-            # Start recording without specifying quality here
-            self.picam2.start_recording(MJPEGEncoder(), self.file_output)
+            encoder = self.hardware.MJPEGEncoder()
+            # The sensor keeps running at CAMERA_FPS for stills; the encoder takes every n-th frame
+            encoder.frame_skip_count = max(1, round(CAMERA_FPS / self.preview_fps))
+            self.picam2.start_recording(encoder, self.file_output,
+                                        quality=self.hardware.recording_quality(self.preview_quality))
 
     def stop_mjpeg_stream(self):
         if self.streaming:
@@ -353,104 +323,317 @@ class CameraCaptureSystem:
                 print(f"Error stopping recording: {str(e)}")
 
 
-    def _get_last_photo_number(self):
-        photo_numbers = []
-        for filename in os.listdir(self.capture_dir):
-            match = re.match(r'photo_(\d+)\.jpg', filename)
-            if match:
-                photo_numbers.append(int(match.group(1)))
-        return max(photo_numbers) if photo_numbers else -1  # Return -1 if no photos found
-    def _capture_single_image(self):
-        """Helper method to capture a single image with flash"""
+    def _start_trace(self, kind):
+        return self.tracer.start(kind) if self.tracer else None
+
+    def _countdown(self, trace=None, progress=None):
+        """Run the LED countdown, reporting each remaining second to ``progress``."""
+        with METRICS.stage('countdown', trace):
+            start = self.pixel_animator.start_animation('countdown')
+            for i in range(COUNTDOWN_SECONDS + 1):
+                wait_time = start + i - time.perf_counter()
+                if wait_time > 0:
+                    time.sleep(wait_time)
+                if progress and i < COUNTDOWN_SECONDS:
+                    progress('countdown', remaining=COUNTDOWN_SECONDS - i)
+
+    def _capture_single_image(self, trace=None, on_decoded=None, shutter_at=None, progress=None):
+        """
+        Helper method to capture a single image with flash.
+
+        Only the sensor capture happens here; watermarking, encoding and the disk
+        write run on the post-processing pool, which also queues the upload. In
+        ``array`` mode the preview keeps streaming through the shot and the
+        frame comes from the pre-roll ring, the one nearest the shutter time;
+        ``jpeg`` mode captures an encoded still and stops the stream afterwards.
+
+        Args:
+            trace (CaptureTrace): Trace to record into; a new one is started if tracing is on
+            on_decoded (callable): Passed on to PostProcessor.submit, e.g. a collage session
+            shutter_at (float): time.time() the shutter should fire at; the flash is scheduled
+                ``FLASH_SETTLE`` before it. Defaults to one settle time from now.
+            progress (callable): Receives a ``shutter`` event before the frame is handed on
+
+        Returns:
+            tuple: (filename the photo will be written to, time.time() of the shutter)
+        """
         self.capture_count += 1
-        filename = os.path.join(self.capture_dir, f"photo_{self.capture_count}.jpg")
-        stream = io.BytesIO()
+        filename = self.storage.path_for(f"photo_{self.capture_count}.jpg")
+        if trace is None:
+            trace = self._start_trace('photo')
+        if trace is not None:
+            trace.set(filename=os.path.basename(filename))
         if not self.streaming:
-            self.start_mjpeg_stream()
-        # Flash and capture
-        self.pixel_animator.start_animation('flash')
-        time.sleep(0.1)
-        self.picam2.capture_file(stream, format='jpeg')
-        
-        stream.seek(0)
-        
-        # Process image with watermark
-        with Image.open(stream) as img:
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            img.paste(self.prepared_watermark, self.watermark_position, self.prepared_watermark)
-            img = img.convert('RGB')
-            img.save(filename)
-        
+            with METRICS.stage('stream_start', trace):
+                self.start_mjpeg_stream()
+        # Flash and capture; the LED engine lights the flash at an absolute deadline
+        now = time.time()
+        shutter_at = now + FLASH_SETTLE if shutter_at is None else shutter_at
+        shutter_deadline = time.perf_counter() + (shutter_at - now)
+        flash_at = self.pixel_animator.start_animation(
+            'flash', at=max(time.perf_counter(), shutter_deadline - FLASH_SETTLE))
+        wait_time = flash_at - time.perf_counter()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        with METRICS.stage('flash_settle', trace):
+            wait_time = shutter_deadline - time.perf_counter()
+            if wait_time > 0:
+                time.sleep(wait_time)
+        shutter_time = time.time()
+        if self.capture_mode == 'array':
+            # Copy a main-stream frame while the MJPEG encoder keeps recording
+            with METRICS.stage('sensor_capture', trace):
+                frame = self._shutter_frame(shutter_time)
+            if progress:
+                progress('shutter', filename=filename, time=shutter_time)
+            self.post_processor.submit(filename, frame, trace=trace, on_decoded=on_decoded)
+        else:
+            stream = io.BytesIO()
+            with METRICS.stage('sensor_capture', trace):
+                self.picam2.capture_file(stream, format='jpeg')
+            if progress:
+                progress('shutter', filename=filename, time=shutter_time)
+            self.post_processor.submit(filename, stream.getvalue(), trace=trace, on_decoded=on_decoded)
+
         print(f"Image captured: {filename}")
-        self.stop_mjpeg_stream()
-        return filename
-    
-    def capture_image(self):
-        """Capture a single image with countdown"""
+        if self.capture_mode == 'jpeg':
+            with METRICS.stage('stream_stop', trace):
+                self.stop_mjpeg_stream()
+        return filename, shutter_time
+
+    def _shutter_frame(self, shutter_time):
+        """The main-stream frame for a shutter at ``shutter_time``: from the pre-roll, else the next one."""
+        if self.preroll is not None:
+            # At most one frame interval (plus the window) to wait for a frame from after the shutter
+            tolerance = self.preroll_window + 2.0 / CAMERA_FPS
+            grabbed = self.preroll.grab(shutter_time, window=self.preroll_window, timeout=tolerance,
+                                        frame_interval=1.0 / CAMERA_FPS)
+            # Nothing that close means the camera was stopped, e.g. in jpeg mode's restart
+            if grabbed is not None and abs(grabbed[1] - shutter_time) <= tolerance:
+                frame, frame_time = grabbed
+                self.last_shutter_offset = frame_time - shutter_time
+                SHUTTER_OFFSET.observe(abs(self.last_shutter_offset))
+                return frame
+        return self.picam2.capture_array('main')
+
+    def capture_image(self, progress=None):
+        """
+        Capture a single image with countdown.
+
+        Args:
+            progress (callable): Called as ``progress(event, **data)`` for each countdown tick and the shutter
+        """
         with self.capture_lock:
-            self.pixel_animator.start_animation('countdown', 3, blocking=True)
-            filename = self._capture_single_image()
-            self.upload(filename)
+            trace = self._start_trace('photo')
+            self._countdown(trace, progress)
+            filename, _ = self._capture_single_image(trace, progress=progress)
             return filename
-    def capture_image_3(self):
-        """Capture three images with exactly 1 second between each"""
+
+    def capture_image_3(self, progress=None):
+        """
+        Capture three images with exactly 1 second between each.
+
+        Args:
+            progress (callable): Called as ``progress(event, **data)`` for each countdown tick,
+                the collage names (``collages``) and every shutter
+        """
         with self.capture_lock:
             filenames = []
             
             # Initial countdown
-            self.pixel_animator.start_animation('countdown', 3, blocking=True)
+            self._countdown(progress=progress)
             
-            # Get start time
-            start_time = time.time()
+            # Collages are named after the session's first photo
+            session = self.collage.start_session(self.capture_count + 1) if self.collage else None
+            if session and progress:
+                progress('collages', filenames=list(session.paths.values()))
+
+            # Get start time; the first shot still gets its full flash settle time
+            start_time = time.time() + FLASH_SETTLE
             
             # Capture 3 images at absolute times
-            for i in range(3):
-                # Calculate target time for this capture
-                target_time = start_time + i
-                
-                # Wait until we reach the target time
-                wait_time = target_time - time.time()
-                if wait_time > 0:
-                    time.sleep(wait_time)
-                
-                filename = self._capture_single_image()
-                filenames.append(filename)
-            
-            # Increment counter and queue uploads
+            drifts = []
+            try:
+                for i in range(3):
+                    # Calculate target time for this capture; the flash is scheduled ahead of it
+                    target_time = start_time + i
+
+                    trace = self._start_trace('burst')
+                    if trace is not None:
+                        trace.set(shot=i + 1)
+                    filename, shutter_time = self._capture_single_image(
+                        trace, on_decoded=session.cell_callback(i) if session else None, shutter_at=target_time,
+                        progress=progress)
+                    filenames.append(filename)
+                    drifts.append(shutter_time - target_time)
+                    BURST_DRIFT.observe(max(0.0, shutter_time - target_time), str(i + 1))
+            except Exception:
+                if session:
+                    session.cancel()
+                raise
+            self.last_burst_drift = drifts
+            self.last_collages = (
+                list(session.paths.values()) if session else []
+            )
+
+            print("Burst shutter drift vs target: " +
+                  ", ".join(f"shot {i + 1} {drift * 1000:+.1f} ms" for i, drift in enumerate(drifts)))
+
+            # Increment counter; uploads are queued as each file is written
             self.capture_count += 1
-            for filename in filenames:
-                self.upload_queue.add_to_queue(filename)
 
             if not self.streaming:
                 self.start_mjpeg_stream()
             
             return filenames
-        
+
+    def capture_clip(self, progress=None):
+        """
+        Record a boomerang clip from the live stream after the countdown.
+
+        Frames are shrunk and spooled to disk as they arrive, so recording holds
+        one frame at a time; the clip is encoded on the clip encoder's worker
+        process, which queues the upload once it is written.
+
+        Args:
+            progress (callable): Called as ``progress(event, **data)`` for each countdown tick,
+                the start of the recording (``shutter``) and its end (``recorded``)
+
+        Returns:
+            str: Filename the clip will be written to
+        """
+        with self.capture_lock:
+            trace = self._start_trace('clip')
+            self._countdown(trace, progress)
+            self.capture_count += 1
+            filename = self.storage.path_for(f"clip_{self.capture_count}.{self.clips.format}")
+            if trace is not None:
+                trace.set(filename=os.path.basename(filename))
+            if not self.streaming:
+                with METRICS.stage('stream_start', trace):
+                    self.start_mjpeg_stream()
+            frames = max(2, round(self.clip_seconds * self.clip_fps))
+            spool = self.clips.spool(filename)
+            # Red pulse for as long as the booth is recording
+            self.pixel_animator.start_animation('pulse', self.clip_seconds, color=(255, 0, 0))
+            start = time.perf_counter()
+            if progress:
+                progress('shutter', filename=filename, time=time.time())
+            try:
+                with METRICS.stage('clip_record', trace):
+                    for i in range(frames):
+                        wait_time = start + i / self.clip_fps - time.perf_counter()
+                        if wait_time > 0:
+                            time.sleep(wait_time)
+                        spool.add(self.picam2.capture_array('main'))
+            except Exception:
+                spool.discard()
+                raise
+            if progress:
+                progress('recorded', frames=spool.frames, seconds=round(time.perf_counter() - start, 3))
+            self.clips.submit(filename, spool, self.clip_fps, trace=trace)
+            print(f"Clip recorded: {filename}")
+            return filename
+
+    def wait_for_photo(self, name, timeout=3.0):
+        """Wait up to ``timeout`` seconds for a just-captured photo, collage or clip to be written."""
+        if self.collage and not self.collage.wait_for(name, timeout):
+            return False
+        if not self.clips.wait_for(name, timeout):
+            return False
+        return self.post_processor.wait_for(name, timeout)
+
+    def _photo_written(self, filename):
+        """Called by the post-processing pool once a photo is on disk."""
+        self.storage.add(filename)
+        record = self.photo_index.add(filename)
+        if record is not None:
+            self.feed.publish(record)
+        self._notify_file('processed', filename)
+        self.upload(filename)
+
+    def _collage_written(self, filename):
+        self.storage.add(filename)
+        self._notify_file('processed', filename)
+        self.upload(filename)
+
+    def _clip_written(self, filename):
+        self.storage.add(filename)
+        self._notify_file('processed', filename)
+        self.upload(filename)
+
+    def _file_failed(self, filename, error):
+        self._notify_file('process_failed', filename, error=str(error))
+
+    def _notify_file(self, event, path, **details):
+        for listener in self.file_listeners:
+            try:
+                listener(event, path, **details)
+            except Exception as e:
+                print(f"Error in file listener: {e}")
+
     def upload(self, filename):
-        """Capture an image and upload it to Google Drive."""
-        # Capture the image
-        
-        self.upload_queue.add_to_queue(filename)
+        """Queue a written photo or collage for upload, resized copy first if configured."""
+        resize = self.upload_resized_width and filename.endswith('.jpg')
+        variant = self._upload_variant(filename) if resize else None
+        if variant:
+            self.upload_queue.add_to_queue(variant)
+            # The original waits until the booth is idle
+            self.upload_queue.add_to_queue(filename, priority=1)
+            self._notify_file('upload_queued', filename, variant=os.path.basename(variant))
+        else:
+            self.upload_queue.add_to_queue(filename)
+            self._notify_file('upload_queued', filename)
+
+    def _upload_variant(self, filename):
+        """Make the resized copy of ``filename`` to upload first. Returns its path, or None."""
+        try:
+            path, _, _ = self.derivatives.get(os.path.basename(filename), self.upload_resized_width)
+        except DerivativeError as e:
+            print(f"Uploading {filename} without a resized copy: {e}")
+            return None
+        stem, ext = os.path.splitext(os.path.basename(filename))
+        width = self.derivatives.normalize(self.upload_resized_width, 'jpeg')[0]
+        # Linked out of the derivative cache, so eviction cannot pull it from under the upload
+        variant = os.path.abspath(os.path.join(self.cache_dir, 'uploads', f"{stem}.w{width}{ext}"))
+        os.makedirs(os.path.dirname(variant), exist_ok=True)
+        try:
+            os.link(path, variant)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(path, variant)
+        self.upload_variants[variant] = os.path.abspath(filename)
+        return variant
 
     def get_latest_photo(self):
-        photos = self.get_all_photos()
-        return photos[0] if photos else None
+        photos = self.photo_index.latest(1)
+        return photos[0].filename if photos else None
 
     def get_all_photos(self):
-        return sorted(
-            [f for f in os.listdir(self.capture_dir) if f.startswith('photo_') and f.endswith('.jpg')],
-            key=lambda x: int(x.split('_')[1].split('.')[0]),
-            reverse=True
-        )
+        return self.photo_index.filenames()
 
     def run(self):
-        self.pixel_animator.start_animation('pulse', 3, blocking=True, color=(0, 255, 0))
+        # The kiosk page connects straight away, so have the encoder running before it does
+        if not self.streaming:
+            with METRICS.stage('stream_start'):
+                self.start_mjpeg_stream()
+        # The ready pulse plays in the background instead of holding up start-up for 3 seconds
+        self.pixel_animator.start_animation('pulse', 3, color=(0, 255, 0))
+        STARTUP.mark('ready')
         print("Camera system ready.")
+        print(STARTUP.format())
 
     def cleanup(self):
         self.keep_running = False
+        self.jobs.stop()
         self.stop_mjpeg_stream()
         self.picam2.stop()
-        self.pixel_animator.stop_animation()
+        self.pixel_animator.shutdown()
+        self.post_processor.shutdown()
+        self.clips.shutdown()
+        if self.collage:
+            self.collage.shutdown()
+        self.storage.stop()
         self.upload_queue.stop()
+        self.manifest.close()
@@ -0,0 +1,16 @@
+"""
+Main module of the spawned clip worker.
+
+A spawned process normally re-runs the parent's main script first, which for
+the booth is all of app.py: Flask, the camera system and every route. app.py
+points multiprocessing at this module instead (``use_as_spawn_main``), so the
+worker only imports what ``encode_clip`` needs when its first job arrives.
+"""
+import importlib.util
+import sys
+
+
+def use_as_spawn_main():
+    """Make processes spawned from here on start from this module instead of the caller's ``__main__``."""
+    # multiprocessing initialises a spawned child's main module by this name when it is set
+    sys.modules['__main__'].__spec__ = importlib.util.find_spec(__name__)
@@ -0,0 +1,430 @@
+"""
+Boomerang clips recorded from the live stream.
+
+A clip job records a couple of seconds of the main stream. Each frame is
+shrunk as it arrives and appended to a raw spool file, so the booth process
+never holds more than one frame of a clip. The spool is encoded on a separate
+worker process. The worker reads the frames back one at a time, forwards and
+then backwards, watermarks them and streams them into the encoder:
+
+    webp    Pillow's animated WebP encoder (the default)
+    gif     written frame by frame against one shared palette
+    mp4     raw frames piped into ffmpeg, which has to be installed
+
+The finished clip is written next to the photos, e.g. ``clip_12.webp``.
+"""
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+from src.metrics import METRICS
+from src.watermark import Watermark
+
+CLIP_FORMATS = ('webp', 'gif', 'mp4')
+# Clips play back this many times faster than they were recorded
+BOOMERANG_SPEED = 2.0
+WEBP_QUALITY = 75
+# 0-6: higher is smaller and slower to encode; 2 takes half the time of 4 for clips ~6% larger
+WEBP_METHOD = 2
+MP4_CODEC_ARGS = ('-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23')
+
+CLIP_ENCODE_SECONDS = METRICS.histogram(
+    'photobooth_clip_encode_seconds', 'Time to encode a clip on the clip worker', ('format',),
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0))
+
+
+class ClipError(Exception):
+    """Raised when a clip cannot be encoded."""
+
+
+class ClipSpool:
+    """Raw RGB frames of one clip, shrunk and appended to a file as they are recorded."""
+
+    def __init__(self, path, size, scale):
+        """
+        Args:
+            path (str): Spool file to write
+            size (tuple): (width, height) of the spooled frames
+            scale (int): Factor the recorded frames are shrunk by
+        """
+        self.path = path
+        self.size = size
+        self.scale = scale
+        self.frames = 0
+        self.file = open(path, 'wb')
+
+    def add(self, frame):
+        """
+        Shrink a frame and append it.
+
+        Args:
+            frame (numpy.ndarray): RGB or XBGR8888 (RGBX in memory) uint8 frame
+        """
+        height, width, channels = frame.shape
+        mode = 'RGBX' if channels == 4 else 'RGB'
+        img = Image.frombuffer(mode, (width, height), np.ascontiguousarray(frame), 'raw', mode, 0, 1)
+        clip_width, clip_height = self.size
+        small = img.reduce(self.scale, box=(0, 0, clip_width * self.scale, clip_height * self.scale))
+        self.file.write(small.tobytes('raw', 'RGB'))
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def boomerang_order(frames):
+    """Frame indexes played forwards and back again, without repeating either end."""
+    return list(range(frames)) + list(range(frames - 2, 0, -1))
+
+
+class _SpoolReader:
+    """Reads spooled frames back one at a time, watermarked."""
+
+    def __init__(self, path, size, watermark):
+        self.file = open(path, 'rb')
+        self.size = size
+        self.frame_bytes = size[0] * size[1] * 3
+        self.watermark = watermark
+
+    def array(self, index):
+        buffer = bytearray(self.frame_bytes)
+        self.file.seek(index * self.frame_bytes)
+        if self.file.readinto(buffer) != self.frame_bytes:
+            raise ClipError(f"Spool {self.file.name} ends before frame {index}")
+        width, height = self.size
+        frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+        if self.watermark is not None:
+            self.watermark.apply_array(frame)
+        return frame
+
+    def image(self, index):
+        return Image.fromarray(self.array(index))
+
+    def close(self):
+        self.file.close()
+
+
+class _LazyFrames:
+    """
+    Multi-frame image that decodes one spooled frame per ``seek``.
+
+    Passed as ``append_images`` to Pillow's animated WebP encoder, which takes
+    multi-frame images one frame at a time, so only the current frame is ever held.
+    """
+
+    def __init__(self, reader, order):
+        self.reader = reader
+        self.order = order
+        self.n_frames = len(order)
+        self.index = 0
+        self.current = reader.image(order[0])
+
+    def seek(self, index):
+        if index != self.index:
+            self.current = self.reader.image(self.order[index])
+            self.index = index
+
+    def tell(self):
+        return self.index
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+
+def _write_webp(reader, order, fps, out):
+    first = reader.image(order[0])
+    first.save(out, 'WEBP', save_all=True, append_images=[_LazyFrames(reader, order[1:])],
+               duration=round(1000 / fps), loop=0, quality=WEBP_QUALITY, method=WEBP_METHOD)
+
+
+def _write_gif(reader, order, fps, out):
+    # One palette for the whole clip, from its first, middle and last frames, keeps colours from
+    # flickering and lets every frame go out as soon as it is quantized
+    last = max(order)
+    samples = [reader.array(i) for i in (0, last // 2, last)]
+    palette = Image.fromarray(np.concatenate(samples)).quantize(255, method=Image.Quantize.MEDIANCUT)
+    del samples
+    duration = round(1000 / fps)
+    header = None
+    for index in order:
+        frame = reader.image(index).quantize(palette=palette, dither=Image.Dither.NONE)
+        if header is None:
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': 0})
+            out.write(b''.join(header))
+        out.write(b''.join(GifImagePlugin.getdata(frame, duration=duration)))
+    out.write(b';')
+
+
+def _write_mp4(reader, order, fps, out_path):
+    width, height = reader.size
+    command = [
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}", '-r', f"{fps:g}", '-i', '-',
+        *MP4_CODEC_ARGS, '-pix_fmt', 'yuv420p', '-movflags', '+faststart', '-f', 'mp4', out_path,
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for index in order:
+            process.stdin.write(reader.array(index).data)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    error = process.stderr.read()
+    if process.wait() != 0:
+        raise ClipError(f"ffmpeg exited with {process.returncode}: {error.decode(errors='replace').strip()}")
+
+
+_watermarks = {}
+
+
+def _watermark(settings, size):
+    """Watermark prepared for the clip size, once per worker process."""
+    if settings is None:
+        return None
+    path, bottom_margin, cache_dir = settings
+    key = (path, size, bottom_margin)
+    if key not in _watermarks:
+        _watermarks[key] = Watermark(path, frame_size=size, bottom_margin=bottom_margin, cache_dir=cache_dir)
+    return _watermarks[key]
+
+
+def _read_status_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    # Linux only; elsewhere the peak covers the worker's whole life
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def encode_clip(spool_path, output_path, fmt, size, frames, fps, watermark=None):
+    """
+    Encode a spooled clip as a boomerang. Runs on the clip worker process.
+
+    Args:
+        spool_path (str): Raw RGB frames written by ClipSpool
+        output_path (str): Final path of the clip
+        fmt (str): One of ``CLIP_FORMATS``
+        size (tuple): (width, height) of the spooled frames
+        frames (int): Number of spooled frames
+        fps (float): Playback frame rate
+        watermark (tuple): (path, bottom margin, cache dir) of the watermark, or None
+
+    Returns:
+        dict: The clip's path, frame count, encode time and the worker's RSS before and at its peak
+    """
+    _reset_peak_rss()
+    rss_kb = _read_status_kb('VmRSS')
+    start = time.perf_counter()
+    order = boomerang_order(frames)
+    directory, name = os.path.split(output_path)
+    tmp_path = os.path.join(directory, f".{name}.part")
+    reader = _SpoolReader(spool_path, tuple(size), _watermark(watermark, tuple(size)))
+    try:
+        if fmt == 'mp4':
+            _write_mp4(reader, order, fps, tmp_path)
+        else:
+            with open(tmp_path, 'wb') as out:
+                (_write_webp if fmt == 'webp' else _write_gif)(reader, order, fps, out)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        reader.close()
+    return {
+        'path': output_path,
+        'frames': len(order),
+        'encode_seconds': time.perf_counter() - start,
+        'rss_kb': rss_kb,
+        'peak_rss_kb': _read_status_kb('VmHWM'),
+        'bytes': os.path.getsize(output_path),
+    }
+
+
+def _lower_priority():
+    # Encoding may take every cycle it gets; the camera, preview and uploads come first
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+class ClipEncoder:
+    """
+    Encodes spooled clips on a worker process and reports them like the post-processor does.
+
+    The worker is spawned on the first clip and kept for the next ones. At most
+    ``max_pending`` clips are recorded but not yet encoded; ``submit`` blocks
+    beyond that, which also bounds the spool files on disk.
+    """
+
+    def __init__(self, fmt='webp', frame_size=(1080, 1350), scale=2, spool_dir='cache/clips',
+                 watermark=None, max_workers=1, max_pending=2, on_complete=None, on_error=None):
+        """
+        Args:
+            fmt (str): One of ``CLIP_FORMATS``
+            frame_size (tuple): (width, height) of the recorded frames
+            scale (int): Factor frames are shrunk by before spooling
+            spool_dir (str): Directory for the spool files
+            watermark (tuple): (path, bottom margin at full size, cache dir) of the watermark, or None
+            max_workers (int): Worker processes
+            max_pending (int): Clips allowed in flight before ``submit`` blocks
+            on_complete (callable): Called with the final path once a clip is written
+            on_error (callable): Called with the final path and the exception if encoding fails
+        """
+        if fmt not in CLIP_FORMATS:
+            raise ValueError(f"Unknown clip format {fmt!r}, expected one of {', '.join(CLIP_FORMATS)}")
+        if fmt == 'mp4' and shutil.which('ffmpeg') is None:
+            raise ValueError("mp4 clips need ffmpeg on the PATH")
+        self.format = fmt
+        self.scale = scale
+        width, height = frame_size
+        # Even dimensions, as the MP4 encoder's 4:2:0 chroma needs
+        self.size = (width // scale // 2 * 2, height // scale // 2 * 2)
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        if watermark is not None:
+            path, bottom_margin, cache_dir = watermark
+            watermark = (path, bottom_margin // scale, cache_dir)
+        self.watermark = watermark
+        self.max_workers = max_workers
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.executor = self._executor()
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.last_result = None
+        METRICS.gauge('photobooth_clips_pending', 'Clips waiting for or being encoded', lambda: len(self.pending))
+        METRICS.gauge('photobooth_clip_worker_peak_rss_bytes', 'Peak RSS of the clip worker during the last clip',
+                      lambda: (self.last_result or {}).get('peak_rss_kb', 0) * 1024)
+
+    def _executor(self):
+        # Spawned rather than forked: the booth process has camera and server threads running
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_lower_priority)
+
+    def spool(self, filename):
+        """Start recording the clip that will be written to ``filename``."""
+        path = os.path.join(self.spool_dir, f"{os.path.basename(filename)}.rgb")
+        return ClipSpool(path, self.size, self.scale)
+
+    def submit(self, filename, spool, fps, trace=None):
+        """
+        Queue a recorded clip for encoding into ``filename``.
+
+        Args:
+            filename (str): Final path of the clip
+            spool (ClipSpool): The recorded frames; deleted once the clip is encoded
+            fps (float): Frame rate the clip was recorded at
+            trace (CaptureTrace): Optional trace the encode time is added to before it is finished
+
+        Returns:
+            concurrent.futures.Future: Resolves to the result of ``encode_clip``
+        """
+        spool.close()
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(encode_clip, spool.path, filename, self.format, self.size,
+                                          spool.frames, fps * BOOMERANG_SPEED, self.watermark)
+        except Exception:
+            self.slots.release()
+            spool.discard()
+            raise
+        registered = threading.Event()
+        with self.pending_lock:
+            self.pending[os.path.basename(filename)] = registered
+        executor = self.executor
+        future.add_done_callback(lambda f: self._finished(filename, spool, executor, trace, f, registered))
+        return future
+
+    def _finished(self, filename, spool, executor, trace, future, registered):
+        name = os.path.basename(filename)
+        try:
+            self._report(filename, spool, executor, trace, future)
+        finally:
+            # Only now is the clip in storage, so wait_for callers can look it up
+            with self.pending_lock:
+                if self.pending.get(name) is registered:
+                    del self.pending[name]
+            registered.set()
+
+    def _report(self, filename, spool, executor, trace, future):
+        """Clean up after an encode and pass the clip on to ``on_complete`` or ``on_error``."""
+        name = os.path.basename(filename)
+        spool.discard()
+        self.slots.release()
+        error = future.exception()
+        result = future.result() if error is None else None
+        if trace is not None:
+            if result is not None:
+                trace.add('clip_encode', result['encode_seconds'])
+                trace.set(frames=result['frames'], bytes=result['bytes'])
+            trace.finish()
+        if error is not None:
+            print(f"Failed to encode {name}: {error}")
+            if isinstance(error, BrokenProcessPool) and self.executor is executor:
+                # The worker died (e.g. out of memory); the next clip gets a fresh one
+                self.executor = self._executor()
+            if self.on_error:
+                try:
+                    self.on_error(filename, error)
+                except Exception as e:
+                    print(f"Error in clip error callback for {name}: {e}")
+            return
+        self.last_result = result
+        CLIP_ENCODE_SECONDS.observe(result['encode_seconds'], self.format)
+        print(f"Clip encoded: {filename} ({result['frames']} frames in {result['encode_seconds']:.1f}s)")
+        if self.on_complete:
+            try:
+                self.on_complete(filename)
+            except Exception as e:
+                print(f"Error in clip callback for {name}: {e}")
+
+    def is_pending(self, name):
+        with self.pending_lock:
+            return name in self.pending
+
+    def wait_for(self, name, timeout):
+        """
+        Wait up to ``timeout`` seconds for clip ``name`` to be written and passed to ``on_complete``.
+
+        Returns:
+            bool: True if the clip is not (or no longer) being encoded
+        """
+        with self.pending_lock:
+            registered = self.pending.get(name)
+        return registered is None or registered.wait(timeout)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,260 @@
+"""
+Photo strips and grids composed from a three-shot session.
+
+Each shot's decoded frame is handed to the session by the post-processing
+pool, which shrinks it to cell size straight away, so no full-size frame is
+kept or read back from disk. Once every shot has arrived the layouts are
+composed on a background thread, written next to the photos as e.g.
+``strip_12.jpg`` and passed on for upload.
+"""
+import io
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from src.metrics import METRICS
+
+
+class CollageLayout:
+    """
+    Geometry of one layout: a grid of equally sized cells plus room for the logo.
+
+    If the shots leave a cell of the grid empty, the logo goes there; otherwise
+    a footer of ``footer`` pixels is added below the last row for it.
+    """
+
+    def __init__(self, name, columns, cell_size, shots=3, gap=20, footer=0, background=(255, 255, 255)):
+        """
+        Args:
+            name (str): Used as the output file prefix, e.g. ``strip``
+            columns (int): Cells per row
+            cell_size (tuple): (width, height) of each photo cell
+            shots (int): Number of photos in a session
+            gap (int): Border around and between the cells, in pixels
+            footer (int): Height of the logo footer when no cell is left free
+            background (tuple): RGB colour of the canvas
+        """
+        self.name = name
+        self.columns = columns
+        self.cell_size = cell_size
+        self.shots = shots
+        self.gap = gap
+        self.background = background
+
+        rows = math.ceil(shots / columns)
+        cell_width, cell_height = cell_size
+        self.cells = [
+            (gap + (i % columns) * (cell_width + gap), gap + (i // columns) * (cell_height + gap))
+            for i in range(rows * columns)
+        ]
+        width = gap + columns * (cell_width + gap)
+        height = gap + rows * (cell_height + gap)
+        if shots < len(self.cells):
+            x, y = self.cells[shots]
+            self.logo_box = (x, y, x + cell_width, y + cell_height)
+            self.footer = 0
+        else:
+            self.logo_box = (gap, height, width - gap, height + footer - gap)
+            self.footer = footer
+            height += footer
+        self.size = (width, height)
+        self.cells = self.cells[:shots]
+
+
+LAYOUTS = {
+    # Classic 2x6" print: three photos stacked above a logo footer
+    'strip': CollageLayout('strip', columns=1, cell_size=(600, 750), footer=260),
+    # 2x2 grid with the logo in the fourth cell
+    'grid': CollageLayout('grid', columns=2, cell_size=(540, 675)),
+}
+
+
+class CollageSession:
+    """Collects the cells of one three-shot session until it can be composed."""
+
+    def __init__(self, composer, number, layouts):
+        self.composer = composer
+        self.number = number
+        self.layouts = layouts
+        self.filenames = {layout.name: f"{layout.name}_{number}.jpg" for layout in layouts}
+        self.paths = {name: composer.path_for(filename) for name, filename in self.filenames.items()}
+        self.cells = {layout.name: [None] * layout.shots for layout in layouts}
+        self.remaining = max(layout.shots for layout in layouts)
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def cell_callback(self, shot):
+        """Return the ``on_decoded`` callback for the post-processor for shot number ``shot``."""
+        return lambda img: self.add(shot, img)
+
+    def add(self, shot, img):
+        """
+        Shrink ``img`` into this shot's cell of every layout.
+
+        Called from the post-processing pool before the frame is watermarked;
+        ``img`` is None if the frame could not be decoded.
+        """
+        cells = None
+        if img is not None:
+            try:
+                with METRICS.stage('collage_cell'):
+                    cells = {}
+                    for layout in self.layouts:
+                        cell = ImageOps.fit(img, layout.cell_size, Image.Resampling.BILINEAR)
+                        cells[layout.name] = cell if cell.mode == 'RGB' else cell.convert('RGB')
+            except Exception as e:
+                print(f"Could not add shot {shot + 1} to collage session {self.number}: {e}")
+                cells = None
+        with self.lock:
+            if cells is None:
+                self.failed = True
+            else:
+                for name, cell in cells.items():
+                    self.cells[name][shot] = cell
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self.composer._session_ready(self)
+
+    def cancel(self):
+        """Give up on this session, e.g. when a shot could not be taken at all."""
+        with self.lock:
+            self.failed = True
+            self.remaining = -1
+        self.composer._release(self.filenames.values())
+        self.composer._report_errors(self.paths.values(), 'the session was cancelled')
+
+
+class CollageComposer:
+    """
+    Composes finished sessions into the configured layouts on a background thread.
+
+    The layout canvases, including the scaled logo, are rendered once up front,
+    so composing a session is three pastes and one JPEG encode per layout.
+    """
+
+    def __init__(self, path_for, logo_path, layouts=('strip',), quality=90, on_complete=None, on_error=None):
+        """
+        Args:
+            path_for (callable): Returns the path a collage filename is written to (CaptureStorage.path_for)
+            logo_path (str): RGBA image placed in each layout's logo area
+            layouts (iterable): Names from ``LAYOUTS`` to produce for every session
+            quality (int): JPEG quality of the collages
+            on_complete (callable): Called with the path of every collage once it is written
+            on_error (callable): Called with the path and a message for every collage that is not produced
+        """
+        unknown = set(layouts) - set(LAYOUTS)
+        if unknown:
+            raise ValueError(f"Unknown collage layouts: {', '.join(sorted(unknown))}")
+        self.path_for = path_for
+        self.layouts = [LAYOUTS[name] for name in layouts]
+        self.quality = quality
+        self.on_complete = on_complete
+        self.on_error = on_error
+        with Image.open(logo_path) as logo:
+            logo = logo.convert('RGBA')
+            self.templates = {layout.name: self._render_template(layout, logo) for layout in self.layouts}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='collage')
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+    @staticmethod
+    def _render_template(layout, logo):
+        canvas = Image.new('RGB', layout.size, layout.background)
+        x0, y0, x1, y1 = layout.logo_box
+        logo = ImageOps.contain(logo, (x1 - x0, y1 - y0), Image.Resampling.LANCZOS)
+        position = (x0 + (x1 - x0 - logo.width) // 2, y0 + (y1 - y0 - logo.height) // 2)
+        canvas.paste(logo, position, logo)
+        return canvas
+
+    def start_session(self, number):
+        """
+        Begin a session whose collages will be named after ``number``.
+
+        The collage filenames count as pending from here on, so requests for
+        them wait instead of failing while the shots are still being taken.
+
+        Returns:
+            CollageSession
+        """
+        session = CollageSession(self, number, self.layouts)
+        with self.pending_lock:
+            for filename in session.filenames.values():
+                self.pending[filename] = threading.Event()
+        return session
+
+    def compose(self, layout, cells):
+        """Paste ``cells`` into a copy of the layout's template and return the image."""
+        canvas = self.templates[layout.name].copy()
+        for cell, position in zip(cells, layout.cells):
+            canvas.paste(cell, position)
+        return canvas
+
+    def _session_ready(self, session):
+        if session.failed:
+            print(f"Skipping collages for session {session.number}: a shot could not be processed")
+            self._release(session.filenames.values())
+            self._report_errors(session.paths.values(), 'a shot could not be processed')
+            return
+        self.executor.submit(self._compose_session, session)
+
+    def _compose_session(self, session):
+        for layout in session.layouts:
+            filename = session.filenames[layout.name]
+            path = session.paths[layout.name]
+            tmp_path = os.path.join(os.path.dirname(path), f".{filename}.part")
+            try:
+                with METRICS.stage('collage'):
+                    canvas = self.compose(layout, session.cells[layout.name])
+                    encoded = io.BytesIO()
+                    canvas.save(encoded, format='JPEG', quality=self.quality)
+                    with open(tmp_path, 'wb') as f:
+                        f.write(encoded.getbuffer())
+                    os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Failed to compose {filename}: {e}")
+                self._report_errors([path], str(e))
+                self._release([filename])
+                continue
+            print(f"Collage written: {path}")
+            try:
+                if self.on_complete:
+                    self.on_complete(path)
+            except Exception as e:
+                print(f"Error in collage callback for {filename}: {e}")
+            finally:
+                # Only now is the collage in storage, so wait_for callers can look it up
+                self._release([filename])
+
+    def _report_errors(self, paths, message):
+        if not self.on_error:
+            return
+        for path in paths:
+            try:
+                self.on_error(path, message)
+            except Exception as e:
+                print(f"Error in collage error callback for {os.path.basename(path)}: {e}")
+
+    def _release(self, filenames):
+        with self.pending_lock:
+            for filename in filenames:
+                event = self.pending.pop(filename, None)
+                if event is not None:
+                    event.set()
+
+    def wait_for(self, name, timeout):
+        """
+        Wait up to ``timeout`` seconds for the collage ``name`` to be written and passed to ``on_complete``.
+
+        Returns:
+            bool: True if ``name`` is not (or no longer) being composed
+        """
+        with self.pending_lock:
+            event = self.pending.get(name)
+        return event is None or event.wait(timeout)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,198 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from PIL import Image
+
+
+class DerivativeError(ValueError):
+    """Raised for derivative requests that cannot be served (bad size or format)."""
+
+
+class PhotoNotFound(DerivativeError):
+    """Raised when the source photo of a derivative does not exist."""
+
+
+class DerivativeCache:
+    """
+    On-demand resized variants of captured photos, kept in a size-bounded LRU disk cache.
+
+    Variant filenames embed the source's mtime and size, so a variant can never
+    outlive the photo it was made from, and the same values form a strong ETag.
+    Requested widths are snapped up to a small fixed set so guests cannot fill
+    the cache with arbitrary sizes.
+    """
+
+    WIDTHS = (160, 320, 640, 1080)
+    FORMATS = {
+        'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+        'webp': ('WEBP', 'image/webp', 'webp'),
+    }
+    REEL_WIDTH = 320
+
+    def __init__(self, resolve, cache_dir, max_bytes=512 * 1024 * 1024, quality=80):
+        """
+        Args:
+            resolve (callable): Returns the path of a full-size capture by filename, or None
+            cache_dir (str): Directory for the generated variants
+            max_bytes (int): Total size the cache is trimmed back to
+            quality (int): Encoder quality for JPEG and WebP variants
+        """
+        self.resolve = resolve
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        # variant -> [lock, holders and waiters]; dropped when the last of them is done
+        self.key_locks = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        """Rebuild the LRU order from the files already on disk, oldest first."""
+        found = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def normalize(self, width, fmt):
+        """
+        Snap a requested width/format onto the supported set.
+
+        Returns:
+            tuple: (width, format name)
+        """
+        fmt = (fmt or 'jpeg').lower()
+        if fmt == 'jpg':
+            fmt = 'jpeg'
+        if fmt not in self.FORMATS:
+            raise DerivativeError(f"Unsupported format: {fmt}")
+        try:
+            width = int(width) if width else self.WIDTHS[-1]
+        except (TypeError, ValueError):
+            raise DerivativeError(f"Invalid width: {width}")
+        if width <= 0:
+            raise DerivativeError(f"Invalid width: {width}")
+        for allowed in self.WIDTHS:
+            if width <= allowed:
+                return allowed, fmt
+        return self.WIDTHS[-1], fmt
+
+    def _variant(self, source_path, width, fmt):
+        stat = os.stat(source_path)
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        version = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        ext = self.FORMATS[fmt][2]
+        name = f"{stem}.{version}.w{width}.{ext}"
+        etag = f"{stem}-{version}-w{width}-{fmt}"
+        return name, etag
+
+    def get(self, filename, width=None, fmt=None):
+        """
+        Return a cached variant of ``filename``, generating it if needed.
+
+        Returns:
+            tuple: (path to the variant, strong ETag value, mimetype)
+        """
+        width, fmt = self.normalize(width, fmt)
+        source_path = self.resolve(filename) if os.path.basename(filename) == filename else None
+        if source_path is None or not os.path.isfile(source_path):
+            raise PhotoNotFound(f"No such photo: {filename}")
+
+        variant, etag = self._variant(source_path, width, fmt)
+        path = os.path.join(self.cache_dir, variant)
+        if not self._touch(variant):
+            with self._key_lock(variant):
+                if not self._touch(variant):
+                    with Image.open(source_path) as img:
+                        # Let libjpeg decode at a reduced scale when it can
+                        img.draft('RGB', (width, round(img.height * width / img.width)))
+                        self._write(img, path, width, fmt)
+        return path, etag, self.FORMATS[fmt][1]
+
+    def store_from_image(self, source_path, img, width=REEL_WIDTH, fmt='jpeg'):
+        """Generate a variant from an already decoded image, e.g. right after capture."""
+        width, fmt = self.normalize(width, fmt)
+        variant, _ = self._variant(source_path, width, fmt)
+        with self._key_lock(variant):
+            if not self._touch(variant):
+                self._write(img, os.path.join(self.cache_dir, variant), width, fmt)
+
+    @contextmanager
+    def _key_lock(self, variant):
+        """Hold the lock for one variant, so it is generated once however many requests ask for it."""
+        with self.lock:
+            entry = self.key_locks.get(variant)
+            if entry is None:
+                entry = self.key_locks[variant] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.key_locks[variant]
+
+    def _touch(self, variant):
+        """Mark a variant as recently used. Returns False if it is not cached."""
+        with self.lock:
+            if variant not in self.entries:
+                return False
+            self.entries.move_to_end(variant)
+        try:
+            os.utime(os.path.join(self.cache_dir, variant))
+        except FileNotFoundError:
+            with self.lock:
+                size = self.entries.pop(variant, 0)
+                self.total_bytes -= size
+            return False
+        return True
+
+    def _write(self, img, path, width, fmt):
+        resized = img if img.mode in ('RGB', 'RGBX') else img.convert('RGB')
+        if resized.width > width:
+            height = round(resized.height * width / resized.width)
+            resized = resized.resize((width, height), Image.Resampling.LANCZOS)
+        # RGBX frames straight from the camera are only converted at thumbnail size
+        if resized.mode != 'RGB':
+            resized = resized.convert('RGB')
+
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.part', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            resized.save(tmp_path, format=self.FORMATS[fmt][0], quality=self.quality)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        size = os.path.getsize(path)
+        variant = os.path.basename(path)
+        with self.lock:
+            self.total_bytes += size - self.entries.get(variant, 0)
+            self.entries[variant] = size
+            self.entries.move_to_end(variant)
+        self._evict()
+
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or len(self.entries) <= 1:
+                    return
+                variant, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, variant))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,191 @@
+"""
+Change feed of new photos for live guest galleries.
+
+Every photo is published once it is on disk, as a small server-sent event
+(capture number, URLs, dimensions) that is encoded once and shared by all
+subscribers. A subscriber starts with a catch-up from the photo index (photos
+newer than its ``since`` id, or the latest few for a fresh page) and then
+follows the feed's in-memory log, so photos finished out of order by the
+post-processing pool are still delivered exactly once. A subscriber that falls
+further behind than the log keeps catches up from the index again.
+"""
+import asyncio
+import itertools
+import json
+import threading
+from collections import OrderedDict, deque
+
+from src.metrics import METRICS
+
+FEED_EVENTS = METRICS.counter('photobooth_feed_events_total', 'Photos published to the gallery feed')
+
+
+class PhotoFeed:
+    """Publishes new photos to any number of waiting gallery subscribers."""
+
+    def __init__(self, photo_index, thumbnail_width=320, history=256, catch_up_limit=60):
+        """
+        Args:
+            photo_index (PhotoIndex): Source of catch-up records
+            thumbnail_width (int): Width of the thumbnail URL in each event
+            history (int): Published events kept for subscribers that are behind
+            catch_up_limit (int): Most photos sent to a (re)connecting subscriber
+        """
+        self.photo_index = photo_index
+        self.thumbnail_width = thumbnail_width
+        self.catch_up_limit = catch_up_limit
+        # (position, capture number, encoded event) in publish order
+        self.log = deque(maxlen=history)
+        self.position = 0
+        self.encoded = OrderedDict()
+        self.history = history
+        self.condition = threading.Condition()
+        self.async_waiters = {}
+        self.subscribers = 0
+        METRICS.gauge('photobooth_feed_subscribers', 'Connected gallery feed subscribers', lambda: self.subscribers)
+
+    def event(self, record):
+        """The event payload for a photo record."""
+        data = record.as_dict()
+        data['thumbnail'] = f"{data['url']}?w={self.thumbnail_width}"
+        return data
+
+    def encode(self, record):
+        """Server-sent event text for a record, encoded once per photo."""
+        with self.condition:
+            cached = self.encoded.get(record.number)
+        if cached is not None:
+            return cached
+        record.load_dimensions()
+        encoded = f"id: {record.number}\nevent: photo\ndata: {json.dumps(self.event(record))}\n\n"
+        with self.condition:
+            self.encoded[record.number] = encoded
+            while len(self.encoded) > self.history:
+                self.encoded.popitem(last=False)
+        return encoded
+
+    def publish(self, record):
+        """Announce a photo that has just been added to the index."""
+        encoded = self.encode(record)
+        with self.condition:
+            self.position += 1
+            self.log.append((self.position, record.number, encoded))
+            self.condition.notify_all()
+            waiters = {loop: list(events) for loop, events in self.async_waiters.items()}
+        # One wake-up per event loop rather than one per subscriber
+        for loop, events in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_set_all, events)
+            except RuntimeError:
+                # The loop has been closed; its waiters are gone
+                pass
+        FEED_EVENTS.inc()
+
+    def subscribe(self, since=None):
+        """
+        Start following the feed.
+
+        Args:
+            since (int): Last capture number the client has, or None for the latest photos
+        """
+        return FeedSubscription(self, since)
+
+    def _entries_after(self, position):
+        """Log entries after ``position``, or None if they have dropped out of the log. Holds ``condition``."""
+        if not self.log or position >= self.position:
+            return []
+        first = self.log[0][0]
+        if position + 1 < first:
+            return None
+        return list(itertools.islice(self.log, position + 1 - first, None))
+
+    def stats(self):
+        with self.condition:
+            return {'subscribers': self.subscribers, 'published': self.position, 'history': len(self.log)}
+
+
+def _set_all(events):
+    for event in events:
+        event.set()
+
+
+class FeedSubscription:
+    """One client's place in the feed. ``next``/``next_async`` return SSE-encoded events."""
+
+    def __init__(self, feed, since=None):
+        self.feed = feed
+        self.closed = False
+        with feed.condition:
+            feed.subscribers += 1
+        self._catch_up(since)
+
+    def _catch_up(self, since):
+        feed = self.feed
+        # Taken before reading the index: anything published later is in the log, and dropped
+        # there if the catch-up already had it
+        with feed.condition:
+            self.position = feed.position
+        records = feed.photo_index.after(since, feed.catch_up_limit)
+        self.backlog = [feed.encode(record) for record in records]
+        self.caught_up = {record.number for record in records}
+        self.last_id = max(self.caught_up, default=since)
+
+    def _deliver(self, entries):
+        if entries is None:
+            # Fell behind the log; start over from the index
+            self._catch_up(self.last_id)
+            events, self.backlog = self.backlog, []
+            return events
+        events = []
+        for position, number, encoded in entries:
+            self.position = position
+            if number in self.caught_up:
+                continue
+            events.append(encoded)
+            self.last_id = number if self.last_id is None else max(self.last_id, number)
+        return events
+
+    def next(self, timeout=None):
+        """Wait up to ``timeout`` seconds for new photos. Returns their events, empty on timeout."""
+        if self.backlog:
+            events, self.backlog = self.backlog, []
+            return events
+        feed = self.feed
+        with feed.condition:
+            feed.condition.wait_for(lambda: feed.position > self.position, timeout)
+            entries = feed._entries_after(self.position)
+        return self._deliver(entries)
+
+    async def next_async(self, timeout=None):
+        """Like ``next``, but waits on the event loop instead of a thread."""
+        if self.backlog:
+            events, self.backlog = self.backlog, []
+            return events
+        feed = self.feed
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        with feed.condition:
+            ready = feed.position > self.position
+            if not ready:
+                feed.async_waiters.setdefault(loop, set()).add(wakeup)
+        try:
+            if not ready:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with feed.condition:
+                waiters = feed.async_waiters.get(loop)
+                if waiters is not None:
+                    waiters.discard(wakeup)
+                    if not waiters:
+                        del feed.async_waiters[loop]
+                entries = feed._entries_after(self.position)
+        return self._deliver(entries)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            with self.feed.condition:
+                self.feed.subscribers -= 1
@@ -0,0 +1,90 @@
+import os
+import time
+
+# 'pi' for the real camera and NeoPixel strip, 'sim' for the simulated backends
+DEFAULT_BACKEND = os.environ.get('PHOTOBOOTH_HARDWARE', 'pi')
+
+
+class PiHardware:
+    """Real Raspberry Pi camera (picamera2/libcamera) and NeoPixel strip on GPIO 18."""
+
+    name = 'pi'
+
+    def __init__(self):
+        from picamera2 import MappedArray, Picamera2
+        from picamera2.encoders import MJPEGEncoder, Quality
+        from picamera2.outputs import FileOutput
+        from libcamera import Transform
+
+        self.Picamera2 = Picamera2
+        self.MappedArray = MappedArray
+        self.MJPEGEncoder = MJPEGEncoder
+        self.Quality = Quality
+        self.FileOutput = FileOutput
+        self.Transform = Transform
+
+    def create_camera(self):
+        return self.Picamera2()
+
+    def recording_quality(self, jpeg_quality):
+        """
+        ``start_recording`` quality for a JPEG quality (1-100).
+
+        The hardware MJPEG encoder is driven by bitrate, which picamera2 derives
+        from its five ``Quality`` levels and the stream size and frame rate.
+        """
+        return self.Quality(min(max(jpeg_quality, 1) // 20, len(self.Quality) - 1))
+
+    def set_frame_callback(self, camera, callback):
+        """
+        Call ``callback(array, timestamp)`` with every main-stream frame, on picamera2's thread.
+
+        The array maps the camera's buffer and is only valid during the call.
+        ``timestamp`` is the sensor's start-of-exposure time converted to
+        time.time(), so it can be compared with shutter times.
+        """
+        if callback is None:
+            camera.post_callback = None
+            return
+
+        def post_callback(request):
+            sensor_ns = request.get_metadata().get('SensorTimestamp')
+            now = time.time()
+            if sensor_ns is None:
+                timestamp = now
+            else:
+                # libcamera stamps with CLOCK_BOOTTIME (CLOCK_MONOTONIC on older releases); use
+                # whichever clock the stamp is just behind
+                ages = [time.clock_gettime_ns(clock) - sensor_ns
+                        for clock in (time.CLOCK_BOOTTIME, time.CLOCK_MONOTONIC)]
+                timestamp = now - min((a for a in ages if a >= 0), default=0) / 1e9
+            with self.MappedArray(request, 'main') as mapped:
+                callback(mapped.array, timestamp)
+
+        camera.post_callback = post_callback
+
+    def create_pixels(self, num_pixels):
+        import board
+        import neopixel
+
+        return neopixel.NeoPixel(board.D18, num_pixels, auto_write=False)
+
+
+def load_hardware(backend=None, **options):
+    """
+    Return the hardware backend to drive the camera and LEDs with.
+
+    Args:
+        backend: 'pi', 'sim', an already constructed backend, or None for $PHOTOBOOTH_HARDWARE
+        **options: Passed to the simulated backend (e.g. fps, size)
+    """
+    if backend is not None and not isinstance(backend, str):
+        return backend
+    backend = backend or DEFAULT_BACKEND
+    if backend == 'pi':
+        return PiHardware()
+    if backend == 'sim':
+        from src.simulated import SimulatedHardware
+
+        return SimulatedHardware(**options)
+    raise ValueError(f"Unknown hardware backend: {backend}")
@@ -0,0 +1,293 @@
+"""
+Capture jobs: queued capture requests with a stream of progress events.
+
+``POST /jobs`` only enqueues a job and returns its id; a single worker thread
+runs jobs one after another, since there is only one camera. Each job keeps an
+ordered list of events (queued, countdown ticks, shutters, post-processing and
+upload results) that clients follow with ``/jobs/<id>/events``. When the queue
+is full, a new request is either folded into a job that is already waiting
+(``coalesce``) or turned away (``reject``).
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from src.metrics import METRICS
+
+JOB_KINDS = ('photo', 'burst', 'clip')
+QUEUE_POLICIES = ('coalesce', 'reject')
+TERMINAL_STATES = ('done', 'failed')
+
+JOB_RESULTS = METRICS.counter('photobooth_capture_jobs_total', 'Capture job requests by outcome', ('result',))
+
+
+class JobQueueFull(Exception):
+    """Raised by CaptureJobQueue.submit when the queue is full and the policy is ``reject``."""
+
+
+class CaptureJob:
+    """
+    One capture request and everything that happened to it.
+
+    Events are appended under ``condition`` and never removed, so a client can
+    (re)connect at any point and replay from the last event id it saw.
+    """
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.state = 'queued'
+        self.created = time.time()
+        self.error = None
+        self.filenames = []
+        self.collages = []
+        # Files whose upload has not been confirmed or given up on yet
+        self.outstanding = set()
+        self.events = []
+        self.condition = threading.Condition()
+        self.async_waiters = set()
+        self.finished = threading.Event()
+
+    def publish(self, event, **data):
+        """Append an event and wake everybody following this job."""
+        with self.condition:
+            self.events.append({'id': len(self.events) + 1, 'event': event, 'time': time.time(), 'data': data})
+            self.condition.notify_all()
+            waiters = list(self.async_waiters)
+        for loop, wakeup in waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # The loop has been closed; its waiter is gone
+                pass
+
+    @property
+    def closed(self):
+        """True once the job is finished and no upload is outstanding."""
+        return self.state in TERMINAL_STATES and not self.outstanding
+
+    def events_since(self, last_id, timeout=None):
+        """
+        Return the events after ``last_id``, waiting up to ``timeout`` for new ones.
+
+        Returns:
+            tuple: (events, closed)
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.events) > last_id or self.closed, timeout)
+            return self.events[last_id:], self.closed
+
+    async def events_since_async(self, last_id, timeout=None):
+        """Like ``events_since``, but waits on the event loop instead of a thread."""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        waiter = (loop, wakeup)
+        with self.condition:
+            self.async_waiters.add(waiter)
+        try:
+            with self.condition:
+                ready = len(self.events) > last_id or self.closed
+            if not ready:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            with self.condition:
+                return self.events[last_id:], self.closed
+        finally:
+            with self.condition:
+                self.async_waiters.discard(waiter)
+
+    async def wait_async(self):
+        """Wait on the event loop until the capture has finished; its uploads may still be outstanding."""
+        last_id = 0
+        while self.state not in TERMINAL_STATES:
+            events, _ = await self.events_since_async(last_id)
+            last_id += len(events)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'created': self.created,
+            'filenames': [os.path.basename(f) for f in self.filenames],
+            'collages': [os.path.basename(f) for f in self.collages],
+            'error': self.error,
+            'events': f"/jobs/{self.id}/events",
+        }
+
+
+class CaptureJobQueue:
+    """
+    Runs capture jobs one at a time on a dedicated worker thread.
+
+    The camera system reports progress through the callback it is given and
+    file state through its ``file_listeners``; both are routed to the job that
+    produced the file.
+    """
+
+    def __init__(self, camera_system, max_queued=2, policy='coalesce', history=50):
+        """
+        Args:
+            camera_system (CameraCaptureSystem): Runs the captures
+            max_queued (int): Jobs allowed to wait behind the running one
+            policy (str): ``coalesce`` or ``reject``, applied when the queue is full
+            history (int): Finished jobs kept for late /jobs/<id> lookups
+        """
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown job queue policy {policy!r}, expected one of {', '.join(QUEUE_POLICIES)}")
+        self.camera_system = camera_system
+        self.max_queued = max_queued
+        self.policy = policy
+        self.history = history
+        self.jobs = OrderedDict()
+        self.queue = deque()
+        self.by_path = {}
+        self.running = None
+        self.condition = threading.Condition()
+        self.is_running = True
+        camera_system.file_listeners.append(self._file_event)
+        METRICS.gauge('photobooth_capture_jobs_queued', 'Capture jobs waiting to run', lambda: len(self.queue))
+        self.thread = threading.Thread(target=self._run, name='capture-jobs', daemon=True)
+        self.thread.start()
+
+    def submit(self, kind):
+        """
+        Queue a capture job.
+
+        Returns:
+            tuple: (CaptureJob, coalesced) where ``coalesced`` is True if an
+            already queued job was returned instead of a new one
+
+        Raises:
+            ValueError: For an unknown ``kind``
+            JobQueueFull: When the queue is full and the policy is ``reject``
+                (or there is no queued job of the same kind to coalesce into)
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind {kind!r}, expected one of {', '.join(JOB_KINDS)}")
+        with self.condition:
+            if len(self.queue) >= self.max_queued:
+                if self.policy == 'coalesce':
+                    for job in reversed(self.queue):
+                        if job.kind == kind:
+                            JOB_RESULTS.inc('coalesced')
+                            return job, True
+                JOB_RESULTS.inc('rejected')
+                raise JobQueueFull(f"{len(self.queue)} capture job(s) already waiting")
+            job = CaptureJob(kind)
+            self.jobs[job.id] = job
+            self.queue.append(job)
+            position = len(self.queue) + (1 if self.running else 0)
+            self._trim_history()
+            # Published before the worker can see the job, so 'queued' is always the first event
+            job.publish('queued', position=position)
+            self.condition.notify_all()
+        JOB_RESULTS.inc('queued')
+        return job, False
+
+    def get(self, job_id):
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in TERMINAL_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.is_running and not self.queue:
+                    self.condition.wait()
+                if not self.is_running:
+                    break
+                job = self.running = self.queue.popleft()
+            try:
+                self._execute(job)
+            finally:
+                with self.condition:
+                    self.running = None
+
+    def _execute(self, job):
+        job.state = 'running'
+        job.publish('started', kind=job.kind)
+
+        def progress(event, **data):
+            # Files are tracked before they can be written, so no file event is missed
+            if event == 'shutter':
+                self._track(job, data['filename'])
+                data['filename'] = os.path.basename(data['filename'])
+            elif event == 'collages':
+                for path in data['filenames']:
+                    self._track(job, path)
+                data['filenames'] = [os.path.basename(f) for f in data['filenames']]
+            job.publish(event, **data)
+
+        try:
+            if job.kind == 'photo':
+                job.filenames = [self.camera_system.capture_image(progress=progress)]
+            elif job.kind == 'clip':
+                job.filenames = [self.camera_system.capture_clip(progress=progress)]
+            else:
+                job.filenames = self.camera_system.capture_image_3(progress=progress)
+                job.collages = list(self.camera_system.last_collages)
+        except Exception as e:
+            job.error = str(e)
+            job.state = 'failed'
+            JOB_RESULTS.inc('failed')
+            print(f"Capture job {job.id} failed: {e}")
+            job.publish('failed', error=job.error)
+        else:
+            job.state = 'done'
+            JOB_RESULTS.inc('done')
+            job.publish('done', filenames=[os.path.basename(f) for f in job.filenames],
+                        collages=[os.path.basename(f) for f in job.collages])
+        finally:
+            job.finished.set()
+
+    def _track(self, job, path):
+        path = os.path.abspath(path)
+        with self.condition:
+            self.by_path[path] = job
+        with job.condition:
+            job.outstanding.add(path)
+
+    def _file_event(self, event, path, **data):
+        """Listener on the camera system: ``processed``, ``process_failed`` and upload results."""
+        path = os.path.abspath(path)
+        with self.condition:
+            job = self.by_path.get(path)
+        if job is None:
+            return
+        if event in ('process_failed', 'uploaded', 'upload_failed'):
+            with self.condition:
+                self.by_path.pop(path, None)
+            with job.condition:
+                job.outstanding.discard(path)
+        job.publish(event, filename=os.path.basename(path), **data)
+
+    def stop(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        self.thread.join(timeout=5)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'running': self.running.id if self.running else None,
+                'queued': [job.id for job in self.queue],
+                'policy': self.policy,
+                'max_queued': self.max_queued,
+            }
+
+
+def sse_format(event):
+    """Encode one job event as a server-sent event."""
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
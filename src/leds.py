@@ -0,0 +1,304 @@
+"""
+Tick-based LED animation engine.
+
+A single long-lived render thread wakes at fixed tick deadlines and copies the
+current animation's precomputed frame to the strip. Animations are compact
+``(frames, pixels, 3)`` uint8 arrays built once per parameter set, and each one
+can be scheduled to start at an absolute ``time.perf_counter()`` deadline, so
+e.g. the flash can be lined up with a shutter time chosen in advance. A
+scheduled animation waits behind the one playing and only takes over once its
+deadline arrives.
+"""
+import bisect
+import threading
+import time
+
+import numpy as np
+
+from src.hardware import load_hardware
+from src.metrics import METRICS
+
+TICK_LATENESS = METRICS.histogram(
+    'photobooth_led_tick_lateness_seconds',
+    'How late the LED render thread woke up for each tick',
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+)
+TICK_OVERRUNS = METRICS.counter('photobooth_led_overruns_total', 'LED ticks skipped because rendering fell behind')
+
+COUNTDOWN_COLORS = ((255, 0, 0), (255, 255, 0), (0, 255, 0))  # Red, Yellow, Green
+COUNTDOWN_SECONDS = len(COUNTDOWN_COLORS)
+FLASH_SECONDS = 0.3
+PULSE_PERIOD = 1.0
+
+
+class Animation:
+    """One scheduled playback of a frame sequence."""
+
+    def __init__(self, name, frames, start, duration, loop=False):
+        """
+        Args:
+            name (str): Animation type, for logging and stats
+            frames (numpy.ndarray): ``(n, pixels, 3)`` uint8 frames, one per tick
+            start (float): perf_counter deadline of the first frame
+            duration (float): Seconds until the animation ends and the strip is cleared
+            loop (bool): Repeat ``frames`` until ``duration`` has passed
+        """
+        self.name = name
+        self.frames = frames
+        self.start = start
+        self.end = start + duration
+        self.loop = loop
+        self.done = threading.Event()
+
+
+class PixelAnimator:
+    """
+    Plays countdown, pulse and flash animations on the NeoPixel strip.
+
+    ``start_animation`` only swaps the animation the render thread is playing,
+    so switching never starts or joins a thread; one scheduled for later is
+    queued and swapped in by the render thread when its start arrives. Ticks are scheduled against
+    absolute deadlines; a tick that starts late is counted in the lateness
+    histogram, and when rendering falls a whole tick behind the missed ticks
+    are skipped (and counted as overruns) instead of played back late.
+    """
+
+    def __init__(self, num_pixels, hardware=None, tick_rate=60):
+        """
+        Args:
+            num_pixels (int): Number of LEDs on the strip
+            hardware: Backend name or object passed to ``load_hardware``
+            tick_rate (int): Render ticks per second
+        """
+        self.pixels = load_hardware(hardware).create_pixels(num_pixels)
+        self.num_pixels = num_pixels
+        self.tick = 1.0 / tick_rate
+        self.frame_cache = {}
+        self.current = None
+        self.scheduled = []  # Animations waiting for their start, soonest first
+        self.condition = threading.Condition()
+        self.running = True
+        self.last_frame = None
+        self.ticks = 0
+        self.frames_shown = 0
+        self.overruns = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self.thread = threading.Thread(target=self._render_loop, name='led-render', daemon=True)
+        self.thread.start()
+
+    # Frame generation
+
+    def _frames(self, animation_type, **kwargs):
+        key = (animation_type, tuple(sorted(kwargs.items())))
+        frames = self.frame_cache.get(key)
+        if frames is None:
+            if animation_type == 'countdown':
+                frames = self._countdown_frames(**kwargs)
+            elif animation_type == 'pulse':
+                frames = self._pulse_frames(**kwargs)
+            elif animation_type == 'flash':
+                frames = self._flash_frames(**kwargs)
+            else:
+                raise ValueError(f"Unknown animation type: {animation_type}")
+            frames.setflags(write=False)
+            self.frame_cache[key] = frames
+        return frames
+
+    def _ticks(self, seconds):
+        return max(1, round(seconds / self.tick))
+
+    def _countdown_frames(self):
+        """A dot with a dimmed tail runs round the strip once per second, per colour."""
+        frames = np.zeros((self._ticks(COUNTDOWN_SECONDS), self.num_pixels, 3), dtype=np.uint8)
+        t = np.arange(len(frames)) * self.tick
+        second = np.minimum(t.astype(int), len(COUNTDOWN_COLORS) - 1)
+        step = ((t % 1.0) * self.num_pixels).astype(int)
+        colors = np.array(COUNTDOWN_COLORS, dtype=np.uint16)[second]
+        rows = np.arange(len(frames))
+        frames[rows, step] = colors
+        tail = step > 0
+        frames[rows[tail], step[tail] - 1] = colors[tail] * 3 // 10
+        return frames
+
+    def _pulse_frames(self, color=(0, 255, 0)):
+        """One fade-in/fade-out period, looped for the animation's duration."""
+        t = np.arange(self._ticks(PULSE_PERIOD)) * self.tick / PULSE_PERIOD
+        level = 1.0 - np.abs(2.0 * t - 1.0)
+        frame = (level[:, None] * np.array(color, dtype=np.float32)[None, :]).astype(np.uint8)
+        return np.repeat(frame[:, None, :], self.num_pixels, axis=1)
+
+    def _flash_frames(self):
+        return np.full((self._ticks(FLASH_SECONDS), self.num_pixels, 3), 255, dtype=np.uint8)
+
+    # Scheduling
+
+    def start_animation(self, animation_type, duration=1, blocking=False, at=None, **kwargs):
+        """
+        Schedule an animation, replacing whatever is playing.
+
+        With a future ``at`` and an animation already playing, the new one is
+        queued and replaces it only when ``at`` arrives, so e.g. the next flash
+        of a burst doesn't cut the current one short.
+
+        Args:
+            animation_type (str): ``countdown``, ``pulse`` or ``flash``
+            duration (float): Length of looping animations (pulse), in seconds
+            blocking (bool): Wait until the animation has finished
+            at (float): ``time.perf_counter()`` deadline of the first frame; defaults to now
+            **kwargs: Animation parameters, e.g. ``color`` for pulse
+
+        Returns:
+            float: The deadline of the first frame
+        """
+        frames = self._frames(animation_type, **kwargs)
+        start = time.perf_counter() if at is None else at
+        if animation_type == 'pulse':
+            animation = Animation(animation_type, frames, start, duration, loop=True)
+        else:
+            animation = Animation(animation_type, frames, start, len(frames) * self.tick)
+        with self.condition:
+            if self.current is not None and start > time.perf_counter():
+                bisect.insort(self.scheduled, animation, key=lambda a: a.start)
+            else:
+                if self.current is not None:
+                    self.current.done.set()
+                self.current = animation
+            self.condition.notify_all()
+        if blocking:
+            animation.done.wait()
+        return start
+
+    def stop_animation(self):
+        """Stop the current animation, drop the scheduled ones and clear the strip."""
+        with self.condition:
+            for animation in [self.current] + self.scheduled:
+                if animation is not None:
+                    animation.done.set()
+            self.current = None
+            self.scheduled = []
+            self.condition.notify_all()
+
+    def shutdown(self):
+        self.stop_animation()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    # Render thread
+
+    def _render_loop(self):
+        try:
+            while True:
+                with self.condition:
+                    while self.running and self.current is None:
+                        if self.scheduled:
+                            self._promote_due()
+                            if self.current is None:
+                                self.condition.wait(self.scheduled[0].start - time.perf_counter())
+                        else:
+                            self.condition.wait()
+                    if not self.running:
+                        break
+                    animation = self.current
+                self._play(animation)
+        finally:
+            self._clear()
+
+    def _promote_due(self):
+        """Swap in the latest scheduled animation whose start has arrived. Call with the condition held."""
+        due = bisect.bisect_right(self.scheduled, time.perf_counter(), key=lambda a: a.start)
+        if not due:
+            return
+        for animation in [self.current] + self.scheduled[:due - 1]:
+            if animation is not None:
+                animation.done.set()
+        self.current = self.scheduled[due - 1]
+        del self.scheduled[:due]
+
+    def _wait_until(self, deadline, animation):
+        """Sleep until ``deadline``. Returns False if ``animation`` was replaced meanwhile."""
+        with self.condition:
+            while self.current is animation and self.running:
+                self._promote_due()
+                if self.current is not animation:
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return True
+                if self.scheduled:
+                    remaining = min(remaining, self.scheduled[0].start - time.perf_counter())
+                self.condition.wait(max(0.0, remaining))
+        return False
+
+    def _play(self, animation):
+        if animation.start > time.perf_counter():
+            # Don't leave the previous animation lit until a scheduled start
+            self._clear()
+        tick = 0
+        while True:
+            deadline = animation.start + tick * self.tick
+            if deadline >= animation.end:
+                break
+            if not self._wait_until(deadline, animation):
+                self._clear_if_stopped()
+                return
+            lateness = time.perf_counter() - deadline
+            self._record_tick(lateness)
+            if lateness >= self.tick:
+                # Fell a whole tick behind: jump to the frame that is due now
+                skipped = int(lateness / self.tick)
+                self.overruns += skipped
+                TICK_OVERRUNS.inc(amount=skipped)
+                tick += skipped
+                if animation.start + tick * self.tick >= animation.end:
+                    break
+            index = tick % len(animation.frames) if animation.loop else min(tick, len(animation.frames) - 1)
+            self._show(animation.frames[index])
+            tick += 1
+
+        if self._wait_until(animation.end, animation):
+            with self.condition:
+                if self.current is animation:
+                    self.current = None
+            self._clear()
+        else:
+            self._clear_if_stopped()
+        animation.done.set()
+
+    def _clear(self):
+        self._show(np.zeros((self.num_pixels, 3), dtype=np.uint8))
+
+    def _clear_if_stopped(self):
+        with self.condition:
+            stopped = self.current is None
+        if stopped:
+            self._clear()
+
+    def _record_tick(self, lateness):
+        self.ticks += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        TICK_LATENESS.observe(lateness)
+
+    def _show(self, frame):
+        # Only touch the strip when the frame actually changes
+        if self.last_frame is not None and np.array_equal(frame, self.last_frame):
+            return
+        self.pixels[:] = [tuple(pixel) for pixel in frame.tolist()]
+        self.pixels.show()
+        self.last_frame = frame
+        self.frames_shown += 1
+
+    def stats(self):
+        """Tick timing so far: lateness is how long after its deadline each tick started."""
+        return {
+            'tick_ms': self.tick * 1000,
+            'ticks': self.ticks,
+            'frames_shown': self.frames_shown,
+            'overruns': self.overruns,
+            'lateness_mean_ms': self.total_lateness / self.ticks * 1000 if self.ticks else 0.0,
+            'lateness_max_ms': self.max_lateness * 1000,
+        }
@@ -0,0 +1,225 @@
+"""
+Lightweight in-process metrics with Prometheus text output.
+
+Recording a stage costs two perf_counter calls and one short lock, so the
+instrumentation stays on in production. Everything registers on the
+module-level ``METRICS`` registry, which app.py serves on /metrics.
+"""
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labelvalues)
+            if series is None:
+                series = self.series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, *labelvalues):
+        """Return (count, sum) for one label combination."""
+        with self.lock:
+            series = self.series.get(labelvalues)
+            return (series[2], series[1]) if series else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.series.items())
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """A gauge whose value is read from a callback at scrape time."""
+
+    def __init__(self, name, help, callback, labelnames=()):
+        """
+        Args:
+            callback (callable): Returns a number, or a dict of label tuple -> number
+        """
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"Error reading gauge {self.name}: {e}")
+            return lines
+        values = value if isinstance(value, dict) else {(): value}
+        for labelvalues, v in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(v)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.stage_seconds = self.histogram(
+            'photobooth_stage_seconds', 'Time spent in each capture/stream/upload stage', ('stage',))
+
+    def _register(self, name, factory):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = factory()
+            return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(name, lambda: Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(name, lambda: Counter(name, help, labelnames))
+
+    def gauge(self, name, help, callback, labelnames=()):
+        """Register (or replace) a callback gauge, e.g. when the camera system is rebuilt."""
+        gauge = Gauge(name, help, callback, labelnames)
+        with self.lock:
+            self.metrics[name] = gauge
+        return gauge
+
+    def observe_stage(self, stage, seconds, trace=None):
+        self.stage_seconds.observe(seconds, stage)
+        if trace is not None:
+            trace.add(stage, seconds)
+
+    @contextmanager
+    def stage(self, stage, trace=None):
+        """Time the enclosed block as ``stage`` (and add it to ``trace`` if given)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start, trace)
+
+    def render(self):
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class CaptureTrace:
+    """
+    Per-capture record of stage timings, written as one JSON line when finished.
+
+    The same trace follows a photo from the shutter thread into the
+    post-processing pool, so a single line shows where that photo's time went.
+    """
+
+    def __init__(self, writer, kind, **fields):
+        self.writer = writer
+        self.record = {'kind': kind, 'started': time.time(), 'stages': []}
+        self.record.update(fields)
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        offset = time.perf_counter() - self.origin - seconds
+        with self.lock:
+            self.record['stages'].append({
+                'stage': stage,
+                'start_ms': round(offset * 1000, 3),
+                'duration_ms': round(seconds * 1000, 3),
+            })
+
+    def set(self, **fields):
+        with self.lock:
+            self.record.update(fields)
+
+    def finish(self):
+        with self.lock:
+            self.record['total_ms'] = round((time.perf_counter() - self.origin) * 1000, 3)
+            line = json.dumps(self.record)
+        self.writer.write(line)
+
+
+class TraceWriter:
+    """Appends finished CaptureTraces to a JSON-lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def start(self, kind, **fields):
+        return CaptureTrace(self, kind, **fields)
+
+    def write(self, line):
+        with self.lock:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(line + '\n')
+            except OSError as e:
+                print(f"Could not write capture trace to {self.path}: {e}")
+
+
+METRICS = MetricsRegistry()
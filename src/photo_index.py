@@ -0,0 +1,178 @@
+import bisect
+import os
+import re
+import threading
+
+from PIL import Image
+
+PHOTO_PATTERN = re.compile(r'photo_(\d+)\.jpg$')
+
+
+def photo_number(filename):
+    """Return the capture number of a ``photo_N.jpg`` filename, or None."""
+    match = PHOTO_PATTERN.match(filename)
+    return int(match.group(1)) if match else None
+
+
+class PhotoRecord:
+    __slots__ = ('number', 'filename', 'path', 'timestamp', 'size', 'width', 'height')
+
+    def __init__(self, number, filename, path, timestamp, size, width=None, height=None):
+        self.number = number
+        self.filename = filename
+        self.path = path
+        self.timestamp = timestamp
+        self.size = size
+        self.width = width
+        self.height = height
+
+    def load_dimensions(self):
+        """Read the image size from the file header if it is not known yet."""
+        if self.width is None:
+            try:
+                with Image.open(self.path) as img:
+                    self.width, self.height = img.size
+            except OSError:
+                pass
+        return self.width, self.height
+
+    def as_dict(self):
+        return {
+            'id': self.number,
+            'filename': self.filename,
+            'url': f"/captures/{self.filename}",
+            'timestamp': self.timestamp,
+            'size': self.size,
+            'width': self.width,
+            'height': self.height,
+        }
+
+
+class PhotoIndex:
+    """
+    In-memory index of captured photos, ordered by capture number.
+
+    Built once at startup from the capture storage's shard manifests; after
+    that every capture is added as it is written, so listing the gallery never
+    touches the disk. Image dimensions are read lazily from the file header the
+    first time a record is listed.
+    """
+
+    def __init__(self, storage):
+        """
+        Args:
+            storage (CaptureStorage): Where the captures live
+        """
+        self.storage = storage
+        self.records = {}
+        self.numbers = []
+        self.lock = threading.Lock()
+        self.rebuild()
+
+    def rebuild(self):
+        """Replace the index contents with the photos currently in storage."""
+        records = {}
+        for filename, path, mtime, size in self.storage.files():
+            number = photo_number(filename)
+            if number is not None:
+                records[number] = PhotoRecord(number, filename, path, mtime, size)
+        with self.lock:
+            self.records = records
+            self.numbers = sorted(records)
+
+    def refresh_if_changed(self):
+        """
+        Rebuild only if the storage manifests changed since they were read.
+
+        For readers that do not see captures being written (e.g. a separate web
+        server process); the capture path itself uses ``add``.
+        """
+        if self.storage.refresh():
+            self.rebuild()
+
+    def add(self, path, width=None, height=None):
+        """Add (or refresh) a photo that has just been written to disk."""
+        filename = os.path.basename(path)
+        number = photo_number(filename)
+        if number is None:
+            return None
+        stat = os.stat(path)
+        record = PhotoRecord(number, filename, path, stat.st_mtime, stat.st_size, width, height)
+        with self.lock:
+            if number not in self.records:
+                # Captures arrive in order, so this is almost always an append
+                if not self.numbers or number > self.numbers[-1]:
+                    self.numbers.append(number)
+                else:
+                    bisect.insort(self.numbers, number)
+            self.records[number] = record
+        return record
+
+    def remove(self, filenames):
+        """Drop photos that have left local storage, e.g. archived shards."""
+        with self.lock:
+            for filename in filenames:
+                self.records.pop(photo_number(filename), None)
+            self.numbers = [n for n in self.numbers if n in self.records]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.numbers)
+
+    @property
+    def last_number(self):
+        """Highest capture number in the index, or -1 if there are no photos."""
+        with self.lock:
+            return self.numbers[-1] if self.numbers else -1
+
+    def get(self, filename):
+        number = photo_number(filename)
+        with self.lock:
+            return self.records.get(number)
+
+    def latest(self, count):
+        """Return the ``count`` most recent records, newest first."""
+        with self.lock:
+            numbers = self.numbers[-count:] if count > 0 else []
+            return [self.records[n] for n in reversed(numbers)]
+
+    def filenames(self):
+        """Return all filenames, newest first."""
+        with self.lock:
+            return [self.records[n].filename for n in reversed(self.numbers)]
+
+    def after(self, number=None, limit=50):
+        """
+        Return the most recent records newer than ``number``, oldest first.
+
+        Args:
+            number (int): Only return photos with a higher capture number (None for any)
+            limit (int): Maximum number of records; the newest are kept
+        """
+        with self.lock:
+            start = 0 if number is None else bisect.bisect_right(self.numbers, number)
+            start = max(start, len(self.numbers) - limit)
+            records = [self.records[n] for n in self.numbers[start:]]
+        for record in records:
+            record.load_dimensions()
+        return records
+
+    def page(self, cursor=None, limit=50):
+        """
+        Return one page of records, newest first.
+
+        Args:
+            cursor (int): Only return photos older than this capture number
+            limit (int): Maximum number of records to return
+
+        Returns:
+            tuple: (list of PhotoRecord, cursor for the next page or None)
+        """
+        with self.lock:
+            end = len(self.numbers) if cursor is None else bisect.bisect_left(self.numbers, cursor)
+            start = max(0, end - limit)
+            records = [self.records[n] for n in reversed(self.numbers[start:end])]
+        for record in records:
+            record.load_dimensions()
+        next_cursor = records[-1].number if records and start > 0 else None
+        return records, next_cursor
@@ -0,0 +1,189 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from src.metrics import METRICS
+
+
+class PostProcessor:
+    """
+    Bounded worker pool that watermarks, encodes and writes captured frames.
+
+    Capture code hands over the raw sensor output and gets a future back
+    immediately, so the shutter loop is never delayed by decode/encode/disk
+    work. The sensor output is either a JPEG (decoded, watermarked and
+    re-encoded) or a raw frame array, which is watermarked in place and encoded
+    exactly once. Files are written under a hidden temporary name and renamed into place,
+    so a file that exists under its final name is always complete.
+    """
+
+    def __init__(self, watermark, max_workers=2, max_pending=6, on_complete=None, derivatives=None,
+                 jpeg_quality=90, on_error=None):
+        """
+        Args:
+            watermark (Watermark): Prepared watermark applied to every frame
+            max_workers (int): Number of worker threads
+            max_pending (int): Frames allowed in flight before ``submit`` blocks
+            on_complete (callable): Called with the final path once a file is written
+            derivatives (DerivativeCache): Optional cache to pre-generate the reel thumbnail in
+            jpeg_quality (int): Quality of the final JPEG encode
+            on_error (callable): Called with the final path and the exception if processing fails
+        """
+        self.watermark = watermark
+        self.jpeg_quality = jpeg_quality
+        self.derivatives = derivatives
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='postprocess')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        # name -> Event set once the file is written and on_complete has registered it
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        METRICS.gauge('photobooth_postprocess_pending', 'Photos waiting for or in post-processing',
+                      lambda: len(self.pending))
+
+    def submit(self, filename, raw, trace=None, on_decoded=None):
+        """
+        Queue a captured frame for processing into ``filename``.
+
+        Blocks only when ``max_pending`` frames are already in flight. Arrays
+        are owned by the pool from here on and are watermarked in place.
+
+        Args:
+            filename (str): Final path of the photo
+            raw (bytes | numpy.ndarray): JPEG data, or an RGB / XBGR8888 (RGBX in memory) uint8 frame
+            trace (CaptureTrace): Optional per-capture trace to record stages into
+            on_decoded (callable): Called in the worker with the decoded, not yet watermarked
+                image (or None if it could not be decoded); it must not keep a reference to it
+
+        Returns:
+            concurrent.futures.Future: Resolves to ``filename`` once it is on disk
+        """
+        with METRICS.stage('postprocess_backpressure', trace):
+            self.slots.acquire()
+        try:
+            future = self.executor.submit(self._process, filename, raw, time.perf_counter(), trace,
+                                          on_decoded)
+        except Exception:
+            self.slots.release()
+            raise
+        name = os.path.basename(filename)
+        registered = threading.Event()
+        with self.pending_lock:
+            self.pending[name] = registered
+        future.add_done_callback(lambda f: self._finished(filename, f, registered))
+        return future
+
+    def _process(self, filename, raw, submitted_at, trace, on_decoded):
+        METRICS.observe_stage('postprocess_queue_wait', time.perf_counter() - submitted_at, trace)
+        directory, name = os.path.split(filename)
+        tmp_path = os.path.join(directory, f".{name}.part")
+        try:
+            img = self._render(raw, trace, on_decoded)
+            with METRICS.stage('encode', trace):
+                encoded = io.BytesIO()
+                img.save(encoded, format='JPEG', quality=self.jpeg_quality)
+            with METRICS.stage('disk_write', trace):
+                try:
+                    with open(tmp_path, 'wb') as f:
+                        f.write(encoded.getbuffer())
+                    os.replace(tmp_path, filename)
+                finally:
+                    # Don't leave a half-written .part behind, e.g. when the disk is full
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            if self.derivatives:
+                # Reuse the decoded frame rather than reading the file back
+                try:
+                    with METRICS.stage('thumbnail', trace):
+                        self.derivatives.store_from_image(filename, img)
+                except Exception as e:
+                    print(f"Failed to pre-generate thumbnail for {filename}: {e}")
+        finally:
+            if trace is not None:
+                trace.finish()
+        print(f"Image processed: {filename} ({(time.perf_counter() - submitted_at) * 1000:.0f} ms after capture)")
+        return filename
+
+    def _render(self, raw, trace, on_decoded):
+        """Return the watermarked frame as a PIL image ready to encode."""
+        if isinstance(raw, np.ndarray):
+            frame = np.ascontiguousarray(raw)
+            if on_decoded:
+                self._deliver(on_decoded, self._wrap(frame))
+            with METRICS.stage('watermark', trace):
+                self.watermark.apply_array(frame)
+            return self._wrap(frame)
+        try:
+            img = Image.open(io.BytesIO(raw))
+            with METRICS.stage('decode', trace):
+                img.load()
+        except Exception:
+            if on_decoded:
+                self._deliver(on_decoded, None)
+            raise
+        if on_decoded:
+            self._deliver(on_decoded, img)
+        with METRICS.stage('watermark', trace):
+            return self.watermark.apply(img)
+
+    @staticmethod
+    def _wrap(frame):
+        height, width, channels = frame.shape
+        mode = 'RGBX' if channels == 4 else 'RGB'
+        # RGBX wraps the array without copying; PIL encodes it straight to an RGB JPEG
+        return Image.frombuffer(mode, (width, height), frame, 'raw', mode, 0, 1)
+
+    @staticmethod
+    def _deliver(on_decoded, img):
+        try:
+            on_decoded(img)
+        except Exception as e:
+            print(f"Error in decoded-frame callback: {e}")
+
+    def _finished(self, filename, future, registered):
+        name = os.path.basename(filename)
+        self.slots.release()
+        try:
+            if future.exception():
+                print(f"Failed to process {name}: {future.exception()}")
+                if self.on_error:
+                    try:
+                        self.on_error(filename, future.exception())
+                    except Exception as e:
+                        print(f"Error in post-processing error callback for {name}: {e}")
+            elif self.on_complete:
+                try:
+                    self.on_complete(future.result())
+                except Exception as e:
+                    print(f"Error in post-processing callback for {name}: {e}")
+        finally:
+            # Only now is the photo in storage, so wait_for callers can look it up
+            with self.pending_lock:
+                if self.pending.get(name) is registered:
+                    del self.pending[name]
+            registered.set()
+
+    def is_pending(self, name):
+        with self.pending_lock:
+            return name in self.pending
+
+    def wait_for(self, name, timeout):
+        """
+        Wait up to ``timeout`` seconds for ``name`` to be written and passed to ``on_complete``.
+
+        Returns:
+            bool: True if the file is not (or no longer) being processed
+        """
+        with self.pending_lock:
+            registered = self.pending.get(name)
+        # Timeouts leave the file pending; processing errors are logged by _finished
+        return registered is None or registered.wait(timeout)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
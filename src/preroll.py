@@ -0,0 +1,125 @@
+"""
+Pre-roll ring buffer of recent main-stream frames.
+
+The camera hands every main-stream frame to ``FrameRing.write``, which copies
+it into the oldest of ``slots`` preallocated arrays, so memory use is fixed at
+``slots`` frames and nothing is allocated per frame. A shutter then takes the
+frame whose timestamp is nearest to the moment it fired, waiting at most until
+a frame from after that moment has arrived, instead of asking the camera for
+the next frame. With a ``window`` it takes the sharpest frame within that many
+seconds of the shutter instead, scored by ``sharpness``.
+"""
+import threading
+import time
+
+import numpy as np
+
+
+def sharpness(frame, step=2):
+    """
+    Cheap focus/motion-blur score: mean squared gradient of the green channel.
+
+    Blur from focus or from the guests moving spreads edges out and lowers the
+    score. Only every ``step``-th pixel is looked at, which keeps a full-size
+    frame to a few milliseconds.
+    """
+    green = frame[::step, ::step, 1].astype(np.int32)
+    dx = np.diff(green, axis=1)
+    dy = np.diff(green, axis=0)
+    return float(np.mean(dx * dx, dtype=np.float64) + np.mean(dy * dy, dtype=np.float64))
+
+
+class FrameRing:
+    """Fixed-size ring of the latest frames with their timestamps."""
+
+    def __init__(self, slots, shape, dtype=np.uint8):
+        """
+        Args:
+            slots (int): Frames kept; memory use is ``slots`` times one frame
+            shape (tuple): (height, width, channels) of the frames
+            dtype: Pixel type of the frames
+        """
+        if slots < 1:
+            raise ValueError("A frame ring needs at least one slot")
+        self.frames = np.zeros((slots,) + tuple(shape), dtype=dtype)
+        # NaN marks a slot that is empty or being rewritten, so lookups skip it
+        self.timestamps = np.full(slots, np.nan)
+        self.next_slot = 0
+        self.latest = float('-inf')
+        self.condition = threading.Condition()
+        self.writes = 0
+        self.write_seconds = 0.0
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+    def write(self, frame, timestamp):
+        """
+        Copy a frame into the oldest slot. Called on the camera thread for every frame.
+
+        Args:
+            frame (numpy.ndarray): Frame in the ring's format; rows may be padded wider than the ring
+            timestamp (float): time.time() the frame was exposed
+        """
+        start = time.perf_counter()
+        height, width = self.frames.shape[1:3]
+        with self.condition:
+            slot = self.next_slot
+            self.next_slot = (slot + 1) % len(self.frames)
+            self.timestamps[slot] = np.nan
+        # Copied outside the lock; readers hold it while copying a frame out, and skip this slot
+        np.copyto(self.frames[slot], frame[:height, :width])
+        with self.condition:
+            self.timestamps[slot] = timestamp
+            self.latest = timestamp
+            self.writes += 1
+            self.write_seconds += time.perf_counter() - start
+            self.condition.notify_all()
+
+    def nearest(self, timestamp):
+        """Slot holding the frame nearest ``timestamp``, or None if the ring is empty. Call with ``condition`` held."""
+        distance = np.abs(self.timestamps - timestamp)
+        if np.isnan(distance).all():
+            return None
+        return int(np.nanargmin(distance))
+
+    def grab(self, timestamp, window=0.0, timeout=None, frame_interval=0.0):
+        """
+        Copy out the frame for a shutter at ``timestamp``.
+
+        Args:
+            timestamp (float): time.time() of the shutter
+            window (float): Take the sharpest frame within this many seconds of ``timestamp``
+                (0 takes the nearest frame)
+            timeout (float): Longest wait for frames from after ``timestamp + window``
+            frame_interval (float): Seconds between frames; a frame less than half of it before
+                the end of the window is known to be the last one needed, without waiting for the next
+
+        Returns:
+            tuple: (frame copy, its timestamp), or None if the ring has no frames
+        """
+        needed = timestamp + window - frame_interval / 2
+        with self.condition:
+            self.condition.wait_for(lambda: self.latest >= needed, timeout)
+            slot = self.nearest(timestamp)
+            if slot is None:
+                return None
+            if window > 0:
+                candidates = np.flatnonzero(np.abs(self.timestamps - timestamp) <= window)
+            else:
+                candidates = []
+            if len(candidates) <= 1:
+                return self.frames[slot].copy(), float(self.timestamps[slot])
+            # Copied under the lock but scored outside it, so the camera thread's writes aren't held up
+            copies = [(self.frames[s].copy(), float(self.timestamps[s])) for s in candidates]
+        return max(copies, key=lambda copy: sharpness(copy[0]))
+
+    def stats(self):
+        with self.condition:
+            return {
+                'slots': len(self.frames),
+                'bytes': self.nbytes,
+                'frames_written': self.writes,
+                'write_ms_mean': self.write_seconds / self.writes * 1000 if self.writes else None,
+            }
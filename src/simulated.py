@@ -0,0 +1,391 @@
+"""
+Simulated camera, LED strip and upload backends.
+
+They mirror the small part of the picamera2 / neopixel APIs the photobooth uses,
+so the whole capture pipeline can run and be profiled off a Pi:
+
+    PHOTOBOOTH_HARDWARE=sim python app.py
+
+``PHOTOBOOTH_SIM_CAMERA_STARTUP`` (seconds) makes the first ``start()`` take
+as long as libcamera's bring-up does on the Pi, for start-up measurements.
+"""
+import io
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+CAMERA_STARTUP_DELAY = float(os.environ.get('PHOTOBOOTH_SIM_CAMERA_STARTUP', '0'))
+
+
+class SimulatedTransform:
+    def __init__(self, hflip=False, vflip=False):
+        self.hflip = hflip
+        self.vflip = vflip
+
+
+class SimulatedMJPEGEncoder:
+    """
+    Software JPEG encoder standing in for the Pi's hardware MJPEG encoder.
+
+    Like picamera2's encoders it only encodes every ``frame_skip_count``-th
+    frame it is handed.
+    """
+
+    def __init__(self, bitrate=None, quality=85):
+        self.bitrate = bitrate
+        self.quality = quality
+        self.frame_skip_count = 1
+        self.output = None
+        self.frames_encoded = 0
+        self.bytes_encoded = 0
+        self.encode_seconds = 0.0
+        self.encode_cpu_seconds = 0.0
+
+    def encode(self, array):
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        stream = io.BytesIO()
+        Image.fromarray(array).save(stream, format='JPEG', quality=self.quality)
+        data = stream.getvalue()
+        self.encode_seconds += time.perf_counter() - start
+        self.encode_cpu_seconds += time.thread_time() - cpu_start
+        self.frames_encoded += 1
+        self.bytes_encoded += len(data)
+        return data
+
+
+class SimulatedFileOutput:
+    def __init__(self, file=None):
+        self.fileoutput = file
+
+    def outputframe(self, frame, keyframe=True, timestamp=None):
+        if self.fileoutput is not None:
+            self.fileoutput.write(frame)
+
+
+class SimulatedCamera:
+    """
+    Synthetic stand-in for ``Picamera2``.
+
+    A background thread produces a moving gradient at the configured frame rate
+    and, while recording, JPEG-encodes the configured ``encode`` stream (``main``
+    or the smaller ``lores``) into the encoder's output just like the real MJPEG
+    encoder does. The lores frame is synthesized at its own size, as the Pi's
+    ISP scales it in hardware.
+    """
+
+    def __init__(self, fps=15, size=None, startup_delay=None, motion_blur=0):
+        self.fps = fps
+        self.size = size
+        self.startup_delay = CAMERA_STARTUP_DELAY if startup_delay is None else startup_delay
+        self.config = None
+        self.controls = {}
+        self.started = False
+        self.encoder = None
+        self.frame = None
+        self.lores_frame = None
+        self.frame_sequence = 0
+        self.frame_time = None
+        self.frames_produced = 0
+        self.frame_condition = threading.Condition()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self._bases = {}
+        # Called with (main-stream array, time.time()) for every frame, like picamera2's post_callback
+        self.frame_callback = None
+        self._callback_buffer = None
+        # Largest simulated shake, in rows; each frame is smeared by a random amount up to it
+        self.motion_blur = motion_blur
+        self.blur_history = deque(maxlen=64)
+        # time.time() of the frame the last capture_array/capture_file returned
+        self.last_capture_time = None
+
+    def create_video_configuration(self, main=None, lores=None, encode='main', transform=None,
+                                   controls=None, buffer_count=6, **kwargs):
+        main = dict(main or {})
+        main.setdefault('size', self.size or (1920, 1080))
+        main.setdefault('format', 'XBGR8888')
+        config = {
+            'use_case': 'video',
+            'main': main,
+            'lores': dict(lores) if lores else None,
+            'encode': encode,
+            'transform': transform,
+            'controls': dict(controls or {}),
+            'buffer_count': buffer_count,
+        }
+        if config['lores'] is not None:
+            config['lores'].setdefault('format', 'YUV420')
+        return config
+
+    def create_still_configuration(self, main=None, **kwargs):
+        config = self.create_video_configuration(main=main, **kwargs)
+        config['use_case'] = 'still'
+        return config
+
+    def configure(self, config):
+        self.config = config
+        self.size = tuple(config['main']['size'])
+        self._bases = {}
+        self.set_controls(config.get('controls', {}))
+
+    def set_controls(self, controls):
+        self.controls.update(controls)
+        if 'FrameRate' in controls:
+            self.fps = controls['FrameRate']
+
+    def start(self):
+        if self.started:
+            return
+        if self.config is None:
+            self.configure(self.create_video_configuration())
+        if self.startup_delay:
+            # Only the first start pays for the sensor and pipeline bring-up
+            time.sleep(self.startup_delay)
+            self.startup_delay = 0
+        self.started = True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='sim-camera', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.encoder = None
+        if not self.started:
+            return
+        self.started = False
+        self.stop_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def start_recording(self, encoder, output, quality=None):
+        if quality is not None:
+            encoder.quality = quality
+        encoder.output = output
+        self.encoder = encoder
+        self.start()
+
+    def stop_recording(self):
+        # Like picamera2, stopping the recording also stops the camera
+        self.stop()
+
+    def _synthesize(self, sequence, size=None, blur_rows=0):
+        width, height = size or self.size
+        base = self._bases.get((width, height))
+        if base is None:
+            x = np.linspace(0, 255, width, dtype=np.float32)
+            y = np.linspace(0, 255, height, dtype=np.float32)
+            base = np.empty((height, width, 3), dtype=np.uint8)
+            base[..., 0] = x[None, :]
+            base[..., 1] = y[:, None]
+            base[..., 2] = ((x[None, :] + y[:, None]) / 2)
+            self._bases[(width, height)] = base
+        # With simulated shake the background holds still, so frames differ only in the bar and the smear
+        frame = base + np.uint8(0 if self.motion_blur else (sequence * 4) % 256)
+        # A moving bar so consecutive frames differ in structure, not just brightness
+        bar = (sequence * 16 * height // self.size[1]) % height
+        bar_height = max(1, 8 * height // self.size[1])
+        frame[bar:bar + bar_height] = 255
+        if blur_rows:
+            # Box blur over blur_rows + 1 rows, as if the scene moved during the exposure. The
+            # background is a linear ramp that blurring leaves as it is, so only the band around
+            # the bar needs it
+            k = blur_rows + 1
+            band = frame[max(0, bar - k):bar + bar_height + k]
+            summed = np.cumsum(band, axis=0, dtype=np.uint32)
+            band[k - 1:] = (summed[k - 1:] - np.concatenate((np.zeros_like(summed[:1]), summed[:-k]))) // k
+        return frame
+
+    def _lores_size(self):
+        lores = (self.config or {}).get('lores')
+        return tuple(lores['size']) if lores else None
+
+    def _run(self):
+        next_frame = time.perf_counter()
+        lores_size = self._lores_size()
+        encode_lores = lores_size is not None and (self.config or {}).get('encode') == 'lores'
+        while not self.stop_event.is_set():
+            sequence = self.frame_sequence + 1
+            blur = random.randint(0, self.motion_blur) if self.motion_blur else 0
+            frame = self._synthesize(sequence, blur_rows=blur)
+            lores_frame = self._synthesize(sequence, lores_size) if lores_size else None
+            with self.frame_condition:
+                self.frame = frame
+                self.lores_frame = lores_frame
+                self.frame_sequence = sequence
+                self.frame_time = time.time()
+                self.frames_produced += 1
+                self.blur_history.append((self.frame_time, blur))
+                self.frame_condition.notify_all()
+
+            callback = self.frame_callback
+            if callback is not None:
+                self._callback_buffer = self._convert(frame, 'main', out=self._callback_buffer)
+                callback(self._callback_buffer, self.frame_time)
+
+            encoder = self.encoder
+            if encoder is not None and encoder.output is not None and sequence % encoder.frame_skip_count == 0:
+                data = encoder.encode(lores_frame if encode_lores else frame)
+                encoder.output.outputframe(data, timestamp=self.frame_time)
+
+            next_frame += 1.0 / self.fps
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                self.stop_event.wait(delay)
+            else:
+                # Running behind: drop the missed frame slots rather than bursting
+                next_frame = time.perf_counter()
+
+    def _next_frame(self, timeout=2.0, name='main'):
+        """Wait for the next frame, as a real capture request would."""
+        if not self.started:
+            raise RuntimeError("Camera must be started before capturing")
+        if name == 'lores' and self._lores_size() is None:
+            raise RuntimeError("No lores stream configured")
+        with self.frame_condition:
+            sequence = self.frame_sequence
+            if not self.frame_condition.wait_for(lambda: self.frame_sequence != sequence, timeout):
+                raise RuntimeError("Timed out waiting for a frame")
+            self.last_capture_time = self.frame_time
+            return self.lores_frame if name == 'lores' else self.frame
+
+    def _convert(self, frame, name, out=None):
+        fmt = (self.config or {}).get(name, {}).get('format', 'RGB888')
+        if fmt in ('XBGR8888', 'XRGB8888'):
+            if out is None or out.shape != frame.shape[:2] + (4,):
+                out = np.empty(frame.shape[:2] + (4,), dtype=np.uint8)
+            # XBGR8888 is [R, G, B, 255] in memory, XRGB8888 is [B, G, R, 255]
+            out[..., :3] = frame if fmt == 'XBGR8888' else frame[..., ::-1]
+            out[..., 3] = 255
+            return out
+        if fmt == 'RGB888':
+            return frame[..., ::-1].copy()
+        return frame.copy()
+
+    def capture_array(self, name='main'):
+        return self._convert(self._next_frame(name=name), name)
+
+    def capture_file(self, file_output, name='main', format=None):
+        frame = self._next_frame()
+        fmt = (format or 'jpeg').upper()
+        if fmt == 'JPG':
+            fmt = 'JPEG'
+        Image.fromarray(frame).save(file_output, format=fmt)
+
+
+class SimulatedPixels:
+    """
+    Records NeoPixel writes instead of driving a strip.
+
+    ``show`` takes roughly as long as the real 800 kHz WS2812 protocol
+    (30 us per pixel) and appends a (perf_counter time, pixel tuple) entry to
+    ``history``, so animation timing can be checked off the Pi.
+    """
+
+    PIXEL_WRITE_SECONDS = 30e-6
+
+    def __init__(self, num_pixels, auto_write=False, history_size=10000):
+        self.n = num_pixels
+        self.auto_write = auto_write
+        self.brightness = 1.0
+        self._pixels = [(0, 0, 0)] * num_pixels
+        self.history = deque(maxlen=history_size)
+        self.show_count = 0
+        self.set_count = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return self._pixels[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._pixels[index] = [tuple(v) for v in value]
+        else:
+            self._pixels[index] = tuple(value)
+        self.set_count += 1
+        if self.auto_write:
+            self.show()
+
+    def fill(self, color):
+        self._pixels = [tuple(color)] * self.n
+        self.set_count += 1
+        if self.auto_write:
+            self.show()
+
+    def show(self):
+        time.sleep(self.PIXEL_WRITE_SECONDS * self.n)
+        self.history.append((time.perf_counter(), tuple(self._pixels)))
+        self.show_count += 1
+
+    def deinit(self):
+        pass
+
+
+class SimulatedUploader:
+    """
+    Upload backend that only sleeps, optionally failing a fraction of uploads.
+
+    With a ``scheduler`` the file is read through it chunk by chunk, so
+    bandwidth limits apply as they would to a real upload.
+    """
+
+    def __init__(self, latency=0.0, fail_rate=0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.scheduler = None
+        self.uploaded = []
+
+    def upload_file(self, file_path):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        if self.scheduler is not None:
+            with open(file_path, 'rb') as f:
+                for _ in self.scheduler.chunks(f):
+                    pass
+        time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise IOError("Simulated upload failure")
+        self.uploaded.append(file_path)
+        return {'id': uuid.uuid4().hex, 'name': os.path.basename(file_path)}
+
+
+class SimulatedHardware:
+    """Hardware backend producing SimulatedCamera and SimulatedPixels instances."""
+
+    name = 'sim'
+    MJPEGEncoder = SimulatedMJPEGEncoder
+    FileOutput = SimulatedFileOutput
+    Transform = SimulatedTransform
+
+    def __init__(self, fps=15, size=None, camera_startup=None, motion_blur=0):
+        self.fps = fps
+        self.size = size
+        self.camera_startup = camera_startup
+        self.motion_blur = motion_blur
+        self.camera = None
+        self.pixels = None
+
+    def create_camera(self):
+        self.camera = SimulatedCamera(fps=self.fps, size=self.size, startup_delay=self.camera_startup,
+                                      motion_blur=self.motion_blur)
+        return self.camera
+
+    @staticmethod
+    def set_frame_callback(camera, callback):
+        """Call ``callback(array, timestamp)`` with every main-stream frame, on the camera thread."""
+        camera.frame_callback = callback
+
+    def create_pixels(self, num_pixels):
+        self.pixels = SimulatedPixels(num_pixels, auto_write=False)
+        return self.pixels
+
+    @staticmethod
+    def recording_quality(jpeg_quality):
+        """``start_recording`` quality for a JPEG quality; the simulated encoder takes it as-is."""
+        return jpeg_quality
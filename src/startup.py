@@ -0,0 +1,160 @@
+"""
+Startup phases and subsystem readiness.
+
+Boot is recorded as named phases (imports, watermark prep, camera bring-up,
+...) with their start offset and duration relative to the moment the process
+started, plus one-off milestones such as the first preview frame. Subsystems
+move through ``pending``, ``starting``, ``ready`` or ``failed``, which is what
+``/healthz`` and ``/readyz`` report. ``STARTUP`` is process-wide, like
+``METRICS``, so the web server can answer before the camera system exists.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from src.metrics import METRICS
+
+SUBSYSTEM_STATES = ('pending', 'starting', 'ready', 'failed')
+
+
+def _process_start_time():
+    """Wall-clock time the process was started, so interpreter start-up counts too."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 (starttime, in clock ticks after boot); the command name may contain spaces
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class StartupReport:
+    """Phase timings, milestones and subsystem states of one process's boot."""
+
+    def __init__(self, started=None):
+        """
+        Args:
+            started (float): time.time() the process started; read from /proc by default
+        """
+        self.started = started if started is not None else _process_start_time()
+        self.lock = threading.Lock()
+        self.phases = []
+        self.milestones = {}
+        self.subsystems = {}
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def expect(self, *subsystems):
+        """Register subsystems that must be ready before the booth is."""
+        with self.lock:
+            for name in subsystems:
+                self.subsystems.setdefault(name, {'state': 'pending', 'error': None, 'since': self.elapsed()})
+
+    def set_state(self, subsystem, state, error=None):
+        if state not in SUBSYSTEM_STATES:
+            raise ValueError(f"Unknown subsystem state {state!r}")
+        with self.lock:
+            self.subsystems[subsystem] = {'state': state, 'error': error, 'since': self.elapsed()}
+
+    @contextmanager
+    def phase(self, name, subsystem=None):
+        """
+        Time the enclosed block as a startup phase.
+
+        Args:
+            name (str): Phase name in the report
+            subsystem (str): Subsystem moved to ``starting`` and then ``ready`` or ``failed``
+        """
+        if subsystem:
+            self.set_state(subsystem, 'starting')
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            if subsystem:
+                self.set_state(subsystem, 'failed', str(e))
+            raise
+        else:
+            if subsystem:
+                self.set_state(subsystem, 'ready')
+        finally:
+            with self.lock:
+                self.phases.append({
+                    'name': name,
+                    'start': start - self.started,
+                    'seconds': time.time() - start,
+                    'thread': threading.current_thread().name,
+                })
+
+    def mark(self, name):
+        """Record a milestone the first time it is reached. Returns True if it was new."""
+        if name in self.milestones:
+            return False
+        with self.lock:
+            if name in self.milestones:
+                return False
+            self.milestones[name] = self.elapsed()
+        return True
+
+    @property
+    def ready(self):
+        with self.lock:
+            return bool(self.subsystems) and all(s['state'] == 'ready' for s in self.subsystems.values())
+
+    @property
+    def failed(self):
+        with self.lock:
+            return [name for name, s in self.subsystems.items() if s['state'] == 'failed']
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'uptime': self.elapsed(),
+                'subsystems': {name: dict(s) for name, s in self.subsystems.items()},
+                'phases': [dict(p) for p in self.phases],
+                'milestones': dict(self.milestones),
+            }
+
+    def format(self):
+        """Human-readable report of the phases and milestones so far."""
+        report = self.as_dict()
+        lines = ["Startup report (seconds since process start):"]
+        for p in sorted(report['phases'], key=lambda p: p['start']):
+            lines.append(f"  {p['name']:<12} {p['start']:7.3f} +{p['seconds']:.3f}  [{p['thread']}]")
+        for name, at in sorted(report['milestones'].items(), key=lambda m: m[1]):
+            lines.append(f"  {name:<12} {at:7.3f}")
+        return '\n'.join(lines)
+
+
+STARTUP = StartupReport()
+
+METRICS.gauge('photobooth_startup_phase_seconds', 'Duration of each startup phase',
+              lambda: {(p['name'],): p['seconds'] for p in STARTUP.as_dict()['phases']}, ('phase',))
+METRICS.gauge('photobooth_startup_milestone_seconds', 'Seconds from process start to each startup milestone',
+              lambda: {(name,): at for name, at in STARTUP.as_dict()['milestones'].items()}, ('milestone',))
+METRICS.gauge('photobooth_ready', '1 once every subsystem is ready', lambda: int(STARTUP.ready))
+
+
+def health_report(initialized):
+    """
+    Body for ``/healthz`` and ``/readyz``.
+
+    Args:
+        initialized (bool): Whether the camera system object exists yet
+
+    Returns:
+        dict: The startup report plus ``status`` (``ready``, ``starting`` or
+        ``failed``) and ``ready``
+    """
+    report = STARTUP.as_dict()
+    ready = initialized and STARTUP.ready
+    if STARTUP.failed:
+        status = 'failed'
+    else:
+        status = 'ready' if ready else 'starting'
+    report.update(status=status, ready=ready)
+    return report
@@ -0,0 +1,520 @@
+"""
+Sharded capture storage.
+
+Photos, collages and clips are written to ``<captures>/<event>/<YYYY-MM-DD>/``
+shards instead of one flat directory. Every shard keeps a ``manifest.json`` of
+its files, so start-up reads one small file per shard instead of listing every
+photo ever taken, and each new file only rewrites its own shard's manifest.
+Filenames stay unique across shards (capture numbers never repeat), so URLs
+keep using the bare filename and are resolved through the manifests.
+
+With a retention budget, the oldest shards are moved into
+``<archive>/<event>/<date>.tar.gz`` once the live shards outgrow it, but only
+after every file in the shard has a confirmed upload. Captures left in a flat
+directory by older versions are still served, and can be moved into shards
+with the migration tool:
+
+    python -m src.storage migrate /home/pi/photobooth/captures --event wedding
+"""
+import argparse
+import json
+import os
+import re
+import tarfile
+import threading
+import time
+
+CAPTURE_PATTERN = re.compile(r'[a-z]+_\d+\.(?:jpg|gif|webp|mp4)$')
+# Photos and clips take a capture number each; collages are named after their session's first photo
+NUMBERED_PATTERN = re.compile(r'(?:photo|clip)_(\d+)\.')
+DAY_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}$')
+MANIFEST_NAME = 'manifest.json'
+# Shards touched more recently than this are never archived, so late collages and uploads can land
+ARCHIVE_MIN_AGE = 3600
+
+
+def safe_name(name):
+    """Turn an event name into something usable as a directory name."""
+    return re.sub(r'[^A-Za-z0-9_-]+', '-', name).strip('-') or 'default'
+
+
+def capture_number(filename):
+    """Return the capture number of a photo or clip filename, or None."""
+    match = NUMBERED_PATTERN.match(filename)
+    return int(match.group(1)) if match else None
+
+
+def day_of(timestamp=None):
+    return time.strftime('%Y-%m-%d', time.localtime(timestamp))
+
+
+class Shard:
+    """One ``<event>/<day>`` directory and its manifest; the legacy flat directory has no event."""
+
+    def __init__(self, root, event, day):
+        self.event = event
+        self.day = day
+        self.key = f"{event}/{day}" if event else ''
+        self.directory = os.path.join(root, event, day) if event else root
+        self.files = {}
+        self.archive = None
+        self.manifest_mtime = None
+        # Highest photo number in the manifest, so start-up need not parse every filename
+        self.highest = -1
+
+    @property
+    def legacy(self):
+        return not self.event
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    @property
+    def bytes(self):
+        """Bytes still on local storage."""
+        return 0 if self.archive else sum(f['size'] for f in self.files.values())
+
+    @property
+    def last_number(self):
+        numbers = [capture_number(name) for name in self.files]
+        return max((n for n in numbers if n is not None), default=-1)
+
+    @property
+    def last_modified(self):
+        return max((f['mtime'] for f in self.files.values()), default=0.0)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def scan(self):
+        """Rebuild the file list from the directory itself."""
+        files = {}
+        for entry in os.scandir(self.directory):
+            if CAPTURE_PATTERN.match(entry.name) and entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        changed = files != self.files
+        self.files = files
+        self.highest = self.last_number
+        return changed
+
+    def load(self):
+        """Read the manifest. Returns False if it is missing or unreadable."""
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+                self.manifest_mtime = os.fstat(f.fileno()).st_mtime_ns
+        except (OSError, ValueError):
+            return False
+        self.files = manifest.get('files', {})
+        self.archive = manifest.get('archive')
+        self.highest = manifest['last_number'] if 'last_number' in manifest else self.last_number
+        return True
+
+    def save(self):
+        manifest = {
+            'event': self.event,
+            'date': self.day,
+            'bytes': sum(f['size'] for f in self.files.values()),
+            'last_number': self.highest,
+            'files': self.files,
+            'archive': self.archive,
+        }
+        tmp_path = os.path.join(self.directory, f".{MANIFEST_NAME}.part")
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+
+    def remove_leftovers(self):
+        """Delete captures still on disk in an archived shard (after a crash mid-archive)."""
+        for entry in os.scandir(self.directory):
+            if CAPTURE_PATTERN.match(entry.name) and entry.is_file():
+                os.remove(entry.path)
+
+
+class CaptureStorage:
+    """
+    Decides where captures are written and keeps the shard manifests.
+
+    ``listeners`` are called with ``(event, filenames)``; the only event is
+    ``archived``, after a shard's files have left local storage.
+    """
+
+    def __init__(self, root, event='default', archive_dir=None, retention_bytes=None):
+        """
+        Args:
+            root (str): Captures directory holding the event directories
+            event (str): Name of the event new captures are filed under
+            archive_dir (str): Where archived shards go; defaults to ``archive`` next to ``root``
+            retention_bytes (int): Local bytes kept before old shards are archived; None keeps everything
+        """
+        self.root = root
+        self.event = safe_name(event)
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(os.path.abspath(root)), 'archive')
+        self.retention_bytes = retention_bytes
+        self.lock = threading.RLock()
+        self.shards = {}
+        self.locations = {}
+        self.last_number = -1
+        self.listeners = []
+        self.retention_wakeup = threading.Condition()
+        self.retention_thread = None
+        self.is_running = False
+        self.retention_pending = False
+        self.over_budget = False
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    # Index
+
+    def _load(self):
+        """
+        Read every shard manifest, plus the flat files of an unmigrated directory.
+
+        Shards without a readable manifest are rescanned, and so is the newest
+        live shard of each event, which may have had files written after its
+        manifest was last saved.
+        """
+        shards = {}
+        legacy = Shard(self.root, '', '')
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and not entry.name.startswith('.'):
+                for day in os.scandir(entry.path):
+                    if DAY_PATTERN.match(day.name) and day.is_dir():
+                        shard = Shard(self.root, entry.name, day.name)
+                        if not shard.load():
+                            shard.scan()
+                            shard.save()
+                        elif shard.archive:
+                            shard.remove_leftovers()
+                        shards[shard.key] = shard
+            elif CAPTURE_PATTERN.match(entry.name) and entry.is_file():
+                stat = entry.stat()
+                legacy.files[entry.name] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+        newest = {}
+        for shard in shards.values():
+            if not shard.archive and shard.day > newest.get(shard.event, ('', None))[0]:
+                newest[shard.event] = (shard.day, shard)
+        for _, shard in newest.values():
+            if shard.scan():
+                shard.save()
+        if legacy.files:
+            shards[legacy.key] = legacy
+            print(f"{len(legacy.files)} capture(s) in the flat layout under {self.root}; "
+                  f"move them into shards with: python -m src.storage migrate {self.root}")
+
+        locations = {}
+        last_number = -1
+        for shard in sorted(shards.values(), key=lambda s: (s.day, s.event)):
+            last_number = max(last_number, shard.highest if not shard.legacy else shard.last_number)
+            if not shard.archive:
+                locations.update(dict.fromkeys(shard.files, shard))
+        with self.lock:
+            self.shards = shards
+            self.locations = locations
+            self.last_number = last_number
+
+    def refresh(self):
+        """
+        Reload if any manifest changed, for readers in another process.
+
+        Returns:
+            bool: True if the storage was reloaded
+        """
+        with self.lock:
+            known = {shard.key: shard.manifest_mtime for shard in self.shards.values() if not shard.legacy}
+        current = {}
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and not entry.name.startswith('.'):
+                for day in os.scandir(entry.path):
+                    if DAY_PATTERN.match(day.name):
+                        try:
+                            current[f"{entry.name}/{day.name}"] = os.stat(
+                                os.path.join(day.path, MANIFEST_NAME)).st_mtime_ns
+                        except OSError:
+                            current[f"{entry.name}/{day.name}"] = None
+        if current == known:
+            return False
+        self._load()
+        return True
+
+    def files(self):
+        """
+        Yield every capture still on local storage.
+
+        Returns:
+            iterator: (filename, path, mtime, size) tuples
+        """
+        with self.lock:
+            entries = [(name, shard.path(name), shard.files[name]) for name, shard in self.locations.items()]
+        for name, path, info in entries:
+            yield name, path, info['mtime'], info['size']
+
+    def paths(self):
+        with self.lock:
+            return [shard.path(name) for name, shard in self.locations.items()]
+
+    def resolve(self, filename):
+        """Return the path of a capture still on local storage, or None."""
+        if os.path.basename(filename) != filename:
+            return None
+        with self.lock:
+            shard = self.locations.get(filename)
+            return shard.path(filename) if shard else None
+
+    def usage(self):
+        with self.lock:
+            return sum(shard.bytes for shard in self.shards.values())
+
+    def stats(self):
+        with self.lock:
+            live = [s for s in self.shards.values() if not s.archive]
+            return {
+                'event': self.event,
+                'shards': len(live),
+                'archived_shards': len(self.shards) - len(live),
+                'files': len(self.locations),
+                'bytes': sum(s.bytes for s in live),
+                'retention_bytes': self.retention_bytes,
+            }
+
+    # Writing
+
+    def _shard(self, event, day):
+        key = f"{event}/{day}"
+        shard = self.shards.get(key)
+        if shard is None:
+            shard = self.shards[key] = Shard(self.root, event, day)
+            os.makedirs(shard.directory, exist_ok=True)
+        return shard
+
+    def path_for(self, filename, when=None):
+        """
+        Return the path a new capture called ``filename`` should be written to.
+
+        Args:
+            filename (str): e.g. ``photo_12.jpg``
+            when (float): Capture time; defaults to now and decides the day shard
+        """
+        with self.lock:
+            return self._shard(self.event, day_of(when)).path(filename)
+
+    def add(self, path):
+        """Record a capture that has just been written by ``path_for``'s path."""
+        filename = os.path.basename(path)
+        stat = os.stat(path)
+        event, day = os.path.relpath(os.path.dirname(path), self.root).split(os.sep)[-2:]
+        with self.lock:
+            shard = self._shard(event, day)
+            shard.files[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+            number = capture_number(filename)
+            if number is not None:
+                shard.highest = max(shard.highest, number)
+                self.last_number = max(self.last_number, number)
+            shard.save()
+            self.locations[filename] = shard
+        self.request_retention()
+
+    # Retention
+
+    def start_retention(self, is_uploaded, interval=300.0, cooldown=30.0):
+        """
+        Enforce the retention budget in the background.
+
+        Args:
+            is_uploaded (callable): Takes a list of paths, returns True if all have confirmed uploads
+            interval (float): Seconds between checks when nothing asks for one
+            cooldown (float): Minimum seconds between checks, so a busy session is not re-checked per file
+        """
+        if self.retention_bytes is None or self.retention_thread is not None:
+            return
+        self.is_running = True
+
+        def run():
+            while True:
+                with self.retention_wakeup:
+                    self.retention_wakeup.wait_for(lambda: self.retention_pending or not self.is_running, interval)
+                    if not self.is_running:
+                        return
+                    self.retention_pending = False
+                try:
+                    self.enforce_retention(is_uploaded)
+                except Exception as e:
+                    print(f"Error enforcing capture retention: {e}")
+                with self.retention_wakeup:
+                    self.retention_wakeup.wait_for(lambda: not self.is_running, cooldown)
+
+        self.retention_thread = threading.Thread(target=run, name='storage-retention', daemon=True)
+        self.retention_thread.start()
+        self.request_retention()
+
+    def request_retention(self):
+        """Ask the retention thread for a check, e.g. after a file was written or uploaded."""
+        with self.retention_wakeup:
+            self.retention_pending = True
+            self.retention_wakeup.notify()
+
+    def enforce_retention(self, is_uploaded, now=None):
+        """
+        Archive the oldest shards until the live ones fit the retention budget.
+
+        Today's shard, the legacy flat directory, recently touched shards and
+        shards with uploads still outstanding are never archived.
+
+        Returns:
+            list: Keys of the shards that were archived
+        """
+        if self.retention_bytes is None:
+            return []
+        now = time.time() if now is None else now
+        current = f"{self.event}/{day_of(now)}"
+        with self.lock:
+            candidates = sorted(
+                (s for s in self.shards.values() if not s.archive and not s.legacy and s.key != current),
+                key=lambda s: (s.day, s.event)
+            )
+        usage = self.usage()
+        archived = []
+        for shard in candidates:
+            if usage <= self.retention_bytes:
+                break
+            if now - shard.last_modified < ARCHIVE_MIN_AGE:
+                continue
+            with self.lock:
+                paths = [shard.path(name) for name in shard.files]
+            if not is_uploaded(paths):
+                continue
+            freed = shard.bytes
+            self.archive_shard(shard)
+            usage -= freed
+            archived.append(shard.key)
+        over_budget = usage > self.retention_bytes
+        if over_budget and not self.over_budget:
+            print(f"Captures use {usage / 1e9:.2f} GB, over the {self.retention_bytes / 1e9:.2f} GB budget; "
+                  f"no more shards can be archived yet")
+        self.over_budget = over_budget
+        return archived
+
+    def archive_shard(self, shard):
+        """Move a shard's captures into ``<archive>/<event>/<day>.tar.gz`` and delete them locally."""
+        destination = os.path.join(self.archive_dir, shard.event, f"{shard.day}.tar.gz")
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        tmp_path = destination + '.part'
+        with self.lock:
+            filenames = sorted(shard.files)
+        start = time.perf_counter()
+        # JPEGs hardly compress, so the fastest gzip level is used; the manifest still shrinks
+        with tarfile.open(tmp_path, 'w:gz', compresslevel=1) as tar:
+            tar.add(shard.manifest_path, arcname=f"{shard.event}/{shard.day}/{MANIFEST_NAME}")
+            for filename in filenames:
+                tar.add(shard.path(filename), arcname=f"{shard.event}/{shard.day}/{filename}")
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, destination)
+
+        with self.lock:
+            shard.archive = {
+                'path': destination,
+                'bytes': os.path.getsize(destination),
+                'time': time.time(),
+            }
+            shard.save()
+            for filename in filenames:
+                if self.locations.get(filename) is shard:
+                    del self.locations[filename]
+        for filename in filenames:
+            try:
+                os.remove(shard.path(filename))
+            except FileNotFoundError:
+                pass
+        print(f"Archived {shard.key}: {len(filenames)} file(s) to {destination} "
+              f"in {time.perf_counter() - start:.1f}s")
+        for listener in self.listeners:
+            try:
+                listener('archived', filenames)
+            except Exception as e:
+                print(f"Error in storage listener: {e}")
+
+    def stop(self):
+        with self.retention_wakeup:
+            self.is_running = False
+            self.retention_wakeup.notify_all()
+        if self.retention_thread is not None:
+            self.retention_thread.join()
+            self.retention_thread = None
+
+
+def migrate_flat(root, event='default', journal_path=None, dry_run=False):
+    """
+    Move captures from the flat layout into ``<event>/<day>`` shards by file date.
+
+    Upload journal entries are renamed before their file is moved, so a crash
+    part way through never leaves an upload pointing at a missing file, and a
+    second run simply carries on with the files that are left.
+
+    Args:
+        root (str): Captures directory
+        event (str): Event the migrated captures are filed under
+        journal_path (str): Upload journal to update; defaults to ``<root>/uploads.db`` if it exists
+        dry_run (bool): Only report what would be moved
+
+    Returns:
+        dict: Number of files per shard key
+    """
+    event = safe_name(event)
+    groups = {}
+    for entry in os.scandir(root):
+        if CAPTURE_PATTERN.match(entry.name) and entry.is_file():
+            groups.setdefault(day_of(entry.stat().st_mtime), []).append(entry.name)
+    moved = {f"{event}/{day}": len(names) for day, names in sorted(groups.items())}
+    if dry_run or not groups:
+        return moved
+
+    journal_path = journal_path or os.path.join(root, 'uploads.db')
+    journal = None
+    if os.path.exists(journal_path):
+        from src.uploads import UploadJournal
+
+        journal = UploadJournal(journal_path)
+    try:
+        for day, names in sorted(groups.items()):
+            shard = Shard(root, event, day)
+            os.makedirs(shard.directory, exist_ok=True)
+            for name in names:
+                old_path = os.path.abspath(os.path.join(root, name))
+                new_path = os.path.abspath(shard.path(name))
+                if journal:
+                    journal.rename(old_path, new_path)
+                os.replace(old_path, new_path)
+            shard.load()
+            shard.scan()
+            shard.save()
+    finally:
+        if journal:
+            journal.close()
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Capture storage maintenance')
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help='Move flat captures into per-event, per-day shards')
+    migrate.add_argument('captures_dir')
+    migrate.add_argument('--event', default=os.environ.get('PHOTOBOOTH_EVENT', 'default'))
+    migrate.add_argument('--journal', help='Upload journal to update (default: <captures_dir>/uploads.db)')
+    migrate.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        moved = migrate_flat(args.captures_dir, args.event, args.journal, args.dry_run)
+        for key, count in moved.items():
+            print(f"{'Would move' if args.dry_run else 'Moved'} {count} file(s) to {key}")
+        if not moved:
+            print("Nothing to migrate")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import io
+import ipaddress
+import itertools
+import threading
+import time
+
+MJPEG_BOUNDARY = b'frame'
+_PART_HEADER = b'--' + MJPEG_BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+class StreamingOutput(io.BufferedIOBase):
+    """
+    Encoder output holding the newest MJPEG frame.
+
+    The multipart chunk is built once per frame here, and every frame gets a
+    monotonically increasing sequence number so readers can tell how many
+    frames they skipped.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.chunk = None
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.listeners = []
+
+    def write(self, buf):
+        chunk = _PART_HEADER + buf + b'\r\n'
+        with self.condition:
+            self.frame = buf
+            self.chunk = chunk
+            self.sequence += 1
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener()
+        return len(buf)
+
+
+def is_local(peer):
+    """True for the kiosk's own connections (or an unknown peer), which never leave the booth."""
+    if peer is None or peer == 'localhost':
+        return True
+    try:
+        address = ipaddress.ip_address(peer)
+    except ValueError:
+        return False
+    # A dual-stack server reports IPv4 peers as ::ffff:a.b.c.d
+    address = getattr(address, 'ipv4_mapped', None) or address
+    return address.is_loopback
+
+
+class ClientStats:
+    def __init__(self, client_id, tier=None, peer=None):
+        self.client_id = client_id
+        self.tier = tier
+        self.peer = peer
+        self.connected_at = time.time()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+        self.last_sequence = 0
+
+    def as_dict(self):
+        return {
+            'tier': self.tier,
+            'peer': self.peer,
+            'connected_seconds': time.time() - self.connected_at,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'bytes_sent': self.bytes_sent,
+            'last_sequence': self.last_sequence,
+        }
+
+
+class _FrameThrottle:
+    """
+    Passes at most ``max_fps`` frames a second to one client.
+
+    Frames held back this way are the client's choice, so they are not counted
+    as dropped; a frame arriving up to a quarter interval early still goes out,
+    so a 5 fps tier over a 15 fps stream sends every third frame instead of
+    drifting to every fourth.
+    """
+
+    def __init__(self, max_fps):
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.next_due = 0.0
+
+    def allow(self):
+        if not self.interval:
+            return True
+        now = time.perf_counter()
+        if now < self.next_due - self.interval / 4:
+            return False
+        self.next_due = max(self.next_due + self.interval, now)
+        return True
+
+
+class BroadcastHub:
+    """
+    Fans a single StreamingOutput out to any number of MJPEG clients.
+
+    All clients share the same pre-built multipart chunk. A client that is slow
+    to drain its socket simply picks up the newest frame when it is ready again;
+    the frames it skipped are counted as dropped instead of queueing up. Clients
+    may also ask for a lower frame rate (``max_fps``), which thins out the
+    shared stream for them without encoding anything extra.
+    """
+
+    def __init__(self, output, idle_timeout=5.0):
+        """
+        Args:
+            output (StreamingOutput): Encoder output to broadcast
+            idle_timeout (float): Seconds to wait for a frame before re-checking
+        """
+        self.output = output
+        self.idle_timeout = idle_timeout
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self._client_ids = itertools.count(1)
+        self.total_frames_sent = 0
+        self.total_frames_dropped = 0
+        self.total_bytes_sent = 0
+        self._loop = None
+        self._frame_event = None
+
+    @property
+    def client_count(self):
+        with self.clients_lock:
+            return len(self.clients)
+
+    @property
+    def remote_client_count(self):
+        """Connected clients that are not on the booth itself."""
+        with self.clients_lock:
+            return sum(1 for stats in self.clients.values() if not is_local(stats.peer))
+
+    def _register(self, tier=None, peer=None):
+        stats = ClientStats(next(self._client_ids), tier, peer)
+        with self.clients_lock:
+            self.clients[stats.client_id] = stats
+        return stats
+
+    def _unregister(self, stats):
+        with self.clients_lock:
+            self.clients.pop(stats.client_id, None)
+            self.total_frames_sent += stats.frames_sent
+            self.total_frames_dropped += stats.frames_dropped
+            self.total_bytes_sent += stats.bytes_sent
+
+    @staticmethod
+    def _account(stats, sequence, last_sequence, chunk):
+        skipped = sequence - last_sequence - 1
+        if skipped > 0 and stats.frames_sent:
+            stats.frames_dropped += skipped
+        stats.last_sequence = sequence
+        stats.frames_sent += 1
+        stats.bytes_sent += len(chunk)
+
+    def subscribe(self, max_fps=None, tier=None, peer=None):
+        """
+        Yield multipart chunks for one client until it disconnects.
+
+        Args:
+            max_fps (float): Send at most this many frames a second; None sends every frame
+            tier (str): Preview tier name, only reported in ``stats``
+            peer (str): Client address, for telling the kiosk apart from remote viewers
+        """
+        stats = self._register(tier, peer)
+        throttle = _FrameThrottle(max_fps)
+        output = self.output
+        try:
+            with output.condition:
+                last_sequence = output.sequence
+                chunk = output.chunk
+            # Send the current frame straight away so new viewers see an image
+            if chunk is not None:
+                throttle.allow()
+                stats.frames_sent += 1
+                stats.bytes_sent += len(chunk)
+                stats.last_sequence = last_sequence
+                yield chunk
+
+            while True:
+                with output.condition:
+                    if output.sequence == last_sequence:
+                        output.condition.wait(self.idle_timeout)
+                    sequence = output.sequence
+                    chunk = output.chunk
+                if sequence == last_sequence or chunk is None:
+                    continue
+                if not throttle.allow():
+                    last_sequence = sequence
+                    continue
+
+                self._account(stats, sequence, last_sequence, chunk)
+                last_sequence = sequence
+                yield chunk
+        finally:
+            self._unregister(stats)
+
+    def attach_loop(self, loop):
+        """
+        Let ``subscribe_async`` clients on ``loop`` be woken by new frames.
+
+        The encoder thread schedules one wake-up per frame on the loop, however
+        many async clients are connected.
+        """
+        import asyncio
+
+        self._loop = loop
+        self._frame_event = asyncio.Event()
+        self.output.listeners.append(self._notify_loop)
+
+    def _notify_loop(self):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake_async_clients)
+
+    def _wake_async_clients(self):
+        import asyncio
+
+        event, self._frame_event = self._frame_event, asyncio.Event()
+        event.set()
+
+    async def subscribe_async(self, max_fps=None, tier=None, peer=None):
+        """Async counterpart of ``subscribe`` for clients served on the attached event loop."""
+        import asyncio
+
+        if self._loop is None:
+            raise RuntimeError("attach_loop() must be called before subscribe_async()")
+        stats = self._register(tier, peer)
+        throttle = _FrameThrottle(max_fps)
+        output = self.output
+        last_sequence = None
+        try:
+            while True:
+                event = self._frame_event
+                with output.condition:
+                    sequence, chunk = output.sequence, output.chunk
+                if chunk is not None and sequence != last_sequence:
+                    if not throttle.allow():
+                        last_sequence = sequence
+                        continue
+                    if last_sequence is None:
+                        stats.frames_sent += 1
+                        stats.bytes_sent += len(chunk)
+                        stats.last_sequence = sequence
+                    else:
+                        self._account(stats, sequence, last_sequence, chunk)
+                    last_sequence = sequence
+                    yield chunk
+                    continue
+                try:
+                    await asyncio.wait_for(event.wait(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._unregister(stats)
+
+    def stats(self):
+        """Return connected clients, frame counters and per-client send/drop counts."""
+        with self.clients_lock:
+            clients = {client_id: s.as_dict() for client_id, s in self.clients.items()}
+            sent = self.total_frames_sent
+            dropped = self.total_frames_dropped
+            sent_bytes = self.total_bytes_sent
+        return {
+            'connected_clients': len(clients),
+            'frames_published': self.output.sequence,
+            'frames_sent': sent + sum(c['frames_sent'] for c in clients.values()),
+            'frames_dropped': dropped + sum(c['frames_dropped'] for c in clients.values()),
+            'bytes_sent': sent_bytes + sum(c['bytes_sent'] for c in clients.values()),
+            'clients': clients,
+        }
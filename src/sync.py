@@ -0,0 +1,644 @@
+"""
+Multi-booth gallery sync.
+
+Every booth keeps a ``CaptureManifest``, a list of its captures (name, sha256,
+size, capture time) served at ``/sync/manifest``. An entry's version is its
+position in the list, so a client that has seen version ``n`` asks for
+``since=n`` and gets only what came later, or waits on a long poll until
+something does.
+
+An aggregator (``app.py`` with ``PHOTOBOOTH_SYNC_BOOTHS``) runs a
+``GalleryAggregator`` in place of the camera system. One follower per booth
+long-polls its manifest, and the new files are fetched from the booth's
+``/captures`` on a shared pool of keep-alive connections, several at a time.
+Each file is checked against its hash and filed into the aggregator's own
+capture storage under a fresh capture number, since two booths both have a
+``photo_1.jpg``. A number is reserved per hash, so a download that fails is
+retried under the same number instead of leaving a gap. The merged gallery is then served by the same index,
+``/captures``, ``/api/photos`` and ``/feed`` routes as a single booth's.
+
+Versions count from a booth's start, which the manifest's ``epoch`` names.
+When a booth restarts, the aggregator sees a new epoch and reads the whole
+manifest again. Files it already has are skipped by hash. How far each
+booth's version has got is kept in ``sync.db``, so a restarted aggregator
+carries on where it stopped.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+from src.derivatives import DerivativeCache
+from src.feed import PhotoFeed
+from src.metrics import METRICS
+from src.photo_index import PhotoIndex
+from src.startup import STARTUP
+from src.storage import CAPTURE_PATTERN, CaptureStorage
+
+SYNC_LAG = METRICS.histogram(
+    'photobooth_sync_lag_seconds',
+    "Time from a capture on a booth to its arrival on the aggregator (by the booth's clock)",
+    ('booth',),
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+SYNC_FILES = METRICS.counter('photobooth_sync_files_total', 'Captures pulled from booths, by outcome',
+                             ('booth', 'result'))
+SYNC_BYTES = METRICS.counter('photobooth_sync_bytes_total', 'Capture bytes pulled from booths', ('booth',))
+# Entries per manifest response; a new or restarted booth is read in pages of this size
+MANIFEST_PAGE = 500
+# Recent lags kept per booth for /sync/status
+LAG_HISTORY = 500
+HASH_CHUNK = 256 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _set_all(events):
+    for event in events:
+        event.set()
+
+
+class CaptureManifest:
+    """
+    The versioned list of one booth's captures, for aggregators to follow.
+
+    Built in the background from the capture storage at start-up, oldest
+    first. Hashes are cached in ``hash_cache_path`` by name, size and mtime, so
+    a restart only hashes files it has not seen. After that, every written
+    capture is appended by ``file_event``.
+    """
+
+    def __init__(self, storage, booth_id, hash_cache_path=None):
+        """
+        Args:
+            storage (CaptureStorage): The booth's captures
+            booth_id (str): Name of the booth in the manifest and on the aggregator
+            hash_cache_path (str): JSON file of known hashes; None hashes every file on start
+        """
+        self.storage = storage
+        self.booth_id = booth_id
+        self.hash_cache_path = hash_cache_path
+        # Versions are only comparable within one epoch, i.e. one run of the booth
+        self.epoch = uuid.uuid4().hex[:12]
+        self.entries = None
+        self.names = set()
+        self.pending = []
+        self.condition = threading.Condition()
+        self.async_waiters = {}
+        self.build_thread = threading.Thread(target=self._build, name='manifest', daemon=True)
+        self.build_thread.start()
+
+    def _load_hash_cache(self):
+        if not self.hash_cache_path:
+            return {}
+        try:
+            with open(self.hash_cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_hash_cache(self):
+        if not self.hash_cache_path:
+            return
+        with self.condition:
+            cache = {e['name']: [e['size'], e['mtime'], e['sha256']] for e in self.entries or ()}
+        tmp = self.hash_cache_path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(cache, f, separators=(',', ':'))
+            os.replace(tmp, self.hash_cache_path)
+        except OSError as e:
+            print(f"Could not save the manifest hash cache: {e}")
+
+    @staticmethod
+    def _entry(name, path, mtime, size, digest=None):
+        return {'name': name, 'sha256': digest or file_sha256(path), 'size': size, 'mtime': mtime}
+
+    def _build(self):
+        start = time.perf_counter()
+        cache = self._load_hash_cache()
+        entries = []
+        hashed = 0
+        for name, path, mtime, size in sorted(self.storage.files(), key=lambda f: (f[2], f[0])):
+            if not CAPTURE_PATTERN.match(name):
+                continue
+            cached = cache.get(name)
+            try:
+                if cached and cached[0] == size and cached[1] == mtime:
+                    entries.append(self._entry(name, path, mtime, size, cached[2]))
+                else:
+                    entries.append(self._entry(name, path, mtime, size))
+                    hashed += 1
+            except OSError as e:
+                print(f"Leaving {name} out of the manifest: {e}")
+        with self.condition:
+            # Captures written while the storage was being read were held back until now
+            names = {e['name'] for e in entries}
+            entries.extend(e for e in self.pending if e['name'] not in names)
+            self.entries = entries
+            self.names = names | {e['name'] for e in self.pending}
+            self.pending = []
+        self._wake()
+        print(f"Capture manifest: {len(entries)} file(s), {hashed} hashed, "
+              f"in {time.perf_counter() - start:.2f}s")
+        if hashed:
+            self._save_hash_cache()
+
+    def file_event(self, event, path, **details):
+        """Camera system file listener; appends every capture once it is on disk."""
+        if event != 'processed':
+            return
+        name = os.path.basename(path)
+        try:
+            stat = os.stat(path)
+            entry = self._entry(name, path, stat.st_mtime, stat.st_size)
+        except OSError as e:
+            print(f"Leaving {name} out of the manifest: {e}")
+            return
+        with self.condition:
+            if self.entries is None:
+                self.pending.append(entry)
+                return
+            if name in self.names:
+                return
+            self.names.add(name)
+            self.entries.append(entry)
+        self._wake()
+
+    def _wake(self):
+        with self.condition:
+            self.condition.notify_all()
+            waiters = {loop: list(events) for loop, events in self.async_waiters.items()}
+        for loop, events in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_set_all, events)
+            except RuntimeError:
+                pass
+
+    def _since(self, epoch, since):
+        """Where to start for a client at ``since`` of ``epoch``; another epoch starts over."""
+        return max(0, since) if epoch == self.epoch else 0
+
+    def _page(self, since, limit):
+        """Response for the entries after version ``since``. Call with ``condition`` held."""
+        entries = (self.entries or [])[since:since + limit]
+        return {
+            'booth': self.booth_id,
+            'epoch': self.epoch,
+            'version': since + len(entries),
+            'latest': len(self.entries or ()),
+            'building': self.entries is None,
+            'entries': [{'name': e['name'], 'sha256': e['sha256'], 'size': e['size'], 'time': e['mtime']}
+                        for e in entries],
+        }
+
+    def _has_changes(self, since):
+        return self.entries is not None and len(self.entries) > since
+
+    def changes(self, epoch=None, since=0, limit=MANIFEST_PAGE, timeout=None):
+        """
+        Entries after version ``since``, waiting up to ``timeout`` seconds if there are none yet.
+
+        Args:
+            epoch (str): Epoch ``since`` belongs to; any other (or None) starts from the beginning
+            since (int): Version the client already has
+            limit (int): Most entries returned
+            timeout (float): Longest wait for a new capture; 0 or None answers straight away
+
+        Returns:
+            dict: booth, epoch, version reached by these entries, latest version, and the entries
+        """
+        since = self._since(epoch, since)
+        with self.condition:
+            if timeout:
+                self.condition.wait_for(lambda: self._has_changes(since), timeout)
+            return self._page(since, limit)
+
+    async def changes_async(self, epoch=None, since=0, limit=MANIFEST_PAGE, timeout=None):
+        """Like ``changes``, but waits on the event loop instead of a thread."""
+        since = self._since(epoch, since)
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        with self.condition:
+            ready = not timeout or self._has_changes(since)
+            if not ready:
+                self.async_waiters.setdefault(loop, set()).add(wakeup)
+        try:
+            if not ready:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.condition:
+                waiters = self.async_waiters.get(loop)
+                if waiters is not None:
+                    waiters.discard(wakeup)
+                    if not waiters:
+                        del self.async_waiters[loop]
+                return self._page(since, limit)
+
+    def close(self):
+        self._save_hash_cache()
+
+
+class SyncJournal:
+    """
+    SQLite record of what an aggregator has pulled.
+
+    ``booths`` keeps each booth's epoch and the manifest version reached in it.
+    ``files`` has one row per pulled capture, keyed by hash. ``local_name`` is
+    NULL for a capture the booth no longer had (archived), which is not asked
+    for again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS booths (
+                url TEXT PRIMARY KEY,
+                booth TEXT,
+                epoch TEXT,
+                version INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                sha256 TEXT PRIMARY KEY,
+                booth TEXT NOT NULL,
+                name TEXT NOT NULL,
+                local_name TEXT,
+                number INTEGER,
+                size INTEGER NOT NULL,
+                captured REAL NOT NULL,
+                synced REAL NOT NULL
+            )
+        ''')
+
+    def booth_state(self, url):
+        """Return (epoch, version) reached for the booth at ``url``, or (None, 0)."""
+        with self.lock:
+            row = self.conn.execute('SELECT epoch, version FROM booths WHERE url = ?', (url,)).fetchone()
+        return row if row else (None, 0)
+
+    def set_booth_state(self, url, booth, epoch, version):
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO booths (url, booth, epoch, version, updated) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET booth = excluded.booth, epoch = excluded.epoch, '
+                'version = excluded.version, updated = excluded.updated',
+                (url, booth, epoch, version, time.time())
+            )
+
+    def known_hashes(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT sha256 FROM files')}
+
+    def last_number(self):
+        with self.lock:
+            row = self.conn.execute('SELECT MAX(number) FROM files').fetchone()
+        return row[0] if row[0] is not None else -1
+
+    def record(self, sha256, booth, name, local_name, number, size, captured):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files (sha256, booth, name, local_name, number, size, captured, synced) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (sha256, booth, name, local_name, number, size, captured, time.time())
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class TransferError(Exception):
+    """A capture could not be pulled; ``permanent`` ones are not retried."""
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class BoothFollower:
+    """Keeps one booth's captures mirrored into the aggregator."""
+
+    def __init__(self, aggregator, url, poll_wait=20.0):
+        """
+        Args:
+            aggregator (GalleryAggregator): Where the captures go
+            url (str): Base URL of the booth, e.g. ``http://booth-1.local``
+            poll_wait (float): Seconds a manifest request waits on the booth for a new capture
+        """
+        self.aggregator = aggregator
+        self.url = url.rstrip('/')
+        self.poll_wait = poll_wait
+        self.booth = None
+        self.epoch, self.version = aggregator.journal.booth_state(self.url)
+        self.latest = None
+        self.connected = False
+        self.failures = 0
+        self.last_error = None
+        self.last_sync = None
+        self.files = 0
+        self.bytes = 0
+        self.transfer_seconds = 0.0
+        self.lags = deque(maxlen=LAG_HISTORY)
+        self.manifest_bytes = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"sync-{self.url}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _fetch_manifest(self):
+        # Answer straight away while behind; otherwise wait on the booth for the next capture
+        behind = self.latest is not None and self.version < self.latest
+        response = self.aggregator.session().get(
+            f"{self.url}/sync/manifest",
+            params={'epoch': self.epoch or '', 'since': self.version, 'limit': MANIFEST_PAGE,
+                    'wait': 0 if behind else self.poll_wait},
+            timeout=(self.aggregator.timeout, self.poll_wait + self.aggregator.timeout)
+        )
+        response.raise_for_status()
+        self.manifest_bytes += len(response.content)
+        return response.json()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                page = self._fetch_manifest()
+            except Exception as e:
+                self._failed(f"manifest: {e}")
+                continue
+            if page['epoch'] != self.epoch:
+                if self.epoch is not None:
+                    print(f"Booth {page['booth']} at {self.url} restarted; reading its manifest again")
+                # The booth answered from the start of the new epoch
+                self.epoch = page['epoch']
+            self.booth = page['booth']
+            self.latest = page['latest']
+            self.connected = True
+            if self.stopped.is_set():
+                return
+            if page['entries'] and not self.aggregator.pull(self, page['entries']):
+                # Some transfers failed; the same page is asked for again
+                self._failed(self.last_error)
+                continue
+            self.failures = 0
+            self.version = page['version']
+            self.aggregator.journal.set_booth_state(self.url, self.booth, self.epoch, self.version)
+            if page['entries']:
+                self.last_sync = time.time()
+
+    def _failed(self, error):
+        self.connected = False
+        self.failures += 1
+        self.last_error = error
+        if self.failures == 1:
+            print(f"Sync from {self.url} failed: {error}")
+        # 1, 2, 4 ... 30 seconds
+        self.stopped.wait(min(30.0, 2.0 ** (self.failures - 1)))
+
+    def transferred(self, size, seconds, lag):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            self.transfer_seconds += seconds
+            if lag is not None:
+                self.lags.append(lag)
+
+    def stats(self):
+        with self.lock:
+            files, size, seconds = self.files, self.bytes, self.transfer_seconds
+            lags = sorted(self.lags)
+        return {
+            'url': self.url,
+            'booth': self.booth,
+            'connected': self.connected,
+            'epoch': self.epoch,
+            'version': self.version,
+            'latest': self.latest,
+            'behind': None if self.latest is None else self.latest - self.version,
+            'files': files,
+            'bytes': size,
+            'manifest_bytes': self.manifest_bytes,
+            # Per connection while transferring; concurrent transfers add up
+            'bytes_per_second': size / seconds if seconds else None,
+            # Of captures taken while the aggregator was following, not the backlog it found
+            'lag_seconds': {
+                'recent': len(lags),
+                'median': lags[len(lags) // 2] if lags else None,
+                'p95': lags[min(len(lags) - 1, int(len(lags) * 0.95))] if lags else None,
+                'max': lags[-1] if lags else None,
+            },
+            'last_sync': self.last_sync,
+            'last_error': self.last_error,
+        }
+
+    def stop(self):
+        self.stopped.set()
+
+
+class GalleryAggregator:
+    """
+    Stands in for the camera system on a node serving the merged gallery of several booths.
+
+    It has the storage, photo index, feed and derivative cache that the
+    gallery routes use, and no camera.
+    """
+
+    def __init__(self, booths, capture_dir, cache_dir=None, event='default', transfers=4, poll_wait=20.0,
+                 timeout=10.0):
+        """
+        Args:
+            booths (list): Base URLs of the booths to follow
+            capture_dir (str): Where the merged captures are stored
+            cache_dir (str): Thumbnail cache; defaults to ``cache`` next to ``capture_dir``
+            event (str): Event the captures are filed under
+            transfers (int): Captures downloaded at once, over as many keep-alive connections
+            poll_wait (float): Seconds a manifest request waits on the booth for a new capture
+            timeout (float): Seconds to wait for a connection and for each read of a transfer
+        """
+        if not booths:
+            raise ValueError("An aggregator needs at least one booth URL")
+        self.capture_dir = capture_dir
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(capture_dir)), 'cache')
+        self.timeout = timeout
+        self.transfers = transfers
+        self._local = threading.local()
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        # sha256 -> capture number, for captures not pulled yet
+        self.reserved = {}
+        self.started = None
+        STARTUP.expect('storage', 'sync')
+        with STARTUP.phase('storage', subsystem='storage'):
+            self.storage = CaptureStorage(capture_dir, event=event)
+            self.photo_index = PhotoIndex(self.storage)
+            self.feed = PhotoFeed(self.photo_index)
+            self.derivatives = DerivativeCache(self.storage.resolve, os.path.join(self.cache_dir, 'derivatives'))
+        with STARTUP.phase('sync', subsystem='sync'):
+            self.journal = SyncJournal(os.path.join(capture_dir, 'sync.db'))
+            self.known = self.journal.known_hashes()
+            self.next_number = max(self.journal.last_number(), self.storage.last_number) + 1
+            self.executor = ThreadPoolExecutor(max_workers=transfers, thread_name_prefix='sync-transfer')
+            self.followers = [BoothFollower(self, url, poll_wait) for url in booths]
+
+    def session(self):
+        """A requests session per thread, so every transfer thread keeps its connections open."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def pull(self, follower, entries):
+        """
+        Fetch the new captures among ``entries`` from a booth, several at once.
+
+        Returns:
+            bool: True if every capture was pulled or is known to be gone from the booth
+        """
+        with self.lock:
+            new = [e for e in entries if e['sha256'] not in self.known and e['sha256'] not in self.in_flight]
+            # Numbered in capture order, so the gallery lists a booth's photos as they were taken
+            new.sort(key=lambda e: e['time'])
+            jobs = []
+            for entry in new:
+                self.in_flight.add(entry['sha256'])
+                number = self.reserved.get(entry['sha256'])
+                if number is None:
+                    # A retry keeps the number it was given the first time
+                    number = self.reserved[entry['sha256']] = self.next_number
+                    self.next_number += 1
+                jobs.append((entry, number))
+        futures = [self.executor.submit(self._transfer, follower, entry, number) for entry, number in jobs]
+        wait(futures)
+        ok = True
+        for (entry, number), future in zip(jobs, futures):
+            error = future.exception()
+            permanent = isinstance(error, TransferError) and error.permanent
+            with self.lock:
+                self.in_flight.discard(entry['sha256'])
+                if error is None or permanent:
+                    del self.reserved[entry['sha256']]
+                if permanent and number == self.next_number - 1:
+                    # Nothing was numbered after it, so the number can be handed out again
+                    self.next_number -= 1
+            if error is None:
+                continue
+            if permanent:
+                SYNC_FILES.inc(follower.booth, 'gone')
+                self.journal.record(entry['sha256'], follower.booth, entry['name'], None, None,
+                                    entry['size'], entry['time'])
+                with self.lock:
+                    self.known.add(entry['sha256'])
+            else:
+                SYNC_FILES.inc(follower.booth, 'failed')
+                follower.last_error = f"{entry['name']}: {error}"
+                ok = False
+        return ok
+
+    def _transfer(self, follower, entry, number):
+        """Download one capture, check its hash and file it as capture ``number``."""
+        name = entry['name']
+        prefix, ext = name.split('_', 1)[0], os.path.splitext(name)[1]
+        local_name = f"{prefix}_{number}{ext}"
+        path = self.storage.path_for(local_name, when=entry['time'])
+        tmp = path + '.part'
+        start = time.perf_counter()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with self.session().get(f"{follower.url}/captures/{quote(name)}", stream=True,
+                                    timeout=self.timeout) as response:
+                if response.status_code == 404:
+                    raise TransferError(f"{name} is no longer on the booth", permanent=True)
+                if response.status_code != 200:
+                    # 202 while the booth is still writing it, or an error
+                    raise TransferError(f"{name}: HTTP {response.status_code}")
+                with open(tmp, 'wb') as f:
+                    for chunk in response.iter_content(HASH_CHUNK):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            if digest.hexdigest() != entry['sha256']:
+                raise TransferError(f"{name}: hash mismatch after {size} bytes")
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        seconds = time.perf_counter() - start
+        self.storage.add(path)
+        self.journal.record(entry['sha256'], follower.booth, name, local_name, number, size, entry['time'])
+        with self.lock:
+            self.known.add(entry['sha256'])
+        record = self.photo_index.add(path)
+        if record is not None:
+            self.feed.publish(record)
+        lag = max(0.0, time.time() - entry['time'])
+        follower.transferred(size, seconds, lag if entry['time'] >= self.started else None)
+        SYNC_FILES.inc(follower.booth, 'pulled')
+        SYNC_BYTES.inc(follower.booth, amount=size)
+        SYNC_LAG.observe(lag, follower.booth)
+
+    # The parts of the camera system's interface the gallery routes use
+
+    def wait_for_photo(self, name, timeout=3.0):
+        """Captures are only added once they are complete, so there is nothing to wait for."""
+        return True
+
+    def get_latest_photo(self):
+        photos = self.photo_index.latest(1)
+        return photos[0].filename if photos else None
+
+    def get_all_photos(self):
+        return self.photo_index.filenames()
+
+    def stats(self):
+        booths = [f.stats() for f in self.followers]
+        total = sum(b['bytes'] for b in booths)
+        return {
+            'booths': booths,
+            'files': sum(b['files'] for b in booths),
+            'bytes': total,
+            'transfers': self.transfers,
+            # Over the time since the followers started, idle time included
+            'bytes_per_second_overall': total / (time.time() - self.started) if self.started else None,
+        }
+
+    def run(self):
+        self.started = time.time()
+        for follower in self.followers:
+            follower.start()
+        STARTUP.mark('ready')
+        print(f"Gallery aggregator following {len(self.followers)} booth(s).")
+
+    def cleanup(self):
+        for follower in self.followers:
+            follower.stop()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.storage.stop()
+        self.journal.close()
@@ -0,0 +1,151 @@
+"""
+Bandwidth control for uploads.
+
+Uploaders send files in chunks of ``chunk_size`` bytes and ask the
+``UploadScheduler`` for permission before each one. The scheduler keeps a
+token bucket shared by all upload workers, so the cap holds for the booth as a
+whole, and switches between two rates: ``idle_rate`` while nothing else needs
+the uplink and ``busy_rate`` while a capture is running or remote viewers are
+watching the preview. After the last activity it waits ``hold`` seconds before
+speeding up again, so the gaps between the shots of a burst don't count as
+idle. A rate of None means unlimited.
+"""
+import threading
+import time
+
+from src.metrics import METRICS
+
+UPLOAD_BYTES = METRICS.counter('photobooth_upload_bytes_total', 'Bytes handed to the upload backend')
+THROTTLE_SECONDS = METRICS.counter('photobooth_upload_throttled_seconds_total',
+                                   'Time upload workers waited for bandwidth')
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+
+class TokenBucket:
+    """
+    Token bucket in bytes that may be overdrawn by one chunk.
+
+    Taking more tokens than are available leaves a debt that has to be paid
+    back at the current rate, which keeps large chunks from being starved by
+    a burst size smaller than the chunk.
+    """
+
+    def __init__(self, rate=None, burst=DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            rate (float): Bytes per second, or None for no limit
+            burst (int): Most bytes that can be sent at once after an idle period
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.monotonic())
+            if rate is None:
+                self.tokens = float(self.burst)
+            self.rate = rate
+
+    def take(self, amount):
+        """
+        Take ``amount`` tokens, going into debt if needed.
+
+        Returns:
+            float: Seconds until the debt is paid back at the current rate (0 if there is none)
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if not self.rate:
+                return 0.0
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class UploadScheduler:
+    """Decides how fast uploads may go, based on what the booth is doing."""
+
+    def __init__(self, idle_rate=None, busy_rate=None, chunk_size=DEFAULT_CHUNK_SIZE, is_busy=None, hold=3.0,
+                 poll_interval=0.25):
+        """
+        Args:
+            idle_rate (float): Bytes per second while the booth is idle, None for unlimited
+            busy_rate (float): Bytes per second while ``is_busy`` says so, None for unlimited
+            chunk_size (int): Bytes sent per chunk; Drive's resumable uploads need a multiple of 256 KiB
+            is_busy (callable): Returns True while captures or remote viewers need the bandwidth
+            hold (float): Seconds after the last busy check before going back to ``idle_rate``
+            poll_interval (float): Longest sleep between checks of the booth state while throttled
+        """
+        self.idle_rate = idle_rate
+        self.busy_rate = busy_rate
+        self.chunk_size = chunk_size
+        self.is_busy = is_busy or (lambda: False)
+        self.hold = hold
+        self.poll_interval = poll_interval
+        self.bucket = TokenBucket(idle_rate, burst=chunk_size)
+        self.busy_until = 0.0
+        self.bytes_sent = 0
+        self.throttled_seconds = 0.0
+        self.lock = threading.Lock()
+        METRICS.gauge('photobooth_upload_rate_limit_bytes', 'Current upload bandwidth cap (0 for none)',
+                      lambda: self.bucket.rate or 0)
+        METRICS.gauge('photobooth_upload_busy', '1 while uploads are held to the busy rate', lambda: int(self.busy))
+
+    @property
+    def busy(self):
+        now = time.monotonic()
+        if self.is_busy():
+            self.busy_until = now + self.hold
+        return now < self.busy_until
+
+    def current_rate(self):
+        rate = self.busy_rate if self.busy else self.idle_rate
+        if rate != self.bucket.rate:
+            self.bucket.set_rate(rate)
+        return rate
+
+    def throttle(self, nbytes):
+        """Block until ``nbytes`` more may be sent. Called by uploaders before every chunk."""
+        self.current_rate()
+        wait = self.bucket.take(nbytes)
+        waited = 0.0
+        while wait > 0:
+            # Sleep in short steps so the booth going idle lifts the limit straight away
+            step = min(wait, self.poll_interval)
+            time.sleep(step)
+            waited += step
+            self.current_rate()
+            wait = self.bucket.take(0)
+        with self.lock:
+            self.bytes_sent += nbytes
+            self.throttled_seconds += waited
+        UPLOAD_BYTES.inc(amount=nbytes)
+        if waited:
+            THROTTLE_SECONDS.inc(amount=waited)
+
+    def chunks(self, f, size=None):
+        """Yield throttled chunks of the open binary file ``f``."""
+        chunk_size = size or self.chunk_size
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                return
+            self.throttle(len(data))
+            yield data
+
+    def stats(self):
+        with self.lock:
+            return {
+                'busy': self.busy,
+                'rate_limit': self.bucket.rate,
+                'bytes_sent': self.bytes_sent,
+                'throttled_seconds': self.throttled_seconds,
+            }
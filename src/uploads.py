@@ -0,0 +1,544 @@
+import io
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from src.metrics import METRICS
+
+UPLOAD_RESULTS = METRICS.counter('photobooth_uploads_total', 'Upload attempts by outcome', ('result',))
+
+MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.mp4': 'video/mp4',
+}
+
+
+def guess_mime_type(file_path):
+    return MIME_TYPES.get(os.path.splitext(file_path)[1].lower(), 'application/octet-stream')
+
+
+class UploadJournal:
+    """
+    SQLite journal of every file that should be uploaded and where it stands.
+
+    States are ``pending`` (waiting for its next attempt), ``uploading``,
+    ``done`` and ``failed`` (gave up after the maximum number of attempts).
+    Anything left ``uploading`` by a crash goes back to ``pending`` on open.
+    Entries with a lower ``priority`` are claimed first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.created = not os.path.exists(path)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS uploads (
+                path TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                remote_id TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        ''')
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(uploads)')}
+        if 'priority' not in columns:
+            # Journals written before upload priorities existed
+            self.conn.execute('ALTER TABLE uploads ADD COLUMN priority INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS uploads_due ON uploads (status, next_attempt)')
+        with self.lock:
+            self.conn.execute("UPDATE uploads SET status = 'pending' WHERE status = 'uploading'")
+
+    def add(self, path, status='pending', priority=0):
+        """Record ``path``. Returns False if it was already in the journal."""
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO uploads (path, status, priority, created, updated) VALUES (?, ?, ?, ?, ?)',
+                (path, status, priority, now, now)
+            )
+        return cursor.rowcount > 0
+
+    def known_paths(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT path FROM uploads')}
+
+    def claim_next(self, now=None, max_priority=None):
+        """
+        Mark the next due ``pending`` entry as ``uploading`` and return it.
+
+        Args:
+            now (float): time.time() to compare ``next_attempt`` with
+            max_priority (int): Only claim entries with at most this priority
+
+        Returns:
+            tuple: (path, attempts so far) or None if nothing is due
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT path, attempts FROM uploads WHERE status = 'pending' AND next_attempt <= ? "
+                "AND priority <= ? ORDER BY priority, next_attempt, created LIMIT 1",
+                (now, max_priority if max_priority is not None else 1 << 62)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE uploads SET status = 'uploading', updated = ? WHERE path = ?",
+                (now, row[0])
+            )
+            return row
+
+    def next_due(self):
+        """Return the earliest ``next_attempt`` of any pending entry, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT MIN(next_attempt) FROM uploads WHERE status = 'pending'"
+            ).fetchone()
+        return row[0]
+
+    def mark_done(self, path, remote_id=None):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE uploads SET status = 'done', remote_id = ?, last_error = NULL, updated = ? WHERE path = ?",
+                (remote_id, time.time(), path)
+            )
+
+    def mark_retry(self, path, attempts, next_attempt, error):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE uploads SET status = 'pending', attempts = ?, next_attempt = ?, last_error = ?, "
+                "updated = ? WHERE path = ?",
+                (attempts, next_attempt, error, time.time(), path)
+            )
+
+    def mark_failed(self, path, attempts, error):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE uploads SET status = 'failed', attempts = ?, last_error = ?, updated = ? WHERE path = ?",
+                (attempts, error, time.time(), path)
+            )
+
+    def rename(self, old_path, new_path):
+        """Point an entry at the new location of its file, e.g. after a storage migration."""
+        with self.lock:
+            self.conn.execute('UPDATE OR REPLACE uploads SET path = ?, updated = ? WHERE path = ?',
+                              (new_path, time.time(), old_path))
+
+    def statuses(self, paths):
+        """Return a dict of path -> status for those of ``paths`` that are in the journal."""
+        paths = list(paths)
+        found = {}
+        with self.lock:
+            # Stay well below SQLite's limit on bound parameters
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                found.update(self.conn.execute(
+                    f"SELECT path, status FROM uploads WHERE path IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def counts(self):
+        """Return the number of entries per status."""
+        with self.lock:
+            return dict(self.conn.execute('SELECT status, COUNT(*) FROM uploads GROUP BY status'))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class UploadQueue:
+    """
+    Durable upload queue drained by a pool of worker threads.
+
+    Every queued file is recorded in an UploadJournal before it is uploaded, so
+    nothing is lost when the service restarts. Failed uploads are retried with
+    exponential backoff and full jitter up to ``max_attempts``. The uploader is
+    any object with an ``upload_file(path)`` method returning a dict, which keeps
+    the Drive backend swappable for a local stand-in server.
+
+    With an ``UploadScheduler``, uploaders that have a ``scheduler`` attribute
+    send their files through it in throttled chunks, and entries queued with a
+    priority above 0 (e.g. originals whose resized variant went first) wait
+    until the booth is idle.
+    """
+
+    def __init__(self, uploader, journal_path, workers=2, max_attempts=8, base_delay=2.0, max_delay=300.0,
+                 scheduler=None):
+        """
+        Args:
+            uploader: Backend with an ``upload_file(path)`` method (e.g. GoogleDriveUploader)
+            journal_path (str): Path to the SQLite journal
+            workers (int): Number of concurrent upload threads
+            max_attempts (int): Attempts before an upload is marked failed
+            base_delay (float): Backoff before the first retry, in seconds
+            max_delay (float): Upper bound for the backoff, in seconds
+            scheduler (UploadScheduler): Bandwidth control shared by the workers
+        """
+        self.uploader = uploader
+        self.scheduler = scheduler
+        if scheduler is not None and hasattr(uploader, 'scheduler'):
+            uploader.scheduler = scheduler
+        self.journal = UploadJournal(journal_path)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.wakeup = threading.Condition()
+        # Called with (status, path, **details) after every attempt: uploaded, upload_retry or upload_failed
+        self.listeners = []
+        METRICS.gauge('photobooth_upload_queue', 'Upload journal entries by status',
+                      lambda: {(status,): n for status, n in self.journal.counts().items()}, ('status',))
+        self.is_running = True
+        self.upload_threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._process_queue, name=f"upload-{i}", daemon=True)
+            thread.start()
+            self.upload_threads.append(thread)
+
+    def add_to_queue(self, filename, priority=0):
+        """
+        Add a file to the upload queue.
+
+        Args:
+            filename (str): File to upload
+            priority (int): 0 uploads as soon as possible; higher values wait while the booth is busy
+        """
+        if self.journal.add(os.path.abspath(filename), priority=priority):
+            with self.wakeup:
+                self.wakeup.notify()
+
+    def reconcile(self, paths, assume_uploaded=False):
+        """
+        Queue any of ``paths`` the journal has never seen.
+
+        Args:
+            paths (list): Captures on local storage
+            assume_uploaded (bool): When the journal is new, record existing captures as done instead
+                of uploading them; only for booths whose old captures are known to be uploaded already
+        """
+        known = self.journal.known_paths()
+        status = 'done' if assume_uploaded and self.journal.created else 'pending'
+        added = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            if path not in known and self.journal.add(path, status=status):
+                added += 1
+        if added:
+            print(f"Upload journal: recorded {added} untracked file(s) as {status}")
+            with self.wakeup:
+                self.wakeup.notify_all()
+        return added
+
+    def backoff(self, attempts):
+        """Full-jitter exponential backoff for the given number of failed attempts."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempts - 1))))
+
+    def _process_queue(self):
+        """Process the upload queue in the background"""
+        while self.is_running:
+            try:
+                # While the booth is busy only the most urgent uploads go out
+                busy = self.scheduler is not None and self.scheduler.busy
+                job = self.journal.claim_next(max_priority=0 if busy else None)
+                if job is None:
+                    next_due = self.journal.next_due()
+                    timeout = 1.0 if next_due is None else min(1.0, max(0.0, next_due - time.time()))
+                    with self.wakeup:
+                        self.wakeup.wait(timeout)
+                    continue
+
+                filename, attempts = job
+                attempts += 1
+                try:
+                    with METRICS.stage('upload'):
+                        file = self.uploader.upload_file(filename)
+                except FileNotFoundError as e:
+                    self.journal.mark_failed(filename, attempts, str(e))
+                    UPLOAD_RESULTS.inc('missing')
+                    print(f"Not uploading missing file {filename}")
+                    self._notify('upload_failed', filename, error=str(e))
+                except Exception as e:
+                    if attempts >= self.max_attempts:
+                        self.journal.mark_failed(filename, attempts, str(e))
+                        UPLOAD_RESULTS.inc('failed')
+                        print(f"Giving up on {filename} after {attempts} attempts: {str(e)}")
+                        self._notify('upload_failed', filename, error=str(e), attempts=attempts)
+                    else:
+                        delay = self.backoff(attempts)
+                        self.journal.mark_retry(filename, attempts, time.time() + delay, str(e))
+                        UPLOAD_RESULTS.inc('retry')
+                        print(f"Failed to upload {filename} (attempt {attempts}), retrying in {delay:.1f}s: {str(e)}")
+                        self._notify('upload_retry', filename, error=str(e), attempts=attempts, delay=delay)
+                else:
+                    self.journal.mark_done(filename, file.get('id'))
+                    UPLOAD_RESULTS.inc('done')
+                    print(f"Uploaded {file.get('name', os.path.basename(filename))}")
+                    if file.get('webViewLink'):
+                        print(f"View at: {file['webViewLink']}")
+                    self._notify('uploaded', filename, remote_id=file.get('id'))
+            except Exception as e:
+                print(f"Error in upload queue processor: {str(e)}")
+                time.sleep(1)  # Prevent tight loop on repeated errors
+
+    def _notify(self, status, path, **details):
+        for listener in self.listeners:
+            try:
+                listener(status, path, **details)
+            except Exception as e:
+                print(f"Error in upload listener: {e}")
+
+    def stop(self):
+        """Stop the upload queue processor"""
+        self.is_running = False
+        with self.wakeup:
+            self.wakeup.notify_all()
+        for thread in self.upload_threads:
+            thread.join()
+        self.journal.close()
+
+
+class GoogleDriveUploader:
+    def __init__(self, credentials_path='credentials.json', folder_id=None, scheduler=None):
+        """
+        Initialize Google Drive uploader with service account credentials.
+
+        The credentials and API client are built once and shared by all upload
+        threads; each thread only gets its own authorized HTTP connection, since
+        httplib2 connections are not thread-safe.
+
+        Args:
+            service_account_path (str): Path to the service account JSON file
+            folder_id (str): Optional Google Drive folder ID to upload to
+            scheduler (UploadScheduler): Sends the file in its chunk size at its rate; set by UploadQueue
+        """
+        self.SCOPES = ['https://www.googleapis.com/auth/drive.file']
+        self.service_account_path = credentials_path
+        self.folder_id = folder_id
+        self.scheduler = scheduler
+        self.service = None
+        self.credentials = None
+        self._auth_lock = threading.Lock()
+        self._local = threading.local()
+
+    def authenticate(self):
+        """Authenticate with Google Drive API using service account."""
+        with self._auth_lock:
+            if self.service:
+                return
+            # The Drive client takes a noticeable share of start-up to import, so wait for the first upload
+            from google.oauth2 import service_account
+            from googleapiclient.discovery import build
+
+            self.credentials = service_account.Credentials.from_service_account_file(
+                self.service_account_path,
+                scopes=self.SCOPES
+            )
+            self.service = build('drive', 'v3', credentials=self.credentials, cache_discovery=False)
+
+    def _http(self):
+        """Return this thread's authorized HTTP connection."""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            import google_auth_httplib2
+            import httplib2
+
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def create_folder(self, folder_name):
+        """
+        Create a new folder in Google Drive.
+
+        Args:
+            folder_name (str): Name of the folder to create
+
+        Returns:
+            str: ID of the created folder
+        """
+        if not self.service:
+            self.authenticate()
+
+        folder_metadata = {
+            'name': folder_name,
+            'mimeType': 'application/vnd.google-apps.folder'
+        }
+
+        folder = self.service.files().create(
+            body=folder_metadata,
+            fields='id'
+        ).execute(http=self._http())
+
+        return folder.get('id')
+
+    def upload_file(self, file_path, folder_id=None):
+        """
+        Upload a file to Google Drive.
+
+        Args:
+            file_path (str): Path to the file to upload
+            folder_id (str): Optional folder ID to upload to (overrides instance folder_id)
+
+        Returns:
+            dict: File metadata from Google Drive
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        if not self.service:
+            self.authenticate()
+
+        target_folder = folder_id or self.folder_id
+        file_name = os.path.basename(file_path)
+
+        file_metadata = {
+            'name': file_name
+        }
+
+        if target_folder:
+            file_metadata['parents'] = [target_folder]
+
+        from googleapiclient.http import DEFAULT_CHUNK_SIZE, MediaFileUpload
+
+        chunk_size = self.scheduler.chunk_size if self.scheduler else DEFAULT_CHUNK_SIZE
+        media = MediaFileUpload(
+            file_path,
+            mimetype=guess_mime_type(file_path),
+            chunksize=chunk_size,
+            resumable=True
+        )
+
+        request = self.service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id, name, webViewLink'
+        )
+        if self.scheduler is None:
+            return request.execute(http=self._http())
+
+        size = os.path.getsize(file_path)
+        sent, file = 0, None
+        while file is None:
+            # Each next_chunk() call sends one chunk of the resumable upload
+            self.scheduler.throttle(max(1, min(chunk_size, size - sent)))
+            status, file = request.next_chunk(http=self._http())
+            if status is not None:
+                sent = status.resumable_progress
+        return file
+
+
+class _MultipartFile(io.RawIOBase):
+    """
+    A ``multipart/form-data`` body with one file field, read lazily from disk.
+
+    Each ``chunk_size`` bytes are paid for at the scheduler before any of them
+    is handed to the socket, so the upload goes at the scheduler's rate. It has
+    a length, which lets requests send it with a Content-Length instead of
+    chunked encoding.
+    """
+
+    def __init__(self, file_path, scheduler, field='file'):
+        boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+                f'filename="{os.path.basename(file_path)}"\r\n'
+                f'Content-Type: {guess_mime_type(file_path)}\r\n\r\n').encode()
+        tail = f'\r\n--{boundary}--\r\n'.encode()
+        self.length = len(head) + os.path.getsize(file_path) + len(tail)
+        self.file = open(file_path, 'rb')
+        self.parts = [io.BytesIO(head), self.file, io.BytesIO(tail)]
+        self.scheduler = scheduler
+        self.position = 0
+        self.paid = 0
+
+    def __len__(self):
+        return self.length
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        # requests works out the Content-Length as len() minus tell()
+        return self.position
+
+    def read(self, size=-1):
+        size = self.length if size is None or size < 0 else size
+        data = b''
+        while self.parts and len(data) < size:
+            block = self.parts[0].read(size - len(data))
+            if not block:
+                self.parts.pop(0)
+                continue
+            data += block
+        self.position += len(data)
+        while self.paid < self.position:
+            amount = min(self.scheduler.chunk_size, self.length - self.paid)
+            self.scheduler.throttle(amount)
+            self.paid += amount
+        return data
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class HttpUploader:
+    """
+    Uploads files as multipart POSTs to a plain HTTP endpoint.
+
+    Used with a local stand-in server to exercise the queue without Drive; the
+    endpoint is expected to answer with a JSON object containing at least ``id``.
+    """
+
+    def __init__(self, url, timeout=30, scheduler=None):
+        """
+        Args:
+            url (str): Endpoint receiving the POSTs
+            timeout (float): Seconds to wait for the connection and each response read
+            scheduler (UploadScheduler): Paces the request body; set by UploadQueue
+        """
+        self.url = url
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def upload_file(self, file_path):
+        file_name = os.path.basename(file_path)
+        if self.scheduler is None:
+            with open(file_path, 'rb') as f:
+                response = self._session().post(
+                    self.url,
+                    files={'file': (file_name, f, guess_mime_type(file_path))},
+                    timeout=self.timeout
+                )
+        else:
+            with _MultipartFile(file_path, self.scheduler) as body:
+                response = self._session().post(
+                    self.url,
+                    data=body,
+                    headers={'Content-Type': body.content_type},
+                    timeout=self.timeout
+                )
+        response.raise_for_status()
+        file = response.json()
+        file.setdefault('name', file_name)
+        return file
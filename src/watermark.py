@@ -0,0 +1,159 @@
+import hashlib
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+
+class Watermark:
+    """
+    Premultiplied watermark that is composited onto the bottom band of a frame.
+
+    The RGBA source is scaled once, its alpha is multiplied by ``opacity`` and the
+    colour channels are premultiplied, so compositing a shot is a single
+    ``band * (255 - a) / 255 + premultiplied`` pass over the covered rows only.
+    The prepared arrays are cached on disk keyed by the source PNG's hash and the
+    target size, so restarts skip the preparation entirely.
+    """
+
+    CACHE_VERSION = 1
+
+    def __init__(self, path, frame_size=(1080, 1350), opacity=0.70, bottom_margin=100, cache_dir=None):
+        """
+        Args:
+            path (str): Path to the RGBA watermark PNG
+            frame_size (tuple): (width, height) of the frames the watermark is applied to
+            opacity (float): Multiplier applied to the watermark's own alpha channel
+            bottom_margin (int): Distance in pixels between the watermark and the bottom edge
+            cache_dir (str): Optional directory for the prepared watermark cache
+        """
+        self.path = path
+        self.frame_size = frame_size
+        self.opacity = opacity
+        self.bottom_margin = bottom_margin
+        self.cache_dir = cache_dir
+
+        with open(path, 'rb') as f:
+            source = f.read()
+        self.source_hash = hashlib.sha256(source).hexdigest()
+
+        arrays = self._load_cached()
+        if arrays is None:
+            arrays = self._prepare(source)
+            self._store_cached(arrays)
+        self.premultiplied, self.inverse_alpha = arrays
+
+        height, width = self.inverse_alpha.shape
+        self.size = (width, height)
+        self.position = (0, frame_size[1] - height - bottom_margin)
+
+    @property
+    def cache_path(self):
+        if not self.cache_dir:
+            return None
+        width, height = self.frame_size
+        key = (f"watermark_{self.source_hash[:16]}_{width}x{height}"
+               f"_o{int(self.opacity * 1000)}_v{self.CACHE_VERSION}.npz")
+        return os.path.join(self.cache_dir, key)
+
+    def _load_cached(self):
+        path = self.cache_path
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return data['premultiplied'], data['inverse_alpha']
+        except Exception as e:
+            print(f"Ignoring unreadable watermark cache {path}: {e}")
+            return None
+
+    def _store_cached(self, arrays):
+        path = self.cache_path
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, premultiplied=arrays[0], inverse_alpha=arrays[1])
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write watermark cache {path}: {e}")
+
+    def _prepare(self, source):
+        """Scale the watermark to the frame width and build the premultiplied arrays."""
+        with Image.open(io.BytesIO(source)) as watermark:
+            watermark = watermark.convert('RGBA')
+
+            original_width, original_height = watermark.size
+            target_width = self.frame_size[0]
+
+            # Only scale if original width is larger than target
+            if original_width > target_width:
+                scale_factor = target_width / original_width
+                target_height = int(original_height * scale_factor)
+                watermark = watermark.resize((target_width, target_height), Image.Resampling.LANCZOS)
+
+            rgba = np.asarray(watermark, dtype=np.float32)
+
+        alpha = np.floor(rgba[..., 3] * self.opacity)
+        premultiplied = np.rint(rgba[..., :3] * (alpha[..., None] / 255.0)).astype(np.uint8)
+        inverse_alpha = (255 - alpha).astype(np.uint8)
+        return premultiplied, inverse_alpha
+
+    def _band(self, frame_width, frame_height):
+        """Return the (frame box, watermark box) slices clipped to the frame."""
+        x, y = self.position
+        width, height = self.size
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, frame_width), min(y + height, frame_height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (x0, y0, x1, y1), (x0 - x, y0 - y, x1 - x, y1 - y)
+
+    def _composite(self, band, watermark_box):
+        """Blend the watermark slice ``watermark_box`` into ``band`` in place."""
+        wx0, wy0, wx1, wy1 = watermark_box
+        blended = band.astype(np.uint16)
+        blended *= self.inverse_alpha[wy0:wy1, wx0:wx1, None]
+        # Exact rounded division by 255 for values up to 255 * 255
+        blended += 128
+        blended += blended >> 8
+        blended >>= 8
+        blended += self.premultiplied[wy0:wy1, wx0:wx1]
+        np.minimum(blended, 255, out=blended)
+        band[...] = blended
+
+    def apply_array(self, frame):
+        """
+        Composite the watermark in place onto an RGB(X) ``uint8`` array.
+
+        Only the rows and columns covered by the watermark are read and written.
+        Any channels past the first three (e.g. the X of XBGR8888) are left alone.
+        """
+        boxes = self._band(frame.shape[1], frame.shape[0])
+        if boxes is not None:
+            (x0, y0, x1, y1), watermark_box = boxes
+            self._composite(frame[y0:y1, x0:x1, :3], watermark_box)
+        return frame
+
+    def apply(self, img):
+        """
+        Composite the watermark onto a PIL image, touching only the covered band.
+
+        RGB images are modified in place; other modes are converted to RGB first.
+
+        Returns:
+            PIL.Image.Image: The watermarked RGB image
+        """
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        boxes = self._band(*img.size)
+        if boxes is None:
+            return img
+        box, watermark_box = boxes
+        band = np.array(img.crop(box))
+        self._composite(band, watermark_box)
+        img.paste(Image.fromarray(band), box[:2])
+        return img
@@ -1,19 +1,32 @@
-from flask import Flask, render_template, send_from_directory
-import os
+from flask import Flask, abort, render_template, send_file
+
+from src.photo_index import PhotoIndex
+from src.storage import CaptureStorage
 
 class WebServer:
     def __init__(self, capture_dir):
         self.app = Flask(__name__, static_folder='static')
         self.capture_dir = capture_dir
+        self.storage = CaptureStorage(capture_dir)
+        self.photo_index = PhotoIndex(self.storage)
+        # Plain static URLs; the asset pipeline is wired up in app.py
+        self.app.jinja_env.globals['asset_url'] = lambda path: f"/static/{path}"
 
         @self.app.route('/')
         def index():
-            photos = sorted([f for f in os.listdir(self.capture_dir) if f.endswith('.jpg')], reverse=True)
+            self.photo_index.refresh_if_changed()
+            photos = [r.filename for r in self.photo_index.latest(3)]
             return render_template('index.html', photos=photos)
 
         @self.app.route('/captures/<path:filename>')
         def serve_photo(filename):
-            return send_from_directory(self.capture_dir, filename)
+            path = self.storage.resolve(filename)
+            if path is None:
+                self.photo_index.refresh_if_changed()
+                path = self.storage.resolve(filename)
+            if path is None:
+                abort(404)
+            return send_file(path)
 
     def run(self, port):
         self.app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,71 @@
+// Guest gallery: follows /feed and adds each new photo as it arrives, instead of reloading the page
+const GALLERY = {
+    feedUrl: '/feed',
+    maxPhotos: 200,
+};
+
+class Gallery {
+    constructor() {
+        this.grid = document.getElementById('galleryGrid');
+        this.status = document.getElementById('feedStatus');
+        this.emptyMessage = document.getElementById('noPhotosMessage');
+        this.shown = new Set();
+        this.initialized = false;
+    }
+
+    connect() {
+        // EventSource sends Last-Event-ID when it reconnects, so only missed photos are replayed
+        const source = new EventSource(GALLERY.feedUrl);
+        source.addEventListener('photo', (event) => this.addPhoto(JSON.parse(event.data)));
+        source.addEventListener('open', () => this.setStatus('Live', true));
+        source.addEventListener('error', () => this.setStatus('Reconnecting…', false));
+        // The catch-up arrives in one burst; only later photos get the entrance animation
+        setTimeout(() => { this.initialized = true; }, 1000);
+    }
+
+    setStatus(text, live) {
+        this.status.textContent = text;
+        this.status.classList.toggle('live', live);
+    }
+
+    addPhoto(photo) {
+        if (this.shown.has(photo.id)) {
+            return;
+        }
+        this.shown.add(photo.id);
+        if (this.emptyMessage) {
+            this.emptyMessage.remove();
+            this.emptyMessage = null;
+        }
+
+        const link = document.createElement('a');
+        link.href = photo.url;
+        link.dataset.id = photo.id;
+        if (this.initialized) {
+            link.classList.add('new');
+        }
+        const img = document.createElement('img');
+        img.src = photo.thumbnail;
+        img.alt = photo.filename;
+        img.loading = 'lazy';
+        // Known dimensions reserve the space, so the grid doesn't jump while thumbnails load
+        if (photo.width && photo.height) {
+            img.width = photo.width;
+            img.height = photo.height;
+        }
+        link.appendChild(img);
+
+        // Newest first; catch-up and out-of-order photos are slotted in by id
+        const next = Array.from(this.grid.children).find((child) => Number(child.dataset.id) < photo.id);
+        this.grid.insertBefore(link, next || null);
+
+        while (this.grid.children.length > GALLERY.maxPhotos) {
+            this.shown.delete(Number(this.grid.lastElementChild.dataset.id));
+            this.grid.lastElementChild.remove();
+        }
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    new Gallery().connect();
+});
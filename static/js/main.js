@@ -26,7 +26,11 @@ const CONFIG = {
         frameSequence: [0, 1]
     },
     photoReel: {
-        maxPhotos: 3
+        maxPhotos: 3,
+        thumbnailWidth: 320
+    },
+    preview: {
+        readyPollInterval: 1000 // How often to ask /readyz while the camera is still starting
     }
 };
 
@@ -137,9 +141,9 @@ class PhotoReel {
         }
 
         const newImg = document.createElement('img');
-        newImg.src = `/captures/${filename}`;
+        newImg.src = `/captures/${filename}?w=${CONFIG.photoReel.thumbnailWidth}`;
         newImg.alt = filename;
-        newImg.onclick = () => window.open(newImg.src, '_blank');
+        newImg.onclick = () => window.open(`/captures/${filename}`, '_blank');
 
         this.reelElement.insertBefore(newImg, this.reelElement.firstChild);
         
@@ -154,6 +158,33 @@ class PreviewDisplay {
         this.previewStream = previewStream;
         this.latestPhoto = latestPhoto;
         this.overlayLayer = overlayLayer;
+        this.reconnecting = false;
+
+        // The page can load before the camera is up; /video_feed answers 503 until then
+        this.previewStream.addEventListener('error', () => this.reconnectWhenReady());
+    }
+
+    async reconnectWhenReady() {
+        if (this.reconnecting) {
+            return;
+        }
+        this.reconnecting = true;
+        try {
+            while (true) {
+                try {
+                    const response = await fetch('/readyz', { cache: 'no-store' });
+                    if (response.ok) {
+                        break;
+                    }
+                } catch (error) {
+                    // Server not reachable yet
+                }
+                await new Promise(resolve => setTimeout(resolve, CONFIG.preview.readyPollInterval));
+            }
+            this.previewStream.src = `/video_feed?t=${Date.now()}`;
+        } finally {
+            this.reconnecting = false;
+        }
     }
 
     showLatestPhoto(filename) {        
@@ -715,26 +746,19 @@ class CountdownManager {
         });
     }
 
-    async startTripleCapture() {
+    async prepare() {
         // Ensure all images are loaded
         await Promise.all([
             ...this.images.map(img => ImageLoader.load(img)),
             ImageLoader.load(this.scoreImage)
         ]);
-        
-        // Show countdown numbers
-        for (let i = this.images.length - 1; i >= 0; i--) {
-            await this.showNumber(this.images[i]);
-        }
-    
-        this.hideArrows();
-    
-        // Three flashes with 1-second delay between them
-        for (let i = 0; i < 3; i++) {
-            if (i > 0) {
-                await new Promise(resolve => setTimeout(resolve, 1000));
-            }
-            await this.flashScreen();
+    }
+
+    // Called for each countdown event from the server, so the numbers match the LEDs
+    showTick(remaining) {
+        const image = this.images[remaining - 1];
+        if (image) {
+            this.showNumber(image);
         }
     }
 
@@ -901,25 +925,63 @@ class CameraApp {
     }
 
 
-    async capturePhoto3() {
-        try {
-            const response = await fetch('/capture_3', { method: 'POST' });
-            const data = await response.json();
-            
-            if (data.status !== 'success') {
-                throw new Error('Failed to capture images');
-            }
-            
-            // Add all photos to the reel without previewing
-            data.filenames.forEach(filename => {
-                this.photoReel.addPhoto(filename);
-            });
-            
-            return data;
-        } catch (error) {
-            console.error('Capture error:', error);
-            throw error;
+    async startCaptureJob(kind = 'burst') {
+        const response = await fetch('/jobs', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ kind })
+        });
+        const job = await response.json();
+        if (response.status === 429) {
+            throw new Error('The booth is busy, try again in a moment.');
+        }
+        if (!response.ok) {
+            throw new Error(job.message || 'Failed to start capture');
         }
+        return job;
+    }
+
+    // Drive the overlay from the job's server-sent events instead of fixed timeouts
+    followCaptureJob(job) {
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(job.events);
+            let arrowsHidden = false;
+            const payload = e => JSON.parse(e.data).data;
+
+            events.addEventListener('countdown', e => {
+                this.countdown.showTick(payload(e).remaining);
+            });
+            events.addEventListener('shutter', () => {
+                if (!arrowsHidden) {
+                    this.countdown.hideArrows();
+                    arrowsHidden = true;
+                }
+                this.countdown.flashScreen();
+            });
+            events.addEventListener('done', e => {
+                events.close();
+                const data = payload(e);
+                // Add all photos to the reel without previewing
+                data.filenames.forEach(filename => {
+                    this.photoReel.addPhoto(filename);
+                });
+                // The strip is composed in the background; its URL waits until it is ready
+                if (data.collages && data.collages.length) {
+                    this.previewDisplay.showLatestPhoto(data.collages[0]);
+                }
+                resolve(data);
+            });
+            events.addEventListener('failed', e => {
+                events.close();
+                reject(new Error(payload(e).error || 'Failed to capture images'));
+            });
+            events.onerror = () => {
+                // EventSource reconnects by itself unless the server refused the stream
+                if (events.readyState === EventSource.CLOSED) {
+                    reject(new Error('Lost connection to the capture job'));
+                }
+            };
+        });
     }
 
     async handleCapture() {
@@ -927,11 +989,9 @@ class CameraApp {
         captureBtn.disabled = true;
         
         try {
-            // Start both processes concurrently
-            const [captureResult] = await Promise.all([
-                this.capturePhoto3(),
-                this.countdown.startTripleCapture()
-            ]);
+            await this.countdown.prepare();
+            const job = await this.startCaptureJob('burst');
+            await this.followCaptureJob(job);
             
             // Show final score after capture completes
             await this.countdown.showFinalScore();
@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+import types
+
+import pytest
+
+# Make `app` and `src` importable when pytest is run from anywhere
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+
+@pytest.fixture
+def gallery(tmp_path):
+    """The parts of a camera system the gallery routes use, over an empty captures directory."""
+    from src.photo_index import PhotoIndex
+    from src.storage import CaptureStorage
+
+    storage = CaptureStorage(str(tmp_path / 'captures'))
+    system = types.SimpleNamespace(storage=storage, photo_index=PhotoIndex(storage))
+    yield system
+    storage.stop()
+
+
+async def asgi_request(asgi_app, method, path, query=''):
+    """Run one request through an ASGI app. Returns (status, decoded JSON body or raw bytes)."""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    # spec_version 2.4 tells Starlette not to listen for a disconnect while it sends a file
+    scope = {'type': 'http', 'asgi': {'version': '3.0', 'spec_version': '2.4'}, 'http_version': '1.1',
+             'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+             'query_string': query.encode(), 'root_path': '', 'headers': [],
+             'client': ('127.0.0.1', 1234), 'server': ('127.0.0.1', 80)}
+    await asgi_app(scope, receive, send)
+    start = next(m for m in messages if m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+    content_type = dict(start['headers']).get(b'content-type', b'')
+    return start['status'], json.loads(body) if content_type.startswith(b'application/json') else body
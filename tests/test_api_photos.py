@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from conftest import asgi_request
+
+
+def asgi_get(asgi_app, path, query=''):
+    return asyncio.run(asgi_request(asgi_app, 'GET', path, query))
+
+
+@pytest.fixture
+def flask_client(gallery, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'camera_system', gallery)
+    return app.app.test_client()
+
+
+@pytest.fixture
+def asgi_app(gallery):
+    import app
+    from src.asgi_app import create_asgi_app
+
+    return create_asgi_app(lambda: gallery, app.BASE_DIR)
+
+
+@pytest.mark.parametrize('query', ['cursor=abc', 'cursor=', 'limit=x'])
+def test_flask_rejects_malformed_paging(flask_client, query):
+    response = flask_client.get(f"/api/photos?{query}")
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid cursor or limit'
+
+
+@pytest.mark.parametrize('query', ['cursor=abc', 'cursor=', 'limit=x'])
+def test_asgi_rejects_malformed_paging(asgi_app, query):
+    status, body = asgi_get(asgi_app, '/api/photos', query)
+    assert status == 400
+    assert body['message'] == 'Invalid cursor or limit'
+
+
+@pytest.fixture
+def photos(gallery):
+    """Seven photos numbered 1-7 in the index."""
+    from PIL import Image
+
+    for number in range(1, 8):
+        path = gallery.storage.path_for(f"photo_{number}.jpg")
+        Image.new('RGB', (40, 50), (number * 30, 0, 0)).save(path, 'JPEG')
+        gallery.storage.add(path)
+        gallery.photo_index.add(path)
+    return gallery
+
+
+def _pages(get, limit):
+    """Follow next_cursor from the newest page to the last. Returns the responses."""
+    pages, cursor = [], None
+    while True:
+        query = f"limit={limit}" + (f"&cursor={cursor}" if cursor is not None else '')
+        body = get(query)
+        pages.append(body)
+        cursor = body['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def test_both_modes_page_the_same(photos, flask_client, asgi_app):
+    flask_pages = _pages(lambda query: flask_client.get(f"/api/photos?{query}").get_json(), limit=3)
+    asgi_pages = _pages(lambda query: asgi_get(asgi_app, '/api/photos', query)[1], limit=3)
+
+    assert flask_pages == asgi_pages
+    assert [[p['id'] for p in page['photos']] for page in flask_pages] == [[7, 6, 5], [4, 3, 2], [1]]
+    assert [page['next_cursor'] for page in flask_pages] == [5, 2, None]
+    assert {page['total'] for page in flask_pages} == {7}
+
+
+def test_both_modes_page_from_a_cursor(photos, flask_client, asgi_app):
+    flask_body = flask_client.get('/api/photos?cursor=4&limit=2').get_json()
+    status, asgi_body = asgi_get(asgi_app, '/api/photos', 'cursor=4&limit=2')
+    assert status == 200
+    assert flask_body == asgi_body
+    assert [p['id'] for p in flask_body['photos']] == [3, 2]
+    assert flask_body['next_cursor'] == 2
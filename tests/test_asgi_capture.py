@@ -0,0 +1,62 @@
+import asyncio
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from conftest import asgi_request
+from src.derivatives import DerivativeCache
+from src.jobs import CaptureJobQueue
+
+CAPTURE_SECONDS = 1.0
+
+
+class SlowCamera:
+    """Takes CAPTURE_SECONDS per photo, like a countdown would."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.file_listeners = []
+        self.last_collages = []
+        self.count = 100
+
+    def capture_image(self, progress=None):
+        time.sleep(CAPTURE_SECONDS)
+        self.count += 1
+        return self.storage.path_for(f"photo_{self.count}.jpg")
+
+
+@pytest.fixture
+def booth(gallery, tmp_path):
+    path = gallery.storage.path_for('photo_1.jpg')
+    Image.new('RGB', (640, 800), (200, 120, 40)).save(path, 'JPEG')
+    gallery.storage.add(path)
+    gallery.photo_index.add(path)
+    gallery.derivatives = DerivativeCache(gallery.storage.resolve, str(tmp_path / 'derivatives'))
+    gallery.wait_for_photo = lambda name, timeout=3.0: True
+    gallery.jobs = CaptureJobQueue(SlowCamera(gallery.storage), max_queued=2)
+    yield gallery
+    gallery.jobs.stop()
+
+
+def test_gallery_requests_do_not_wait_behind_captures(booth):
+    import app
+    from src.asgi_app import create_asgi_app
+
+    asgi_app = create_asgi_app(lambda: booth, app.BASE_DIR, capture_workers=2, io_workers=2)
+
+    async def scenario():
+        captures = [asyncio.create_task(asgi_request(asgi_app, 'POST', '/capture')) for _ in range(2)]
+        await asyncio.sleep(0.2)
+        start = time.perf_counter()
+        thumbnail = await asgi_request(asgi_app, 'GET', '/captures/photo_1.jpg', 'w=160')
+        page = await asgi_request(asgi_app, 'GET', '/api/photos')
+        gallery_seconds = time.perf_counter() - start
+        return thumbnail, page, gallery_seconds, await asyncio.gather(*captures)
+
+    thumbnail, page, gallery_seconds, captures = asyncio.run(scenario())
+    assert thumbnail[0] == 200 and page[0] == 200
+    # Both captures are still running; the old executor had both its threads waiting on them
+    assert gallery_seconds < CAPTURE_SECONDS / 2
+    assert sorted(body['filename'] for status, body in captures) == ['photo_101.jpg', 'photo_102.jpg']
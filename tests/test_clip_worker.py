@@ -0,0 +1,31 @@
+import subprocess
+import sys
+import textwrap
+
+from conftest import BASE_DIR
+
+SCRIPT = textwrap.dedent('''
+    import multiprocessing
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+
+    sys.path.insert(0, {base_dir!r})
+    print('main script ran as', __name__, flush=True)
+
+    if __name__ == '__main__':
+        from src.clip_worker import use_as_spawn_main
+
+        use_as_spawn_main()
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            # Evaluated in the worker
+            main = pool.submit(eval, "__import__('sys').modules['__main__'].__file__").result()
+        print('worker main is', main.replace(sys.path[0], '').lstrip('/'), flush=True)
+''')
+
+
+def test_spawned_worker_does_not_rerun_the_main_script(tmp_path):
+    script = tmp_path / 'booth.py'
+    script.write_text(SCRIPT.format(base_dir=BASE_DIR))
+    output = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=60,
+                            cwd=tmp_path).stdout.splitlines()
+    assert output == ['main script ran as __main__', 'worker main is src/clip_worker.py']
@@ -0,0 +1,55 @@
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+from src.derivatives import DerivativeCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    photo = tmp_path / 'photo_1.jpg'
+    Image.new('RGB', (1080, 1350), (10, 120, 200)).save(photo, 'JPEG')
+    return DerivativeCache(lambda name: str(tmp_path / name), str(tmp_path / 'derivatives'))
+
+
+def test_concurrent_requests_generate_a_variant_once(cache, monkeypatch):
+    writes = []
+    write = cache._write
+    release = threading.Event()
+
+    def slow_write(*args):
+        writes.append(args[1])
+        release.wait(5)
+        write(*args)
+
+    monkeypatch.setattr(cache, '_write', slow_write)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('photo_1.jpg', 320))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # Let every request reach the variant's lock before the first write finishes
+    while sum(entry[1] for entry in cache.key_locks.values()) < 4:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(writes) == 1
+    assert len({path for path, _, _ in results}) == 1 and len(results) == 4
+    assert cache.key_locks == {}
+
+
+def test_failed_generation_leaves_no_lock_or_temp_file(cache, monkeypatch):
+    def broken_save(self, fp, *args, **kwargs):
+        with open(fp, 'wb') as f:
+            f.write(b'half a jpeg')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(Image.Image, 'save', broken_save)
+    with pytest.raises(OSError):
+        cache.get('photo_1.jpg', 320)
+
+    assert cache.key_locks == {}
+    assert os.listdir(cache.cache_dir) == []
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+import pytest
+from PIL import Image
+
+from src.feed import PhotoFeed
+
+
+@pytest.fixture
+def booth(gallery):
+    def take(number):
+        path = gallery.storage.path_for(f"photo_{number}.jpg")
+        Image.new('RGB', (64, 80), (number, 0, 0)).save(path, 'JPEG')
+        gallery.storage.add(path)
+        return gallery.photo_index.add(path)
+
+    gallery.take = take
+    gallery.feed = PhotoFeed(gallery.photo_index, history=4)
+    return gallery
+
+
+def _numbers(events):
+    numbers = [int(event.split('\n', 1)[0][len('id: '):]) for event in events]
+    for event, number in zip(events, numbers):
+        assert json.loads(event.split('data: ', 1)[1])['filename'] == f"photo_{number}.jpg"
+    return numbers
+
+
+def test_catch_up_sends_only_photos_after_since(booth):
+    for number in range(1, 6):
+        booth.take(number)
+    subscription = booth.feed.subscribe(since=3)
+    assert _numbers(subscription.next(timeout=0)) == [4, 5]
+    assert subscription.next(timeout=0) == []
+
+
+def test_photos_published_during_catch_up_are_delivered_once(booth):
+    booth.take(1)
+    # Indexed but not yet published, like a photo still on its way through on_complete
+    record = booth.take(2)
+    subscription = booth.feed.subscribe(since=0)
+    booth.feed.publish(record)
+    booth.feed.publish(booth.take(3))
+    assert _numbers(subscription.next(timeout=0)) == [1, 2]
+    assert _numbers(subscription.next(timeout=1)) == [3]
+    assert subscription.next(timeout=0) == []
+
+
+def test_subscriber_behind_the_log_catches_up_from_the_index(booth):
+    booth.feed.publish(booth.take(1))
+    subscription = booth.feed.subscribe(since=1)
+    for number in range(2, 9):
+        booth.feed.publish(booth.take(number))
+    # Only 5-8 are still in the log
+    assert _numbers(subscription.next(timeout=0)) == [2, 3, 4, 5, 6, 7, 8]
+    booth.feed.publish(booth.take(9))
+    assert _numbers(asyncio.run(subscription.next_async(timeout=1))) == [9]
+    subscription.close()
+    assert booth.feed.stats()['subscribers'] == 0
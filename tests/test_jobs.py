@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from src.jobs import CaptureJobQueue, JobQueueFull
+
+
+class GatedCamera:
+    """Holds each capture until ``release`` is set, then reports a shutter and the file's upload."""
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.file_listeners = []
+        self.last_collages = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.count = 0
+
+    def capture_image(self, progress=None):
+        self.started.set()
+        assert self.release.wait(5)
+        self.count += 1
+        path = str(self.tmp_path / f"photo_{self.count}.jpg")
+        progress('shutter', filename=path)
+        for listener in self.file_listeners:
+            listener('processed', path)
+            listener('uploaded', path)
+        return path
+
+
+@pytest.fixture
+def camera(tmp_path):
+    camera = GatedCamera(tmp_path)
+    yield camera
+    camera.release.set()
+
+
+def _queue(camera, policy):
+    queue = CaptureJobQueue(camera, max_queued=1, policy=policy)
+    running, _ = queue.submit('photo')
+    assert camera.started.wait(5)
+    return queue, running
+
+
+def test_full_queue_coalesces_into_a_waiting_job_of_the_same_kind(camera):
+    queue, running = _queue(camera, 'coalesce')
+    try:
+        waiting, coalesced = queue.submit('photo')
+        assert not coalesced
+        assert queue.submit('photo') == (waiting, True)
+        # Nothing of that kind is waiting to fold a burst into
+        with pytest.raises(JobQueueFull):
+            queue.submit('burst')
+        assert queue.stats()['queued'] == [waiting.id]
+        assert queue.stats()['running'] == running.id
+    finally:
+        camera.release.set()
+        queue.stop()
+
+
+def test_full_queue_rejects_under_reject_policy(camera):
+    queue, _ = _queue(camera, 'reject')
+    try:
+        queue.submit('photo')
+        with pytest.raises(JobQueueFull):
+            queue.submit('photo')
+    finally:
+        camera.release.set()
+        queue.stop()
+
+
+def test_events_replay_from_any_event_id(camera):
+    queue, job = _queue(camera, 'coalesce')
+    try:
+        camera.release.set()
+        assert job.finished.wait(5)
+        events, closed = job.events_since(0, timeout=5)
+        assert closed
+        assert [e['event'] for e in events] == ['queued', 'started', 'shutter', 'processed', 'uploaded', 'done']
+        assert [e['id'] for e in events] == list(range(1, 7))
+        # A client reconnecting after event 3 gets the rest, and nothing it has seen
+        assert job.events_since(3, timeout=0) == (events[3:], True)
+        assert events[2]['data'] == {'filename': 'photo_1.jpg'}
+        assert events[-1]['data']['filenames'] == ['photo_1.jpg']
+    finally:
+        queue.stop()
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from src.leds import FLASH_SECONDS, PixelAnimator
+from src.simulated import SimulatedHardware
+
+SHOT_INTERVAL = 0.6
+FLASH_SETTLE = 0.1
+
+
+@pytest.fixture
+def animator():
+    hardware = SimulatedHardware()
+    animator = PixelAnimator(8, hardware=hardware)
+    yield animator
+    animator.shutdown()
+
+
+def _lit_spans(history):
+    spans = []
+    lit_at = None
+    for t, frame in history:
+        if frame[0] == (255, 255, 255) and lit_at is None:
+            lit_at = t
+        elif frame[0] != (255, 255, 255) and lit_at is not None:
+            spans.append((lit_at, t))
+            lit_at = None
+    return spans
+
+
+def test_burst_flashes_play_in_full(animator):
+    # Like a burst: each shot schedules its flash right after the previous shutter, while that flash is still lit
+    start = time.perf_counter() + FLASH_SETTLE
+    for i in range(3):
+        flash_at = animator.start_animation('flash', at=start + i * SHOT_INTERVAL)
+        time.sleep(max(0.0, flash_at + FLASH_SETTLE - time.perf_counter()))
+    time.sleep(SHOT_INTERVAL)
+
+    spans = _lit_spans(animator.pixels.history)
+    assert len(spans) == 3
+    for i, (lit, dark) in enumerate(spans):
+        assert lit - (start + i * SHOT_INTERVAL) == pytest.approx(0, abs=0.03)
+        assert dark - lit == pytest.approx(FLASH_SECONDS, abs=0.03)
+
+
+def test_scheduled_flash_replaces_a_pulse_when_it_starts(animator):
+    animator.start_animation('pulse', 5, color=(0, 255, 0))
+    flash_at = animator.start_animation('flash', at=time.perf_counter() + 0.2)
+    time.sleep(0.1)
+    assert animator.current.name == 'pulse'
+    time.sleep(max(0.0, flash_at + 0.05 - time.perf_counter()))
+    assert animator.current.name == 'flash'
+    time.sleep(FLASH_SECONDS)
+    assert animator.current is None and animator.pixels[0] == (0, 0, 0)
@@ -0,0 +1,53 @@
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from src.postprocess import PostProcessor
+
+
+class PlainWatermark:
+    def apply(self, img):
+        return img.convert('RGB')
+
+
+def _jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 400), (90, 30, 160)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def processor():
+    processor = PostProcessor(PlainWatermark(), max_workers=1)
+    yield processor
+    processor.shutdown()
+
+
+def test_failed_write_leaves_no_part_file(tmp_path, processor, monkeypatch):
+    def full_disk(src, dst):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(os, 'replace', full_disk)
+    future = processor.submit(str(tmp_path / 'photo_1.jpg'), _jpeg())
+    with pytest.raises(OSError):
+        future.result(5)
+    assert os.listdir(tmp_path) == []
+
+
+def test_wait_for_returns_once_the_photo_is_in_storage(gallery):
+    def register(path):
+        # Slow enough that a waiter woken by the write alone would look the photo up too early
+        time.sleep(0.3)
+        gallery.storage.add(path)
+
+    processor = PostProcessor(PlainWatermark(), max_workers=1, on_complete=register)
+    try:
+        processor.submit(gallery.storage.path_for('photo_1.jpg'), _jpeg())
+        assert processor.wait_for('photo_1.jpg', 5)
+        assert gallery.storage.resolve('photo_1.jpg') is not None
+        assert not processor.is_pending('photo_1.jpg')
+    finally:
+        processor.shutdown()
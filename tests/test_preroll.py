@@ -0,0 +1,51 @@
+import threading
+import time
+
+import numpy as np
+
+import src.preroll
+from src.preroll import FrameRing
+
+SHAPE = (48, 64, 3)
+
+
+def _frame(sharp):
+    frame = np.zeros(SHAPE, dtype=np.uint8)
+    if sharp:
+        frame[:, ::4, 1] = 255
+    return frame
+
+
+def test_grab_takes_the_sharpest_frame_in_the_window():
+    ring = FrameRing(4, SHAPE)
+    for i, sharp in enumerate((False, True, False)):
+        ring.write(_frame(sharp), 100.0 + i * 0.1)
+    frame, timestamp = ring.grab(100.2, window=0.15, timeout=0)
+    assert timestamp == 100.1 and frame.any()
+    assert ring.grab(100.2)[1] == 100.2
+
+
+def test_camera_writes_are_not_held_up_while_frames_are_scored(monkeypatch):
+    ring = FrameRing(4, SHAPE)
+    for i in range(3):
+        ring.write(_frame(i == 1), 100.0 + i * 0.1)
+    scoring = threading.Event()
+    sharpness = src.preroll.sharpness
+
+    def slow_sharpness(frame):
+        scoring.set()
+        time.sleep(0.2)
+        return sharpness(frame)
+
+    monkeypatch.setattr(src.preroll, 'sharpness', slow_sharpness)
+    grabbed = []
+    grabber = threading.Thread(target=lambda: grabbed.append(ring.grab(100.1, window=0.15, timeout=0)))
+    grabber.start()
+    assert scoring.wait(5)
+    start = time.perf_counter()
+    ring.write(_frame(False), 100.3)
+    written = time.perf_counter() - start
+    grabber.join(5)
+
+    assert written < 0.1
+    assert grabbed[0][1] == 100.1 and grabbed[0][0].any()
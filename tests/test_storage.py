@@ -0,0 +1,80 @@
+import os
+import tarfile
+import time
+
+from src.storage import CaptureStorage, day_of, migrate_flat
+
+DAY = 86400
+
+
+def _write(storage, filename, when, size=1000):
+    path = storage.path_for(filename, when)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (when, when))
+    storage.add(path)
+    return path
+
+
+def test_added_capture_resolves_after_a_restart(tmp_path):
+    storage = CaptureStorage(str(tmp_path / 'captures'), event='Summer party!')
+    path = _write(storage, 'photo_7.jpg', time.time())
+    assert storage.resolve('photo_7.jpg') == path
+    assert os.path.dirname(path) == str(tmp_path / 'captures' / 'Summer-party' / day_of())
+    assert storage.resolve('../photo_7.jpg') is None
+    storage.stop()
+
+    reopened = CaptureStorage(str(tmp_path / 'captures'), event='Summer party!')
+    assert reopened.resolve('photo_7.jpg') == path
+    assert reopened.last_number == 7
+
+
+def test_flat_captures_resolve_before_and_after_migration(tmp_path):
+    root = tmp_path / 'captures'
+    root.mkdir()
+    old = time.time() - 3 * DAY
+    for name, when in (('photo_1.jpg', old), ('photo_2.jpg', old), ('photo_3.jpg', time.time())):
+        (root / name).write_bytes(b'x' * 100)
+        os.utime(root / name, (when, when))
+
+    before = CaptureStorage(str(root))
+    assert before.resolve('photo_1.jpg') == str(root / 'photo_1.jpg')
+    assert before.last_number == 3
+
+    moved = migrate_flat(str(root))
+    assert moved == {f"default/{day_of(old)}": 2, f"default/{day_of()}": 1}
+    after = CaptureStorage(str(root))
+    assert after.resolve('photo_1.jpg') == str(root / 'default' / day_of(old) / 'photo_1.jpg')
+    assert after.resolve('photo_3.jpg') == str(root / 'default' / day_of() / 'photo_3.jpg')
+    assert after.last_number == 3
+    # A second run finds nothing left to move
+    assert migrate_flat(str(root)) == {}
+
+
+def test_retention_archives_old_uploaded_shards_only(tmp_path):
+    storage = CaptureStorage(str(tmp_path / 'captures'), archive_dir=str(tmp_path / 'archive'), retention_bytes=2500)
+    now = time.time()
+    _write(storage, 'photo_1.jpg', now - 3 * DAY)
+    _write(storage, 'photo_2.jpg', now - 2 * DAY)
+    _write(storage, 'photo_3.jpg', now)
+    _write(storage, 'photo_4.jpg', now)
+    archived_files = []
+    storage.listeners.append(lambda event, filenames: archived_files.extend(filenames))
+    not_uploaded = storage.resolve('photo_1.jpg')
+
+    archived = storage.enforce_retention(lambda paths: not_uploaded not in paths, now=now)
+
+    # The oldest shard still has an upload outstanding, so the next one goes; today's never does
+    assert archived == [f"default/{day_of(now - 2 * DAY)}"]
+    assert archived_files == ['photo_2.jpg']
+    assert storage.resolve('photo_2.jpg') is None
+    assert storage.resolve('photo_1.jpg') == not_uploaded
+    with tarfile.open(tmp_path / 'archive' / 'default' / f"{day_of(now - 2 * DAY)}.tar.gz") as tar:
+        assert f"default/{day_of(now - 2 * DAY)}/photo_2.jpg" in tar.getnames()
+    assert storage.usage() == 3000 and storage.over_budget
+
+    # The archived shard stays archived, and its number is still taken, after a restart
+    reopened = CaptureStorage(str(tmp_path / 'captures'))
+    assert reopened.resolve('photo_2.jpg') is None
+    assert reopened.stats()['archived_shards'] == 1
+    assert reopened.last_number == 4
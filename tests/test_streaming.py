@@ -0,0 +1,13 @@
+import pytest
+
+from src.streaming import is_local
+
+
+@pytest.mark.parametrize('peer', [None, 'localhost', '127.0.0.1', '127.1.2.3', '::1', '::ffff:127.0.0.1'])
+def test_kiosk_peers_are_local(peer):
+    assert is_local(peer)
+
+
+@pytest.mark.parametrize('peer', ['192.168.1.20', '::ffff:192.168.1.20', 'fe80::1', 'kiosk.lan'])
+def test_other_peers_are_remote(peer):
+    assert not is_local(peer)
@@ -0,0 +1,146 @@
+import hashlib
+import time
+
+import pytest
+
+from src.sync import CaptureManifest, GalleryAggregator
+
+
+def _write(storage, name, data):
+    path = storage.path_for(name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    storage.add(path)
+    return path
+
+
+@pytest.fixture
+def manifest(gallery):
+    for i in range(3):
+        _write(gallery.storage, f"photo_{i}.jpg", f"photo {i}".encode())
+        time.sleep(0.01)
+    manifest = CaptureManifest(gallery.storage, 'booth-1')
+    manifest.build_thread.join(5)
+    return manifest
+
+
+def _names(page):
+    return [e['name'] for e in page['entries']]
+
+
+def test_manifest_pages_from_since_within_an_epoch(manifest):
+    page = manifest.changes(epoch=manifest.epoch, since=1)
+    assert _names(page) == ['photo_1.jpg', 'photo_2.jpg']
+    assert (page['version'], page['latest']) == (3, 3)
+    assert page['entries'][0]['sha256'] == hashlib.sha256(b'photo 1').hexdigest()
+    assert _names(manifest.changes(epoch=manifest.epoch, since=0, limit=2)) == ['photo_0.jpg', 'photo_1.jpg']
+
+
+def test_manifest_starts_over_for_another_epoch(manifest):
+    for epoch in (None, 'an-older-run'):
+        page = manifest.changes(epoch=epoch, since=2)
+        assert _names(page) == ['photo_0.jpg', 'photo_1.jpg', 'photo_2.jpg']
+        assert page['epoch'] == manifest.epoch
+
+
+def test_manifest_long_poll_returns_new_captures(gallery, manifest):
+    assert manifest.changes(epoch=manifest.epoch, since=3, timeout=0.1)['entries'] == []
+    path = _write(gallery.storage, 'photo_3.jpg', b'photo 3')
+    manifest.file_event('processed', path)
+    # Reported again, e.g. after a retried upload: not a new entry
+    manifest.file_event('processed', path)
+    page = manifest.changes(epoch=manifest.epoch, since=3, timeout=1)
+    assert _names(page) == ['photo_3.jpg'] and page['latest'] == 4
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b''):
+        self.status_code = status_code
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        yield self.body
+
+
+class FakeBooth:
+    """Serves /captures from ``files``; a name in ``statuses`` answers with the next status code queued there."""
+
+    def __init__(self):
+        self.files = {}
+        self.statuses = {}
+        self.requested = []
+
+    def get(self, url, stream=False, timeout=None):
+        name = url.rsplit('/', 1)[1]
+        self.requested.append(name)
+        if self.statuses.get(name):
+            return FakeResponse(self.statuses[name].pop(0))
+        if name not in self.files:
+            return FakeResponse(404)
+        return FakeResponse(200, self.files[name])
+
+    def entry(self, name, captured):
+        data = self.files[name]
+        return {'name': name, 'sha256': hashlib.sha256(data).hexdigest(), 'size': len(data), 'time': captured}
+
+
+@pytest.fixture
+def aggregator(tmp_path):
+    aggregator = GalleryAggregator(['http://booth-1'], str(tmp_path / 'captures'), transfers=2)
+    aggregator.started = 0
+    booth = FakeBooth()
+    aggregator.session = lambda: booth
+    aggregator.booth = booth
+    aggregator.follower = aggregator.followers[0]
+    aggregator.follower.booth = 'booth-1'
+    yield aggregator
+    aggregator.cleanup()
+
+
+def test_pull_skips_known_hashes(aggregator):
+    booth = aggregator.booth
+    booth.files = {'photo_1.jpg': b'one', 'photo_2.jpg': b'two'}
+    entries = [booth.entry('photo_1.jpg', 100.0), booth.entry('photo_2.jpg', 101.0)]
+    assert aggregator.pull(aggregator.follower, entries)
+    assert sorted(booth.requested) == ['photo_1.jpg', 'photo_2.jpg']
+    assert aggregator.photo_index.filenames() == ['photo_1.jpg', 'photo_0.jpg']
+
+    # The same captures again, e.g. after the booth restarted, plus the same photo under a new name
+    booth.requested.clear()
+    booth.files['photo_9.jpg'] = b'one'
+    assert aggregator.pull(aggregator.follower, entries + [booth.entry('photo_9.jpg', 102.0)])
+    assert booth.requested == []
+
+
+def test_pull_marks_a_capture_gone_from_the_booth_as_permanent(aggregator):
+    booth = aggregator.booth
+    booth.files = {'photo_1.jpg': b'one', 'photo_2.jpg': b'two'}
+    entries = [booth.entry('photo_1.jpg', 100.0), booth.entry('photo_2.jpg', 101.0)]
+    del booth.files['photo_2.jpg']
+    # Nothing to retry, so the follower moves on
+    assert aggregator.pull(aggregator.follower, entries)
+    assert aggregator.pull(aggregator.follower, entries)
+    assert booth.requested == ['photo_1.jpg', 'photo_2.jpg']
+    assert entries[1]['sha256'] in aggregator.journal.known_hashes()
+    # The number it had is free again
+    booth.files['photo_3.jpg'] = b'three'
+    assert aggregator.pull(aggregator.follower, [booth.entry('photo_3.jpg', 102.0)])
+    assert aggregator.photo_index.filenames() == ['photo_1.jpg', 'photo_0.jpg']
+
+
+def test_failed_transfer_is_retried_under_the_same_number(aggregator):
+    booth = aggregator.booth
+    booth.files = {'photo_1.jpg': b'one', 'photo_2.jpg': b'two', 'photo_3.jpg': b'three'}
+    entries = [booth.entry(name, 100.0 + i) for i, name in enumerate(sorted(booth.files))]
+    # Still being written on the booth the first time it is asked for
+    booth.statuses['photo_2.jpg'] = [202]
+    assert not aggregator.pull(aggregator.follower, entries)
+    assert aggregator.pull(aggregator.follower, entries)
+    assert aggregator.photo_index.filenames() == ['photo_2.jpg', 'photo_1.jpg', 'photo_0.jpg']
+    assert aggregator.reserved == {}
@@ -0,0 +1,64 @@
+import os
+import threading
+
+import pytest
+
+from src.uploads import UPLOAD_RESULTS, UploadQueue
+
+
+class RecordingUploader:
+    def __init__(self):
+        self.uploaded = []
+        self.done = threading.Event()
+
+    def upload_file(self, path):
+        self.uploaded.append(path)
+        self.done.set()
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        return {'id': str(len(self.uploaded))}
+
+
+@pytest.fixture
+def existing_capture(tmp_path):
+    path = tmp_path / 'photo_0.jpg'
+    path.write_bytes(b'taken before the journal existed')
+    return str(path)
+
+
+def test_existing_capture_is_uploaded_on_first_start(tmp_path, existing_capture):
+    uploader = RecordingUploader()
+    queue = UploadQueue(uploader, str(tmp_path / 'uploads.db'), workers=1)
+    try:
+        assert queue.journal.created
+        assert queue.reconcile([existing_capture]) == 1
+        assert uploader.done.wait(5)
+        assert uploader.uploaded == [existing_capture]
+    finally:
+        queue.stop()
+
+
+def test_existing_capture_recorded_as_done_when_assumed_uploaded(tmp_path, existing_capture):
+    uploader = RecordingUploader()
+    queue = UploadQueue(uploader, str(tmp_path / 'uploads.db'), workers=1)
+    try:
+        assert queue.reconcile([existing_capture], assume_uploaded=True) == 1
+        assert queue.journal.counts() == {'done': 1}
+        assert not uploader.done.wait(0.5)
+    finally:
+        queue.stop()
+
+
+def test_missing_file_is_counted_as_missing(tmp_path):
+    uploader = RecordingUploader()
+    queue = UploadQueue(uploader, str(tmp_path / 'uploads.db'), workers=1)
+    failed = threading.Event()
+    queue.listeners.append(lambda status, path, **details: status == 'upload_failed' and failed.set())
+    before = UPLOAD_RESULTS.values.get(('missing',), 0)
+    try:
+        queue.add_to_queue(str(tmp_path / 'photo_9.jpg'))
+        assert failed.wait(5)
+        assert UPLOAD_RESULTS.values.get(('missing',), 0) == before + 1
+        assert queue.journal.counts() == {'failed': 1}
+    finally:
+        queue.stop()